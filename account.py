@@ -0,0 +1,59 @@
+# ===============================================================================================================
+# Account snapshot
+# Positions and wallet balances fetched at most once per cycle and served from memory to every consumer
+# ===============================================================================================================
+
+class AccountSnapshot:
+    ''' Lazily loads private_get_positions / privateGetWalletBalances, call invalidate() each cycle and after fills '''
+
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self._positions = None
+        self._balances = None
+
+    def invalidate(self):
+        ''' Drop cached data, next access refetches '''
+        self._positions = None
+        self._balances = None
+
+    def load(self, positions=None, balances=None):
+        ''' Fill the snapshot from data fetched elsewhere, e.g. by an async client '''
+        if positions is not None:
+            self._positions = positions
+        if balances is not None:
+            self._balances = balances
+
+    def positions(self):
+        if self._positions is None:
+            self._positions = self.exchange.private_get_positions()['result']
+        return self._positions
+
+    def balances(self):
+        if self._balances is None:
+            self._balances = self.exchange.privateGetWalletBalances()['result']
+        return self._balances
+
+    def position(self, symbol):
+        ''' Raw FTX position dict of symbol, None if the account never traded it '''
+        for pos in self.positions():
+            if pos['future'] == symbol:
+                return pos
+        return None
+
+    def position_side(self, symbol):
+        ''' 1 long, -1 short, 0 flat, None if symbol is not in the positions list '''
+        pos = self.position(symbol)
+        if pos is None:
+            return None
+        netsize = float(pos['netSize'])
+        if netsize > 0:
+            return 1
+        elif netsize < 0:
+            return -1
+        return 0
+
+    def cash(self, coin='USD'):
+        for t in self.balances():
+            if t['coin'] == coin:
+                return float(t['availableWithoutBorrow'])
+        return None
@@ -0,0 +1,123 @@
+# ===============================================================================================================
+# Vectorized backtest and parameter sweep of the EMA-cross strategy
+# Same entry_exit_signals() the live bot uses, evaluated for every (fast, slow, sl, tp, risk) combination at once
+# ===============================================================================================================
+import argparse
+import itertools
+
+import numpy as np
+import pandas as pd
+import talib as ta
+
+from indicators import batch_volatility, entry_exit_signals
+
+def load_store(symbol, timeframe='1m', start=None, end=None, root='candles'):
+    ''' OHLCV from the local CandleStore, no network access '''
+    from candle_store import CandleStore
+    from candles import OHLCV_COLUMNS
+
+    rows = CandleStore(root).read(symbol, timeframe, start, end)
+    df = pd.DataFrame(np.asarray(rows), columns=OHLCV_COLUMNS)
+    df['timestamp'] = pd.to_datetime(df['timestamp'].astype('int64'), unit='ms')
+    return df.set_index('timestamp')
+
+def load_candles(path):
+    ''' OHLCV csv with timestamp in ms or as a date string '''
+    df = pd.read_csv(path)
+    if np.issubdtype(df['timestamp'].dtype, np.number):
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+    else:
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+    return df.set_index('timestamp')
+
+def pair_signals(close, fast_periods, slow_periods):
+    ''' Signals of every fast < slow pair, each a (pairs, bars) bool array built by broadcasting the EMA tables '''
+    fast_ema = np.vstack([ta.EMA(close, p) for p in fast_periods]) # (F, T)
+    slow_ema = np.vstack([ta.EMA(close, p) for p in slow_periods]) # (S, T)
+    fast_prev = np.full_like(fast_ema, np.nan)
+    fast_prev[:, 1:] = fast_ema[:, :-1]
+    with np.errstate(invalid='ignore'):
+        signals = entry_exit_signals(close[None, None, :], fast_ema[:, None, :], fast_prev[:, None, :], slow_ema[None, :, :])
+    pairs = [(i, j) for i, j in itertools.product(range(len(fast_periods)), range(len(slow_periods)))
+             if fast_periods[i] < slow_periods[j]]
+    fi, si = np.array([p[0] for p in pairs]), np.array([p[1] for p in pairs])
+    signals = [np.broadcast_to(s, (len(fast_periods), len(slow_periods), len(close)))[fi, si] for s in signals]
+    keys = [(fast_periods[i], slow_periods[j]) for i, j in pairs]
+    return keys, signals
+
+def run_sweep(df, fast_periods=(12,), slow_periods=(26,), sl_multiply=(1.2,), tp_multiply=(0.0,), riskpertrade=(0.0001,),
+              vol_window=30, vol_alpha=0.96, init_cash=10_000, fees=0.0007, freq='1min', size_limit=1.0, min_size=0.0001,
+              chunk=512):
+    ''' Backtest every parameter combination, return one row of stats per combination.
+        tp_multiply 0.0 means no take profit, as in the live bot (take_profit = 0.0).
+        Size is sized on init_cash rather than live cash because vectorbt cannot reverse percent-sized positions,
+        clamped to [min_size, size_limit] units like Cal_Size(). An opposite entry on the bar of an exit only
+        closes, trading() checks the exit first and stays flat '''
+    import vectorbt as vbt
+
+    close = df['close'].to_numpy(dtype=np.float64)
+    keys, (long_entries, long_exit, short_entries, short_exit) = pair_signals(close, list(fast_periods), list(slow_periods))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        vol_frac = batch_volatility(close, vol_window, vol_alpha) / close # stop distance per unit multiplier, as a fraction of price
+
+    combos = [(p, sl, tp, r) for p in range(len(keys)) for sl in sl_multiply for tp in tp_multiply for r in riskpertrade]
+    rows = []
+    for start in range(0, len(combos), chunk):
+        part = combos[start:start + chunk]
+        pidx = np.array([c[0] for c in part])
+        sl = np.array([c[1] for c in part])
+        tp = np.array([c[2] for c in part])
+        risk = np.array([c[3] for c in part])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sl_stop = vol_frac[:, None] * sl[None, :]
+            tp_stop = np.where(tp[None, :] > 0, vol_frac[:, None] * tp[None, :], np.nan)
+            units = np.clip(risk[None, :] * init_cash / (sl_stop * close[:, None]), min_size, size_limit) # Cal_Size(): risk * cash / sl_distance
+            size = np.minimum(units * close[:, None], init_cash) # as cash value
+        columns = pd.MultiIndex.from_tuples([keys[c[0]] + c[1:] for c in part], names=['fast', 'slow', 'sl_multiply', 'tp_multiply', 'riskpertrade'])
+        wrap = lambda a: pd.DataFrame(a, index=df.index, columns=columns)
+        pf = vbt.Portfolio.from_signals(
+            wrap(np.repeat(close[:, None], len(part), axis=1)),
+            entries=wrap(long_entries[pidx].T), exits=wrap(long_exit[pidx].T),
+            short_entries=wrap(short_entries[pidx].T), short_exits=wrap(short_exit[pidx].T),
+            size=wrap(size), size_type='value', sl_stop=wrap(sl_stop), tp_stop=wrap(tp_stop),
+            upon_opposite_entry='close', init_cash=init_cash, fees=fees, freq=freq,
+        )
+        rows.append(pd.DataFrame({
+            'total_return': pf.total_return(),
+            'sharpe_ratio': pf.sharpe_ratio(),
+            'max_drawdown': pf.max_drawdown(),
+            'trades': pf.trades.count(),
+            'win_rate': pf.trades.win_rate(),
+        }))
+    return pd.concat(rows)
+
+def rank_results(results, by='sharpe_ratio'):
+    return results.sort_values(by, ascending=False).reset_index()
+
+def main():
+    parser = argparse.ArgumentParser(description='Backtest and sweep the EMA-cross strategy on stored candles')
+    parser.add_argument('--csv', help='OHLCV csv file, instead of the local candle store')
+    parser.add_argument('--symbol', default='BTC-PERP')
+    parser.add_argument('--timeframe', default='1m')
+    parser.add_argument('--root', default='candles', help='candle store directory')
+    parser.add_argument('--fast', type=int, nargs='+', default=list(range(5, 31, 1)))
+    parser.add_argument('--slow', type=int, nargs='+', default=list(range(20, 81, 2)))
+    parser.add_argument('--sl', type=float, nargs='+', default=[0.8, 1.0, 1.2, 1.5, 2.0])
+    parser.add_argument('--tp', type=float, nargs='+', default=[0.0, 1.5, 2.0])
+    parser.add_argument('--risk', type=float, nargs='+', default=[0.0001, 0.001, 0.01])
+    parser.add_argument('--fees', type=float, default=0.0007)
+    parser.add_argument('--freq', default='1min')
+    parser.add_argument('--size-limit', type=float, default=1.0, help='robot_position_size_limit')
+    parser.add_argument('--min-size', type=float, default=0.0001, help='exchange minimum order size')
+    parser.add_argument('--out', default='backtest_results.csv')
+    args = parser.parse_args()
+
+    df = load_candles(args.csv) if args.csv else load_store(args.symbol, args.timeframe, root=args.root)
+    results = rank_results(run_sweep(df, args.fast, args.slow, args.sl, args.tp, args.risk, fees=args.fees, freq=args.freq,
+                                       size_limit=args.size_limit, min_size=args.min_size))
+    results.to_csv(args.out, index=False)
+    print(f'{len(results)} combinations on {len(df)} bars, saved {args.out}')
+    print(results.head(20).to_string())
+
+if __name__ == '__main__':
+    main()
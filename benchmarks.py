@@ -0,0 +1,205 @@
+# ===============================================================================================================
+# Benchmarks
+# Time and peak memory per call of the hot-path functions on synthetic candles and trades at growing sizes,
+# saved as JSON baselines so later runs can be compared against them
+# ===============================================================================================================
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from candle_store import CandleStore
+from candles import OHLCV_COLUMNS
+from indicators import IndicatorState
+from journal import TradeJournal
+from mock_exchange import MockFTX, load_bot, synthetic_candles
+from orders import aggregate_fills
+from records import Fill, Position, to_frame
+
+SIZES = (100, 1_000, 100_000, 1_000_000)
+
+def candle_frame(n):
+    df = pd.DataFrame(synthetic_candles(n), columns=OHLCV_COLUMNS)
+    df['timestamp'] = pd.to_datetime(df['timestamp'].astype('int64'), unit='ms')
+    return df
+
+def synthetic_fills(n, symbol='BTC-PERP', seed=3):
+    ''' ccxt-style trades of one order split into n partial fills '''
+    rng = np.random.default_rng(seed)
+    price = 40_000 + rng.normal(0, 5, n)
+    amount = rng.uniform(0.0001, 0.01, n)
+    return [{'symbol': symbol, 'timestamp': 1_600_000_000_000 + i, 'side': 'buy', 'price': p, 'amount': a, 'cost': p * a}
+            for i, (p, a) in enumerate(zip(price.tolist(), amount.tolist()))]
+
+def synthetic_trades(n, symbol='BTC-PERP', seed=5):
+    ''' n entry Positions and the exit Fills that close_trades() pairs them with '''
+    rng = np.random.default_rng(seed)
+    price = 40_000 + rng.normal(0, 200, n)
+    amount = rng.uniform(0.0001, 0.01, n)
+    exit_price = price + rng.normal(0, 50, n)
+    entries, exits = [], []
+    for i, (p, a, x) in enumerate(zip(price.tolist(), amount.tolist(), exit_price.tolist())):
+        ts = 1_600_000_000 + i * 60
+        entries.append(Position(symbol, ts, 'buy', p, a, p * a, stop_loss=p - 50))
+        exits.append(Fill(symbol, ts + 600, 'sell', x, a, x * a))
+    return entries, exits
+
+class Suite:
+    ''' One bot module bound to MockFTX, its journal in a scratch directory '''
+
+    def __init__(self, workdir=None):
+        self.workdir = workdir or tempfile.mkdtemp(prefix='bench_')
+        self.bot = load_bot()
+        self.bot.log_journal = os.path.join(self.workdir, 'trades.db')
+        self.bot.candle_store = CandleStore(os.path.join(self.workdir, 'candles'))
+        self.bot.metrics.jsonl_path = None
+        self.bot.metrics.prom_path = None
+        self.bot.use_exchange(MockFTX(synthetic_candles(1_000), symbol=self.bot.robot_symbol))
+
+    def cold_indicators(self):
+        ''' Fresh indicator state, so every call pays for the whole window as on a cold start '''
+        self.bot.indicator_state = IndicatorState(fast=12, slow=26, vol_window=30, vol_alpha=0.96)
+
+    def cases(self):
+        ''' name -> (setup(n) returning the call arguments, call) '''
+        bot = self.bot
+
+        def with_cold_state(fn):
+            def call(*args):
+                self.cold_indicators()
+                return fn(*args)
+            return call
+
+        def fill_summary(fills):
+            return Fill.from_dict(aggregate_fills(fills)) # what create_open_market_order builds per order
+
+        def close_all(entries, exits):
+            return [bot.close_trades(e, x) for e, x in zip(entries, exits)]
+
+        def journal_with_history(n):
+            path = os.path.join(self.workdir, f'history_{n}.db')
+            if os.path.exists(path):
+                os.remove(path)
+            journal = TradeJournal(path)
+            entries, exits = synthetic_trades(n)
+            journal.append_trades(to_frame(close_all(entries, exits)))
+            journal.set_open_position(entries[-1].to_dict())
+            bot.journal.bind(journal)
+            return ()
+
+        def fresh_journal(n):
+            path = os.path.join(self.workdir, f'save_{n}.db')
+            if os.path.exists(path):
+                os.remove(path)
+            bot.journal.bind(TradeJournal(path))
+            return (close_all(*synthetic_trades(n)),)
+
+        return {
+            'strategy': (lambda n: (candle_frame(n),), with_cold_state(lambda df: bot.strategy(df.copy()))),
+            'Cal_SLdistance': (lambda n: (candle_frame(n),), with_cold_state(bot.Cal_SLdistance)),
+            'Cal_Size': (lambda n: (candle_frame(n),), with_cold_state(bot.Cal_Size)),
+            'fill_aggregation': (lambda n: (synthetic_fills(n),), fill_summary),
+            'close_trades': (synthetic_trades, close_all),
+            'save_trades': (fresh_journal, bot.save_trades),
+            'read_log_ontrade': (journal_with_history, bot.read_log_ontrade),
+        }
+
+def measure(call, args, min_time=0.2, max_repeat=50):
+    ''' Median seconds per call over repeats filling min_time, then peak traced memory of one more call '''
+    times = []
+    started = time.perf_counter()
+    while len(times) < max_repeat and (len(times) < 3 or time.perf_counter() - started < min_time):
+        t0 = time.perf_counter()
+        call(*args)
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    call(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': statistics.median(times), 'min_seconds': min(times), 'repeats': len(times), 'peak_bytes': peak}
+
+def replay_throughput(bars=2_000, workdir=None):
+    ''' Bars per second of the whole per-bar path (bar-close fetch, trading(), risk monitor) through replay.Replay,
+        in the measure() result layout with seconds per bar '''
+    from replay import Replay
+    replay = Replay(synthetic_candles(bars + 100), workdir=workdir or tempfile.mkdtemp(prefix='bench_replay_'))
+    replay.run(start=100)
+    per_bar = replay.seconds / bars
+    print(f'{"replay":18s} {bars:>9,d} bars  {per_bar*1000:10.3f} ms  {replay.bars_per_second:8.0f} bars/s')
+    return {'seconds': per_bar, 'min_seconds': per_bar, 'repeats': bars, 'peak_bytes': 0, 'bars_per_second': replay.bars_per_second}
+
+def run(sizes=SIZES, names=None, workdir=None):
+    suite = Suite(workdir)
+    results = {}
+    logger.disable('')
+    try:
+        for name, (setup, call) in suite.cases().items():
+            if names and name not in names:
+                continue
+            for n in sizes:
+                with contextlib.redirect_stdout(io.StringIO()): # the bot prints on every journal call
+                    args = setup(n)
+                    results[f'{name}[{n}]'] = measure(call, args)
+                r = results[f'{name}[{n}]']
+                print(f'{name:18s} {n:>9,d} rows  {r["seconds"]*1000:10.3f} ms  peak {r["peak_bytes"]/2**20:8.2f} MiB  x{r["repeats"]}')
+    finally:
+        logger.enable('')
+    return results
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(), 'created': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+def compare(results, baseline, tolerance=1.25):
+    ''' Print time and memory ratios against a baseline, return the keys slower than tolerance x baseline.
+        Times are compared on the fastest repeat, far less noisy than the median on sub-millisecond calls '''
+    regressions = []
+    for key, r in results.items():
+        base = baseline['results'].get(key)
+        if base is None:
+            continue
+        t_ratio = r['min_seconds'] / base['min_seconds'] if base['min_seconds'] else float('inf')
+        m_ratio = r['peak_bytes'] / base['peak_bytes'] if base['peak_bytes'] else 1.0
+        flag = '  REGRESSION' if t_ratio > tolerance else ''
+        print(f'{key:30s} time x{t_ratio:5.2f}  memory x{m_ratio:5.2f}{flag}')
+        if flag:
+            regressions.append(key)
+    return regressions
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark hot-path bot functions at growing data sizes')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--only', nargs='+', default=None, help='benchmark names to run, e.g. strategy close_trades')
+    parser.add_argument('--save', default=None, help='write results to this baseline json')
+    parser.add_argument('--compare', default=None, help='baseline json to compare against')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='time ratio counted as a regression')
+    parser.add_argument('--replay', type=int, default=0, help='also replay this many synthetic bars through the bot')
+    parser.add_argument('--min-bars-per-second', type=float, default=None, help='fail if the replay is slower than this')
+    args = parser.parse_args()
+    results = run(args.sizes, args.only)
+    if args.replay:
+        results[f'replay[{args.replay}]'] = replay_throughput(args.replay)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=1)
+        print(f'Baseline saved to {args.save}')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            raise SystemExit(f'{len(regressions)} regressions over x{args.tolerance}: {", ".join(regressions)}')
+    if args.replay and args.min_bars_per_second:
+        throughput = results[f'replay[{args.replay}]']['bars_per_second']
+        if throughput < args.min_bars_per_second:
+            raise SystemExit(f'Replay {throughput:.0f} bars/s, below the {args.min_bars_per_second:.0f} bars/s floor')
@@ -0,0 +1,129 @@
+# ===============================================================================================================
+# Historical candle store
+# One raw float64 file of [timestamp, open, high, low, close, volume] rows per symbol and timeframe,
+# read back through np.memmap so time-range slices are zero-copy views
+# ===============================================================================================================
+import os
+import time
+
+import numpy as np
+
+from candles import timeframe_to_ms
+
+ROW_BYTES = 6 * 8
+
+class CandleStore:
+    ''' On-disk OHLCV history, sorted by timestamp and deduplicated on write '''
+
+    def __init__(self, root='candles'):
+        self.root = root
+
+    def path(self, symbol, timeframe):
+        name = symbol.replace('/', '_').replace(':', '_')
+        return os.path.join(self.root, f'{name}_{timeframe}.ohlcv')
+
+    def load(self, symbol, timeframe):
+        ''' Whole history as a read-only memmap of shape (rows, 6), empty array if nothing is stored '''
+        path = self.path(symbol, timeframe)
+        if not os.path.exists(path) or os.path.getsize(path) < ROW_BYTES:
+            return np.empty((0, 6))
+        rows = os.path.getsize(path) // ROW_BYTES
+        return np.memmap(path, dtype=np.float64, mode='r', shape=(rows, 6))
+
+    def read(self, symbol, timeframe, start=None, end=None):
+        ''' Rows with start <= timestamp < end (ms), a view into the memmap, no copy '''
+        data = self.load(symbol, timeframe)
+        lo = 0 if start is None else int(np.searchsorted(data[:, 0], start, side='left'))
+        hi = len(data) if end is None else int(np.searchsorted(data[:, 0], end, side='left'))
+        return data[lo:hi]
+
+    def read_last(self, symbol, timeframe, n):
+        data = self.load(symbol, timeframe)
+        return data[max(len(data) - n, 0):]
+
+    def last_ts(self, symbol, timeframe):
+        data = self.load(symbol, timeframe)
+        return int(data[-1, 0]) if len(data) else None
+
+    def write(self, symbol, timeframe, bars):
+        ''' Add closed bars. Bars newer than the stored tail are appended in place,
+            anything overlapping or older is merged and the file rewritten atomically. Returns rows added '''
+        bars = np.asarray(bars, dtype=np.float64).reshape(-1, 6)
+        if len(bars) == 0:
+            return 0
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(symbol, timeframe)
+        data = self.load(symbol, timeframe)
+        if len(data) == 0 or bars[:, 0].min() > data[-1, 0]:
+            new = _dedupe(bars)
+            with open(path, 'ab') as f:
+                f.write(np.ascontiguousarray(new).tobytes())
+            return len(new)
+        merged = _dedupe(np.vstack([np.asarray(data), bars]))
+        added = len(merged) - len(data)
+        del data # release the memmap before replacing the file
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(np.ascontiguousarray(merged).tobytes())
+        os.replace(tmp, path)
+        return added
+
+    def gaps(self, symbol, timeframe, start=None, end=None):
+        ''' (last_ts_before_gap, first_ts_after_gap) pairs where bars are missing '''
+        ts = self.read(symbol, timeframe, start, end)[:, 0]
+        tf_ms = timeframe_to_ms(timeframe)
+        idx = np.nonzero(np.diff(ts) > tf_ms)[0]
+        return [(int(ts[i]), int(ts[i + 1])) for i in idx]
+
+    def backfill(self, fetch_ohlcv, symbol, timeframe, since, until=None, page=1000, pause=0.0):
+        ''' Page through fetch_ohlcv(symbol, timeframe, since=, limit=) from since (ms) up to until (default now).
+            The still-forming bar is never stored. Returns rows added '''
+        tf_ms = timeframe_to_ms(timeframe)
+        until = until if until is not None else int(time.time() * 1000)
+        closed_before = (until // tf_ms) * tf_ms
+        added = 0
+        cursor = int(since)
+        while cursor < closed_before:
+            bars = fetch_ohlcv(symbol, timeframe, since=cursor, limit=page)
+            if not bars:
+                break
+            bars = [b for b in bars if cursor <= b[0] < closed_before]
+            if not bars:
+                break
+            added += self.write(symbol, timeframe, bars)
+            cursor = int(bars[-1][0]) + tf_ms
+            if pause:
+                time.sleep(pause)
+        return added
+
+    def repair_gaps(self, fetch_ohlcv, symbol, timeframe, page=1000):
+        ''' Refetch every missing range, gaps that the exchange has no bars for stay as they are '''
+        tf_ms = timeframe_to_ms(timeframe)
+        added = 0
+        for before, after in self.gaps(symbol, timeframe):
+            added += self.backfill(fetch_ohlcv, symbol, timeframe, before + tf_ms, after, page)
+        return added
+
+def _dedupe(rows):
+    ''' Sort by timestamp and keep the last row written for each timestamp '''
+    rows = rows[np.argsort(rows[:, 0], kind='stable')]
+    keep = np.ones(len(rows), dtype=bool)
+    keep[:-1] = rows[1:, 0] != rows[:-1, 0]
+    return rows[keep]
+
+if __name__ == '__main__':
+    import argparse
+    import ccxt
+    parser = argparse.ArgumentParser(description='Backfill the local candle store from the exchange')
+    parser.add_argument('symbol')
+    parser.add_argument('--timeframe', default='1m')
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--root', default='candles')
+    args = parser.parse_args()
+    exchange = ccxt.ftx({'enableRateLimit': True})
+    store = CandleStore(args.root)
+    since = store.last_ts(args.symbol, args.timeframe)
+    since = since + timeframe_to_ms(args.timeframe) if since else int((time.time() - args.days * 86400) * 1000)
+    added = store.backfill(exchange.fetch_ohlcv, args.symbol, args.timeframe, since)
+    added += store.repair_gaps(exchange.fetch_ohlcv, args.symbol, args.timeframe)
+    print(f'{args.symbol} {args.timeframe}: +{added} bars, {len(store.load(args.symbol, args.timeframe))} stored, gaps {len(store.gaps(args.symbol, args.timeframe))}')
@@ -0,0 +1,91 @@
+# ===============================================================================================================
+# Candle buffer
+# In-process OHLCV window that is seeded once and then extended incrementally with fetch_ohlcv(since=...)
+# ===============================================================================================================
+import numpy as np
+import pandas as pd
+
+OHLCV_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+_TIMEFRAME_UNITS = {'m': 60_000, 'h': 3_600_000, 'd': 86_400_000, 'w': 604_800_000}
+
+def timeframe_to_ms(timeframe):
+    ''' Convert ccxt timeframe string (1m, 15m, 1h ...) to milliseconds '''
+    return int(timeframe[:-1]) * _TIMEFRAME_UNITS[timeframe[-1]]
+
+class CandleBuffer:
+    ''' Fixed-size ring of [timestamp, open, high, low, close, volume] rows backed by one numpy array.
+        The last row is the still-forming bar as returned by the exchange, every row before it is closed. '''
+
+    def __init__(self, capacity, timeframe):
+        self.capacity = int(capacity)
+        self.timeframe = timeframe
+        self.tf_ms = timeframe_to_ms(timeframe)
+        self._data = np.zeros((self.capacity, 6), dtype=np.float64)
+        self._start = 0
+        self._len = 0
+        self.gaps = 0 # number of gaps detected since the last seed
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def last_ts(self):
+        ''' Timestamp (ms) of the newest row, the still-forming bar, None if empty '''
+        if self._len == 0:
+            return None
+        return int(self._data[(self._start + self._len - 1) % self.capacity, 0])
+
+    @property
+    def last_closed_ts(self):
+        ''' Timestamp (ms) of the newest closed bar, None if there is none yet '''
+        if self._len < 2:
+            return None
+        return int(self._data[(self._start + self._len - 2) % self.capacity, 0])
+
+    def clear(self):
+        self._start = 0
+        self._len = 0
+        self.gaps = 0
+
+    def seed(self, bars):
+        ''' Replace the buffer content with a full window of bars '''
+        self.clear()
+        for bar in bars[-self.capacity:]:
+            self._push(bar)
+
+    def update(self, bars):
+        ''' Merge bars fetched with since=last_ts.
+            Replace the forming bar, append new ones, return False if a gap is found so the caller can reseed '''
+        for bar in bars:
+            ts = int(bar[0])
+            last_ts = self.last_ts
+            if last_ts is None or ts == last_ts + self.tf_ms:
+                self._push(bar)
+            elif ts == last_ts:
+                self._data[(self._start + self._len - 1) % self.capacity] = bar[:6]
+            elif ts > last_ts:
+                self.gaps += 1
+                return False
+            # older bars are already in the buffer
+        return True
+
+    def _push(self, bar):
+        if self._len < self.capacity:
+            self._data[(self._start + self._len) % self.capacity] = bar[:6]
+            self._len += 1
+        else:
+            self._data[self._start] = bar[:6]
+            self._start = (self._start + 1) % self.capacity
+
+    def to_array(self, closed_only=True):
+        ''' Copy rows out in time order, drop the forming bar if closed_only '''
+        n = self._len - 1 if closed_only and self._len > 0 else self._len
+        idx = (self._start + np.arange(n)) % self.capacity
+        return self._data[idx]
+
+    def to_frame(self, closed_only=True):
+        ''' DataFrame in the same layout fetch_data() has always returned '''
+        df = pd.DataFrame(self.to_array(closed_only), columns=OHLCV_COLUMNS)
+        df['timestamp'] = pd.to_datetime(df['timestamp'].astype('int64'), unit='ms')
+        return df
@@ -3,52 +3,135 @@
 # Last modified: 2022-03-31 
 # developed by Tan & Tao
 # ===============================================================================================================
-import ccxt
+import time
+_import_started = time.perf_counter()
 import configparser
+import threading
 from datetime import datetime
 import numpy as np
-import talib as ta
 import pandas as pd
-import time
 import warnings
 from loguru import logger
+from candles import CandleBuffer
+from resample import Resampler
+from candle_store import CandleStore
+from indicators import IndicatorState
+from markets import MarketSpecCache
+from account import AccountSnapshot
+from metrics import RestCallCounter, Metrics
+from orders import FillTracker
+from retry import RetryPolicy, next_bar_deadline
+from candles import timeframe_to_ms
+from journal import TradeJournal
+from records import ClosedTrade, Fill, Position, to_frame
+from checkpoint import save_checkpoint, load_checkpoint
+from scheduler import BarScheduler, exchange_time_ms
+from notify import Notifier, line_sender
+from risk import RiskMonitor
+from ratelimit import RateBudget
+from trade_history import TradeHistory
+from optimize import load_params
 warnings.filterwarnings('ignore')
 
 # ===============================================================================================================
 # Global configuration
 # ===============================================================================================================
-config = configparser.ConfigParser() 
-config.read('key.ini') # load key
-
 robot_name = 'ActionZone'
-robot_api_key = config['key']['apikey'] 
-robot_secret_key = config['key']['secretkey']
 robot_symbol = 'BTC-PERP' # trade symbol
 robot_timeframe = '1m' # support timeframe: 1m, 3m, 5m, 15m, 1h
+robot_base_timeframe = '1m' # the one candle feed fetched from the exchange, every timeframe is resampled from it
+robot_timeframes = [robot_timeframe] # timeframes kept up to date, e.g. add '15m' and read resampler.frame('15m')
 robot_max_candles = 100 # total candles to be loaded from exchange, max is 1,000
 robot_riskpertrade = 0.0001 # 1%
 robot_position_size_limit = 1 # max position size to allow to trade
 robot_leverage = 20 # set leverage
-
-exchange = ccxt.ftx({
-    'apiKey' : robot_api_key ,
-    'secret' : robot_secret_key ,
-    'enableRateLimit': True,
-    'option' : {'defaultType' : 'future', 'adjustForTimeDifference': True}
-})
-exchange.headers = {
-    'FTX-SUBACCOUNT': 'testAPI',
-}
+robot_sl_multiply = 1.2 # stop loss distance in volatility units
+robot_tp_multiply = 0.0 # take profit distance in volatility units, 0.0 leaves the TP unset
+robot_params = 'params.json' # walk-forward parameters from optimize.py, applied at startup
+robot_tf_ms = timeframe_to_ms(robot_timeframe)
+
+class LazyObject:
+    ''' Stand-in that builds the real object on first attribute access, bind() swaps in another one '''
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_target', None)
+
+    def bind(self, target):
+        object.__setattr__(self, '_target', target)
+        return target
+
+    def resolve(self):
+        if self._target is None:
+            self.bind(self._factory())
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.resolve(), name, value)
+
+def create_exchange():
+    ''' Read key.ini and build the ccxt client, runs on first use of exchange '''
+    import ccxt
+    config = configparser.ConfigParser() 
+    config.read('key.ini') # load key
+    client = ccxt.ftx({
+        'apiKey' : config['key']['apikey'] ,
+        'secret' : config['key']['secretkey'] ,
+        'enableRateLimit': False, # paced by rate_budget instead
+        'option' : {'defaultType' : 'future', 'adjustForTimeDifference': True}
+    })
+    client.headers = {
+        'FTX-SUBACCOUNT': 'testAPI',
+    }
+    rest_calls.install(client)
+    metrics.install(client)
+    rate_budget.install(client)
+    return client
+
+def create_line_sender():
+    ''' LINE Notify sender from key.ini line_token, None when no token is configured '''
+    config = configparser.ConfigParser()
+    config.read('key.ini')
+    token = config.get('key', 'line_token', fallback=None)
+    return line_sender(token) if token else None
+
+def use_exchange(client):
+    ''' Trade through another ccxt-compatible client instead, e.g. mock_exchange.MockFTX for offline runs '''
+    rest_calls.install(client)
+    metrics.install(client)
+    return exchange.bind(client)
+
+retry_policy = RetryPolicy(max_attempts=5, base_delay=0.25, max_delay=8.0, breaker_threshold=5, breaker_cooldown=30.0)
+price_retry_policy = RetryPolicy(max_attempts=1, breaker_threshold=5, breaker_cooldown=30.0) # risk monitor thread, next poll is the retry
+rest_calls = RestCallCounter() # REST requests per trading() cycle
+metrics = Metrics(jsonl_path='log_metrics.jsonl', prom_path='metrics.prom') # stage / exchange latency, one summary line per cycle
+rate_budget = RateBudget('ratelimit.bin', rate=30.0, capacity=30.0, metrics=metrics) # token bucket shared by every bot on this API key, orders first
+exchange = LazyObject(create_exchange)
+account = AccountSnapshot(exchange) # positions and balances, fetched once per cycle
+market_specs = MarketSpecCache(exchange, ttl=60*60) # priceIncrement / sizeIncrement, refreshed hourly
+candle_buffer = CandleBuffer(robot_max_candles, robot_base_timeframe)
+resampler = Resampler(robot_timeframes, base=robot_base_timeframe, capacity=robot_max_candles - 1) # same closed window candle_buffer gave
+notifier = Notifier(batch_size=20, linger=0.5, max_queue=1000) # LINE messages, sent from a background thread
+candle_store = CandleStore('candles') # local OHLCV history, warms candle_buffer at startup
+indicator_state = IndicatorState(fast=12, slow=26, vol_window=30, vol_alpha=0.96)
 
 log_history = 'log_history.csv'
 log_ontrade = 'log_ontrade.csv'
 log_status = 'log_status.log'
-
-logger.add(log_status, format="{time:YYYY-MM-DD at HH:mm:ss} | {level} | {message}", retention= "30 days") # Cleanup after some time
-
-response = exchange.private_post_account_leverage({'leverage': robot_leverage,}) 
-print(exchange.fetchStatus())
-logger.info(f'Status : {exchange.fetchStatus()}')
+log_journal = 'trades.db' # closed trades and open position, replaces log_history / log_ontrade csv
+log_checkpoint = 'checkpoint.pkl' # candles, indicators, prev_bar and open position, rewritten every cycle
+log_fills = 'fills.db' # local mirror of the account's fills, synced from a cursor
+
+journal = LazyObject(lambda: TradeJournal(log_journal))
+trade_history = LazyObject(lambda: TradeHistory(log_fills))
+fill_tracker = FillTracker(exchange, first_delay=0.05, max_delay=1.0, timeout=15.0, history=trade_history) # poll order status until filled
+trade_lock = threading.RLock() # trading() and the risk monitor never act on the position at the same time
+prev_bar = 0
+cycle_boundary = None # bar boundary whose measurement cycle confirm_bar_closed() already started
+exit_fill = None # last exit Fill
 
 # ===============================================================================================================
 # Utility Function
@@ -58,22 +141,38 @@ def get_time():
     formatted_date = now.strftime("%Y/%m/%d %H:%M:%S") 
     return formatted_date
 
+def call_exchange(endpoint, fn, *args, max_attempts=None, policy=None, **kwargs):
+    ''' Run one exchange call through retry_policy, or policy from another thread, return None once it gives up '''
+    t0 = time.perf_counter()
+    try:
+        return (policy or retry_policy).call(endpoint, fn, *args, deadline=next_bar_deadline(robot_tf_ms), max_attempts=max_attempts, **kwargs)
+    except Exception as e:
+        metrics.inc('exchange_errors_total', 'endpoint', endpoint)
+        print(f'[{get_time()}] {type(e).__name__} {str(e)} Cannot GET {endpoint}')
+        logger.debug(f'Cant get {endpoint}, {type(e).__name__} : {str(e)}')
+        return None
+    finally:
+        metrics.observe('exchange_call_seconds', 'endpoint', endpoint, time.perf_counter() - t0)
+
+def line_notify(msg):
+    ''' Queue msg for LINE Notify, returns at once, the notifier thread batches and sends it '''
+    return notifier.post(msg)
+
+def notify_entry(action, fill, size):
+    ''' Entry message once the order is filled, a failure message if it never was '''
+    if fill != None:
+        line_notify(f'{action} {fill.symbol} at {fill.price}, size {fill.amount}')
+    else:
+        line_notify(f'{action} {robot_symbol} FAILED, no fill for size {size}')
+
+def notify_exit(action, trade):
+    if trade != None:
+        line_notify(f'{action} {trade.entry.symbol} at {trade.exit.price}, pnl {trade.pnl:.4f}')
+    else:
+        line_notify(f'{action} {robot_symbol}, exit fill unknown')
+
 def get_wallet():
-    i=0 
-    while i< 5:
-        try:
-            wallet = exchange.privateGetWalletBalances()['result']
-            return wallet
-        except Exception as e:
-            if i >5:
-                print(f'[{get_time()}]MAX RETRY {i} , {str(e)} Cannot GET {get_wallet.__name__}')
-                logger.debug(f'Cant get get_wallet Function, MAX RETRY {i} !!')
-                return  None
-            else:
-                print(str(e) , get_wallet.__name__, f' RETRY {i}')
-                logger.debug(f'Cant get get_wallet Function, Retry round {i}')
-                time.sleep(5)
-                i+=1
+    return call_exchange('wallet', account.balances)
 
 def get_cash():
     try:
@@ -87,122 +186,66 @@ def get_cash():
         logger.debug('Cant get get_cash Function')
     
 def get_position(symbols): 
-    i= 0 
-    while i <5 :
-        try:
-            res = exchange.fetchPositions()
-            for sym in res:
-                if sym['info']['future']==symbols:
-                    f_pos = sym['info']
-            return f_pos
-        except Exception as e:
-            if i >5:
-                print(f'[{get_time()}]MAX RETRY {i} , {str(e)} Cannot GET {get_position.__name__}')
-                logger.debug(f'Cant get get_position Function, MAX RETRY {i} !!')
-                return  None
-            else:
-                print(str(e) , get_position.__name__, f' RETRY {i}')
-                logger.debug(f'Cant get get_position Function, Retry round {i}')
-                time.sleep(5)
-                i+=1
-
-def get_ticker(symbol):
-    i= 0
-    while i< 5:
-        try:
-            res =exchange.fetch_ticker(symbol)
-            return res
-        except Exception as e:
-            if i >5:
-                print(f'[{get_time()}]MAX RETRY {i} , {str(e)} Cannot GET {get_ticker.__name__}')
-                logger.debug(f'Cant get get_ticker Function, MAX RETRY {i} !!')
-                return  None
-            else:
-                print(str(e) , get_ticker.__name__, f' RETRY {i}')
-                logger.debug(f'Cant get get_ticker Function, Retry round {i}')
-                time.sleep(5)
-                i+=1    
+    return call_exchange('positions', account.position, symbols)
+
+def get_ticker(symbol, policy=None):
+    return call_exchange('ticker', exchange.fetch_ticker, symbol, policy=policy)
 
 def get_price_digit(symbol): 
     try:
-        res = get_ticker(symbol)
-        price_step = float(res['info']['priceIncrement'])
-        str_digit = str(price_step)
-        count_digit = len(str_digit.split('.')[1])
-        return count_digit
+        return call_exchange('markets', market_specs.price_digit, symbol)
     except Exception as e :
         print(str(e))
         logger.debug('Cant get get_price_digit Function')
     
 def get_size_digit(symbol): 
     try:
-        res = get_ticker(symbol)
-        size_step = float(res['info']['sizeIncrement'])
-        last_price = float(res['info']['last'])
-        min_provide = size_step * last_price
-        str_digit = str(size_step)
-        count_digit = len(str_digit.split('.')[1])
-        return count_digit
-        
+        return call_exchange('markets', market_specs.size_digit, symbol)
     except Exception as e :
         print(str(e))
         logger.debug('Cant get get_size_digit Function')
  
 def get_minimum_size(symbol): 
-    res = get_ticker(symbol)['info']
-    minimum_size = float(res['sizeIncrement'])
-    last_bid = float(res['bid'])
-    min_value = minimum_size * last_bid
-    return float(minimum_size)
+    return float(call_exchange('markets', market_specs.min_size, symbol))
 
 def check_positions():
-    i= 0
-    while i <5 :
-        try:
-            res = exchange.private_get_positions()['result']   
-            for symbol in res:
-                if symbol['future'] in robot_symbol:
-                    netsize = float(symbol['netSize'])
-                    if netsize > 0:
-                        positions = 1 # Have Long Positions
-                    elif netsize < 0:
-                        positions = -1 # Have Short Positions
-                    else :
-                        positions = 0 # No Positions
-                    return positions  
-        except Exception as e:
-            if i >5:
-                print(f'[{get_time()}]MAX RETRY {i} , {str(e)} Cannot GET {check_positions.__name__}')
-                logger.debug(f'Cant get check_positions Function, MAX RETRY {i} !!')
-                return  None
-            else:
-                print(str(e) , check_positions.__name__, f' RETRY {i}')
-                logger.debug(f'Cant get check_positions Function, Retry round {i}')
-                time.sleep(5)
-                i+=1 
-
-def get_ohlcv(symbols = robot_symbol, timeframe = robot_timeframe, limit = robot_max_candles):
-    i=0 
-    while i < 5:
-        try:
-            bars = exchange.fetch_ohlcv(symbols, timeframe, limit = limit)
-            return bars
-        except Exception as e:
-            if i >5:
-                print(f'[{get_time()}]MAX RETRY {i} , {str(e)} Cannot GET {get_ohlcv.__name__}')
-                logger.debug(f'Cant get get_ohlcv Function, MAX RETRY {i} !!')
-                return  None
+    positions = call_exchange('positions', account.position_side, robot_symbol) # 1 Long, -1 Short, 0 No Positions
+    return positions
+
+def get_ohlcv(symbols = robot_symbol, timeframe = robot_timeframe, limit = robot_max_candles, since = None):
+    bars = call_exchange('ohlcv', exchange.fetch_ohlcv, symbols, timeframe, since = since, limit = limit)
+    return bars
+
+@metrics.timed('fetch_data')
+def fetch_data(symbols = robot_symbol, timeframe = robot_base_timeframe, limit = robot_max_candles):
+    ''' Extend candle_buffer from its last bar, reseed the whole window only on first run, gap or long pause.
+        The new closed bars go to the resampler, returns the robot_timeframe frame '''
+    try:
+        if len(candle_buffer) == 0: # warm start from the local store, the since fetch below tops it up
+            candle_buffer.seed(candle_store.read_last(symbols, timeframe, limit - 1))
+        if len(candle_buffer) == 0:
+            candle_buffer.seed(get_ohlcv(symbols, timeframe, limit = limit))
+        else:
+            bars = get_ohlcv(symbols, timeframe, limit = limit, since = candle_buffer.last_ts)
+            if len(bars) >= limit or not candle_buffer.update(bars):
+                print('CANDLE GAP, RELOAD WINDOW')
+                logger.debug('Candle gap detected, reload full window')
+                candle_buffer.seed(get_ohlcv(symbols, timeframe, limit = limit))
+        closed = candle_buffer.to_array()
+        stored_ts = candle_store.last_ts(symbols, timeframe) or 0
+        candle_store.write(symbols, timeframe, closed[closed[:, 0] > stored_ts])
+        history = None
+        if resampler.last_ts == None: # warm start, enough base history for the longest timeframe
+            since = int(closed[-1, 0]) - (resampler.base_bars_needed() - 1) * candle_buffer.tf_ms
+            if len(candle_store.read(symbols, timeframe, start = since)) < resampler.base_bars_needed():
+                call_exchange('ohlcv', candle_store.backfill, exchange.fetch_ohlcv, symbols, timeframe, since, until = candle_buffer.last_ts)
+            history = candle_store.read(symbols, timeframe, start = since)
+        with trade_lock: # exit_on_level reads the resampler from the risk monitor thread
+            if history is not None:
+                resampler.seed(history)
             else:
-                print(str(e) , get_ohlcv.__name__, f' RETRY {i}')
-                logger.debug(f'Cant get get_ohlcv Function, Retry round {i}')
-                time.sleep(5)
-                i+=1
-
-def fetch_data(symbols = robot_symbol, timeframe = robot_timeframe, limit = robot_max_candles):
-    try:        
-        bars = get_ohlcv(symbols, timeframe, limit = limit)
-        df = pd.DataFrame(bars[:-1], columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+                resampler.update(closed[closed[:, 0] > resampler.last_ts])
+            df = resampler.frame(robot_timeframe)
         return df
     except :
         print('LOAD DATA ERROR')
@@ -215,242 +258,198 @@ def is_new_bar(prev_bar_time, cur_bar_time):
     else:
         return False  
 
-def get_my_trades(symbols = robot_symbol,since_ts=None):
-    i= 0 
-    res_trades = []
-    while (i < 5) : # Try to Fetch until res != []
-        try:
-            if since_ts !=None:
-                res_trades = exchange.fetch_my_trades(symbols, since=int(since_ts))
-                while  res_trades == [] :
-                    print(f'Try to get Trades {i}')
-                    res_trades = exchange.fetch_my_trades(symbols, since=int(since_ts))
-                    if i >= 20:
-                        print('Over Try Limit to Fetch Trades')
-                    i +=1
-                    time.sleep(1)
-            else:
-                res_trades = exchange.fetch_my_trades(symbols)
+def sync_trade_history(symbols = robot_symbol):
+    ''' Pull only the fills newer than the local cursor into trade_history, rows added or None if the call failed '''
+    return call_exchange('my_trades', trade_history.sync, exchange.fetch_my_trades, symbols)
 
-            return res_trades
-        except Exception as e:
-            if i >5:
-                print(f'[{get_time()}]MAX RETRY {i} , {str(e)} Cannot GET {get_my_trades.__name__}')
-                logger.debug(f'Cant get get_my_trades Function, MAX RETRY {i} !!')
-                return  None
-            else:
-                print(str(e) , get_my_trades.__name__, f' RETRY {i}')
-                logger.debug(f'Cant get get_my_trades Function, Retry round {i}')
-                time.sleep(5)
-                i+=1
+def get_my_trades(symbols = robot_symbol,since_ts=None):
+    sync_trade_history(symbols)
+    if since_ts !=None:
+        return trade_history.trades(symbols, since=int(since_ts))
+    return trade_history.trades(symbols)
 
 def load_last_ts_entry(last_side):
-    ''' Fetch last Timestamp filter by side , symbols '''
-    all_ts = []
-    res_trades = get_my_trades(robot_symbol)
-    for i in res_trades:
-        if i['side'] == last_side:
-            all_ts.append((i['timestamp']))
-            last_ts =min(all_ts)
-            return last_ts
+    ''' Timestamp of the latest fill on side, from the local trade history '''
+    sync_trade_history(robot_symbol)
+    return trade_history.last_ts(robot_symbol, last_side)
         
-robot_min_size = get_minimum_size(robot_symbol)
-
 # ===============================================================================================================
 # Order Function
 # ===============================================================================================================
+@metrics.timed('order')
 def create_open_market_order(symbols:str, side:str, size:float, params={}):  ### Custom param
         try:
-            orderInfo = exchange.create_order(symbols, 'market',side , size, params = params)["info"]
+            order = call_exchange('create_order', exchange.create_order, symbols, 'market', side, size, params = params, max_attempts = 1) # never resend a market order
+            orderInfo = order["info"]
             orderID = orderInfo["id"]
             entry_ts = exchange.parse8601(orderInfo['createdAt'])
-            print(f'Time sleep To Fetch Trades {entry_ts}') 
-            time.sleep(5)
-            res_trades = get_my_trades(symbols, since_ts=int(entry_ts))
-            if res_trades != []:
-                entry_df_ts  = pd.DataFrame(res_trades)
-                entry_df  = entry_df_ts.groupby('symbol').agg({'timestamp':'last','side':'last','price':'mean','amount':'sum','cost':'sum'}).reset_index()
-                return entry_df
+            print(f'Wait Order Fill {orderID} {entry_ts}') 
+            fill = call_exchange('fill', fill_tracker.track, orderID, symbols, since=entry_ts)
+            account.invalidate() # position and collateral change with the fill
+            if fill != None:
+                return Fill.from_dict(fill)
             else:
                 print('Cannot Fetch last Trades')
-                return pd.DataFrame()
+                return None
         except Exception as e:
                 print(f'[{get_time()}], {str(e)} Cannot GET {create_open_market_order.__name__}')
                 logger.debug("Cannot GET create_open_market_order Function")
                 return  None
     
+@metrics.timed('close_positions')
 def close_positions(symbols=robot_symbol):    
-    close_df = pd.DataFrame()
+    ''' Flatten the position with a market order, return its exit Fill or None '''
+    exit_fill = None
     netsize = float(get_position(symbols)['netSize'])
     if netsize > 0:
-        close_df = create_open_market_order(symbols, side='sell', size=abs(netsize), params={'conditionalOrdersOnly':True}) 
-        if (not close_df.empty):
-            close_df = close_df.add_suffix('_exit')     
+        exit_fill = create_open_market_order(symbols, side='sell', size=abs(netsize), params={'conditionalOrdersOnly':True}) 
     elif netsize < 0:  
-        close_df = create_open_market_order(symbols, side='buy', size=abs(netsize), params={'conditionalOrdersOnly':True})
-        close_df = close_df.add_suffix('_exit')
+        exit_fill = create_open_market_order(symbols, side='buy', size=abs(netsize), params={'conditionalOrdersOnly':True})
     else :
         print('No positions to close')
-    return close_df
+    return exit_fill
 
 # ===============================================================================================================
 # Ontrade log Function
 # ===============================================================================================================
+@metrics.timed('journal')
 def read_log_ontrade():
-    ''' Read Csv ontrade Files'''
-    try:
-        df =pd.read_csv(log_ontrade, usecols=['symbol','timestamp','side','price','amount','cost','stop_loss','take_profit'])
-        print('Read Trade Files ')
-        return df
-    except :
-        print('Create ontrade Files')
-        logger.info('Create ontrade Files')
-        df =pd.DataFrame(columns=['symbol','timestamp','side','price','amount','cost','stop_loss','take_profit'])
-        return df
+    ''' Read open position from journal'''
+    record = journal.open_position(robot_symbol)
+    if record != None:
+        print('Read Trade Journal ')
+        return Position.from_dict(record)
+    return None
     
+def open_position():
+    ''' Open Position from journal without the prints, polled by the risk monitor '''
+    record = journal.open_position(robot_symbol)
+    return Position.from_dict(record) if record != None else None
+
+@metrics.timed('journal')
 def reset_log_ontrade():
-    ''' Reset DataFrame and save to ontrade Files'''
-    df = pd.DataFrame(columns=['symbol','timestamp','side','price','amount','cost','stop_loss','take_profit'])
-    df.to_csv(log_ontrade)
-    return df
+    ''' Clear open position in journal, no position is None'''
+    journal.clear_open_position(robot_symbol)
+    return None
+
+@metrics.timed('journal')
+def save_log_ontrade(entry):
+    ''' Atomically store the open Position, clear it if entry is None'''
+    if entry == None:
+        journal.clear_open_position(robot_symbol)
+    else:
+        record = entry.to_dict()
+        record['symbol'] = robot_symbol
+        journal.set_open_position(record)
 
-def load_log_ontrade(df,entry_df):
-    ''' Load Position and calculation SL,tp if Not HoldPostion Reset Trades Files '''
+@metrics.timed('load_log_ontrade')
+def load_log_ontrade(df, entry):
+    ''' Position held on the exchange with its SL, tp not set. Reset Trades Journal and return None if Not HoldPostion '''
     last_position = check_positions()
     print(last_position)
-    if  (not entry_df.empty):
-        if last_position == 1:
-            f_pos = get_position(robot_symbol)
-            entry_df.symbol =  [robot_symbol]
-            entry_df['timestamp'] = [int(load_last_ts_entry(f_pos['side'])/1000)]
-            entry_df['price'] =  [float(f_pos['recentAverageOpenPrice'])  ]
-            entry_df['side'] = [f_pos['side']] 
-            entry_df['amount'] =  [float(f_pos['size'])]
-            entry_df['cost'] = [float(f_pos['size']) * float(f_pos['recentAverageOpenPrice'])]
-            entry_df['stop_loss'] = [float(f_pos['recentAverageOpenPrice']) - Cal_SLdistance(df) ] 
-            entry_df['take_profit'] = [0.0]
-        elif last_position == -1:
-            f_pos = get_position(robot_symbol)
-            entry_df.symbol =  [robot_symbol]
-            entry_df['timestamp'] = [int(load_last_ts_entry(f_pos['side'])/1000)]
-            entry_df['price'] =  [float(f_pos['recentAverageOpenPrice'])  ]
-            entry_df['side'] = [f_pos['side']] 
-            entry_df['amount'] =  [float(f_pos['size'])]
-            entry_df['cost'] = [float(f_pos['size']) * float(f_pos['recentAverageOpenPrice'])]
-            entry_df['stop_loss'] = [float(f_pos['recentAverageOpenPrice']) + Cal_SLdistance(df)] 
-            entry_df['take_profit'] = [0.0]
-
-        else: # Postion == 0 if not have position reset_trade_log
-            entry_df = reset_log_ontrade()
-    else:
-        if last_position == 1:
-            latest_log = {}
-            f_pos = get_position(robot_symbol)
-            latest_log['symbol'] =  f_pos['future']
-            latest_log['entry_time'] = df['timestamp'].iloc[-1]
-            latest_log['entry_price'] =  float(f_pos['recentAverageOpenPrice'])  
-            latest_log['position_side'] = f_pos['side'] 
-            latest_log['position_amount'] =  float(f_pos['size'])
-            latest_log['stop_loss'] = float(f_pos['recentAverageOpenPrice']) - Cal_SLdistance(df)  
-            latest_log['take_profit'] = 0.0
-            entry_df = pd.DataFrame([latest_log])
-
-        elif last_position == -1:
-            latest_log = {}
-            f_pos = get_position(robot_symbol)
-            latest_log['symbol'] =  f_pos['future']
-            latest_log['entry_time'] = df['timestamp'].iloc[-1]
-            latest_log['entry_price'] =  float(f_pos['recentAverageOpenPrice'])  
-            latest_log['position_side'] = f_pos['side'] 
-            latest_log['position_amount'] =  float(f_pos['size'])
-            latest_log['stop_loss'] = float(f_pos['recentAverageOpenPrice']) + Cal_SLdistance(df)  
-            latest_log['take_profit'] = 0.0
-            entry_df = pd.DataFrame([latest_log])
-        else: 
-            entry_df = reset_log_ontrade()
-
-    return entry_df
+    if last_position in (1, -1):
+        f_pos = get_position(robot_symbol)
+        price = float(f_pos['recentAverageOpenPrice'])
+        size = float(f_pos['size'])
+        entry_ts = load_last_ts_entry(f_pos['side']) if entry != None else None
+        if entry_ts != None: # our own fill, entry time from the trade history
+            timestamp = int(entry_ts/1000)
+        else: # position found without a fill of ours, stamp it with the last bar
+            timestamp = int(df['timestamp'].iloc[-1].timestamp())
+        entry = Position(robot_symbol, timestamp, f_pos['side'], price, size, size * price,
+                         stop_loss = price - last_position * Cal_SLdistance(df),
+                         take_profit = price + last_position * Cal_TPdistance(df) if robot_tp_multiply > 0 else 0.0)
+    else: # Postion == 0 if not have position reset_trade_log
+        entry = reset_log_ontrade()
+    return entry
 
 # ===============================================================================================================
 # History log Function
 # ===============================================================================================================
-def close_trades(entry_df, exit_df):
-    if not entry_df.empty:
-        trades_df = pd.concat([entry_df,exit_df],axis=1)
-        side_= trades_df['side'][0]
-        if side_ =='buy':
-            trades_df['diff_price'] = trades_df['price_exit'] - trades_df['price'] 
-            trades_df['pnl'] = trades_df['cost_exit'] - trades_df['cost'] 
-            trades_df =trades_df.reset_index()
-        else:
-            trades_df['diff_price'] =  trades_df['price'] -trades_df['price_exit']
-            trades_df['pnl'] =  trades_df['cost'] - trades_df['cost_exit'] 
-            trades_df =trades_df.reset_index()       
-    else:
-        trades_df =pd.DataFrame()
-    return trades_df
-
-def save_trades(all_trades, trades_df):
-    ''' Save Trades Record to log_history'''
-    if not trades_df.empty:
-        all_trades = all_trades.append(trades_df).set_index('symbol')
-        all_trades.to_csv(log_history)
+def close_trades(entry, exit_fill):
+    ''' ClosedTrade of the open Position and the Fill that closed it, None if either is missing '''
+    if entry != None and exit_fill != None:
+        return ClosedTrade(entry, exit_fill)
+    return None
+
+@metrics.timed('journal')
+def save_trades(trades):
+    ''' Append closed trade, or a list of them, to journal'''
+    trades = [trades] if isinstance(trades, ClosedTrade) else [t for t in trades or [] if t != None]
+    if len(trades) == 1:
+        journal.append_trade(trades[0].to_dict())
+        print('RECORD TRADES')
+    elif trades:
+        journal.append_trades(to_frame(trades))
         print('RECORD TRADES')
     else:
         print('Cannot Get Trades Details')
-        pass
     
-def read_log_history():
-    ''' Read Csv log_history Files'''
-    try:
-        df= pd.read_csv(log_history)
-        print('---DataBase Loaded---')
-
-    except:
-        df= pd.DataFrame(columns=['symbol','timestamp','side','price','amount','cost'])
-        df.to_csv(log_history, index=False)
-        print("---DataBase Created---")
-        logger.info("---DataBase Created---")
+def read_log_history(symbol=robot_symbol, side=None, since=None):
+    ''' Closed trades from journal'''
+    df = journal.trades(symbol=symbol, side=side, since=since)
+    print('---DataBase Loaded---')
     return df
 
 # ===============================================================================================================
 # Strategy Function Zone
 # ===============================================================================================================
-def Cal_Size(df, robot_riskpertrade = robot_riskpertrade):
+@metrics.timed('Cal_Size')
+def Cal_Size(df, rpt = None):
     try:
         cash = get_cash()
         size= 0.0
         if cash != None:
-            riskpertrade = robot_riskpertrade * cash
+            riskpertrade = (robot_riskpertrade if rpt == None else rpt) * cash
             size = (riskpertrade / Cal_SLdistance(df)) 
+            min_size = get_minimum_size(robot_symbol)
             if size > robot_position_size_limit:
                 size = robot_position_size_limit
-            elif size < robot_min_size:
-                size = robot_min_size    
-        return round(size, get_size_digit(robot_symbol))
+            elif size < min_size:
+                size = min_size    
+        return market_specs.round_size(robot_symbol, size)
     except Exception as e:
         print(str(e) , Cal_Size.__name__)
         logger.debug('Cant Cal_Size')
 
-def Cal_SLdistance(df, vol_multiply = 1.2):
-    vol = ta.STDDEV(df.close,30).ewm(alpha=0.96).mean()
-    sl_distance = vol * vol_multiply
-    return sl_distance.iloc[-1]
-
-def Cal_TPdistance(df, vol_multiply = 1.5):
-    vol = ta.STDDEV(df.close,30).ewm(alpha=0.96).mean()
-    tp_distance = vol * vol_multiply
-    return tp_distance.iloc[-1]
-
+def sync_indicators(df):
+    ''' Advance indicator_state with the bars of df it has not seen yet. Only the rows from its last_ts on are
+        converted to ms, so a call costs a binary search plus O(1) per new bar, not a pass over the window '''
+    ts = df['timestamp'].to_numpy()
+    start = 0
+    if indicator_state.last_ts != None:
+        start = int(np.searchsorted(ts, np.datetime64(indicator_state.last_ts, 'ms')))
+        if start == len(ts) or ts[start] != np.datetime64(indicator_state.last_ts, 'ms'):
+            start = 0 # last_ts left the window, sync() replays all of it
+    indicator_state.sync(ts[start:].astype('datetime64[ms]').astype(np.int64), df['close'].to_numpy()[start:])
+    return indicator_state
+
+def Cal_SLdistance(df, vol_multiply = None):
+    vol_multiply = robot_sl_multiply if vol_multiply == None else vol_multiply
+    sl_distance = sync_indicators(df).vol * vol_multiply
+    return sl_distance
+
+def Cal_TPdistance(df, vol_multiply = None):
+    vol_multiply = robot_tp_multiply if vol_multiply == None else vol_multiply
+    tp_distance = sync_indicators(df).vol * vol_multiply
+    return tp_distance
+
+@metrics.timed('strategy')
 def strategy(df):    
+    ''' Copy of df with the indicator and signal columns, last row computed, for reports and notebooks.
+        trading() reads indicator_state directly and never builds these columns '''
     if (not df.empty) :
-        df['ema1'] = ta.EMA(df.close, 12)
-        df['ema2'] = ta.EMA(df.close, 26)
-        
-        df['LongEntries'] = (df['ema1'] > df['ema2']) & (df['ema1'].shift(1) < df['ema2']) & (df.close > df['ema1'])
-        df['LongExit'] = df.close < df['ema2']   
-        df['ShortEntries'] = (df['ema1'] < df['ema2']) & (df['ema1'].shift(1) > df['ema2']) & (df.close < df['ema1'])
-        df['ShortExit'] = df.close > df['ema2'] 
+        state = sync_indicators(df)
+        df = df.copy() # df can be the resampler's shared frame
+        ema = np.full((len(df), 2), np.nan) # only the last row is computed, whole columns are set at once
+        ema[-1] = state.ema1, state.ema2
+        df['ema1'] = ema[:, 0]
+        df['ema2'] = ema[:, 1]
+
+        signals = np.zeros((len(df), 4), dtype=bool)
+        signals[-1] = state.signals() # LongEntries, LongExit, ShortEntries, ShortExit
+        for i, col in enumerate(['LongEntries', 'LongExit', 'ShortEntries', 'ShortExit']):
+            df[col] = signals[:, i]
         return df
     
     else:
@@ -461,41 +460,51 @@ def strategy(df):
 # ===============================================================================================================
 # Core Function
 # ===============================================================================================================
-def trading():
+def start_cycle():
+    ''' Per-cycle REST counter, retry budget and stage timers, started before the candle fetch '''
+    rest_calls.start_cycle()
+    retry_policy.start_cycle()
+    metrics.start_cycle()
+
+def trading(df_raw=None):
+    ''' One decision cycle, df_raw is the closed-bar frame when the caller already fetched it,
+        in which case it also started the cycle '''
     global prev_bar
-    global exit_df
+    global exit_fill
     
+    if df_raw is None:
+        start_cycle()
     now_dt =get_time()
+    account.invalidate()
     
     if prev_bar != 0:
         prev_bar_str = datetime.utcfromtimestamp(int(prev_bar/1000))
     else:
         prev_bar_str= []
         
-    df_raw = fetch_data()
-    df = strategy(df_raw) # add fetchingdata to strategy
+    if df_raw is None:
+        df_raw = fetch_data()
+    df = df_raw
+    with metrics.span('strategy'): # O(1) per new bar, no DataFrame columns on the per-bar path
+        state = sync_indicators(df) if not df.empty else None
 
     print(f'RUN BOT  @ {now_dt} ')
-    if  not df.empty:
-        LongEntries = df['LongEntries'].iloc[-1] 
-        LongExit = df['LongExit'].iloc[-1]   
-        ShortEntries = df['ShortEntries'].iloc[-1]
-        ShortExit = df['ShortExit'].iloc[-1]
+    if  state != None:
+        LongEntries, LongExit, ShortEntries, ShortExit = state.signals()
         size = Cal_Size(df)
         
         print('Long : ',LongEntries,LongExit )    
         print('SHORT: ',ShortEntries,ShortExit )
         
-        cur_bar_str =   df.timestamp.iloc[-1]
-        cur_bar_time = int(cur_bar_str.timestamp()*1000) #
+        cur_bar_time = state.last_ts
         new_bar_cond = is_new_bar(prev_bar,cur_bar_time)
         last_position = check_positions()
-        last_price = df['close'].iloc[-1]
+        last_price = state.close
         
-        entry_df = read_log_ontrade() 
+        entry = read_log_ontrade() 
         
-        if not entry_df.empty  :
-            print(f" Latest Position Holding : {entry_df}")     
+        if entry != None:
+            print(f" Latest Position Holding : {entry}")     
             print('----------------------------------------')
         else:
             print(f" Position {robot_symbol} Position Side : {last_position}")
@@ -504,144 +513,120 @@ def trading():
             print('NEW BAR')
             if last_position == 0: 
                 if LongEntries == True:    
-                    entry_df = create_open_market_order(robot_symbol, 'buy', size = size)
-                    entry_df = load_log_ontrade(df, entry_df) 
-                    time.sleep(2)
-                    entry_df.to_csv(log_ontrade)
+                    entry_fill = create_open_market_order(robot_symbol, 'buy', size = size)
+                    entry = load_log_ontrade(df, entry_fill) 
+                    save_log_ontrade(entry)
                     
-                    print("------ Open Long ------")
+                    print("------ Open Long ------" if entry_fill != None else "------ Open Long FAILED ------")
+                    notify_entry('Open Long', entry_fill, size)
 
                 elif ShortEntries == True: 
-                    entry_df = create_open_market_order(robot_symbol,'sell',size=size)
-                    entry_df = load_log_ontrade(df,entry_df) # WITH SL ,TP
-                    entry_df.to_csv(log_ontrade)
-                    time.sleep(2)
+                    entry_fill = create_open_market_order(robot_symbol,'sell',size=size)
+                    entry = load_log_ontrade(df,entry_fill) # WITH SL ,TP
+                    save_log_ontrade(entry)
 
-                    print("------ Open Short ------")
+                    print("------ Open Short ------" if entry_fill != None else "------ Open Short FAILED ------")
+                    notify_entry('Open Short', entry_fill, size)
 
                 else :
                     print('No Positions and Signals')
-                    entry_df = reset_log_ontrade()
+                    entry = reset_log_ontrade()
 
     
             elif last_position == 1:
                 if LongExit == True :
-                    exit_df = close_positions(robot_symbol)
-                    trades_df = close_trades(entry_df,exit_df)
-                    save_trades(read_log_history(),trades_df)
-                    entry_df = load_log_ontrade(df,entry_df) # Close Reset
-                    time.sleep(2)
-                    entry_df.to_csv(log_ontrade)
+                    exit_fill = close_positions(robot_symbol)
+                    trade = close_trades(entry,exit_fill)
+                    save_trades(trade)
+                    entry = load_log_ontrade(df,entry) # Close Reset
+                    save_log_ontrade(entry)
                     print("------ Exit Long ------")
-
-                elif  (not entry_df['symbol'].empty):
-                    if (entry_df['take_profit'][0] != 0.0) and (last_price >= entry_df['take_profit'][0]):
-                        exit_df = close_positions(robot_symbol)
-                        trades_df = close_trades(entry_df,exit_df)
-                        save_trades(read_log_history(),trades_df)
-                        entry_df = load_log_ontrade(df,entry_df) # Close Reset
-                        time.sleep(2)
-                        entry_df.to_csv(log_ontrade)
+                    notify_exit('Exit Long', trade)
+
+                elif entry != None:
+                    if (entry.take_profit != 0.0) and (last_price >= entry.take_profit):
+                        exit_fill = close_positions(robot_symbol)
+                        trade = close_trades(entry,exit_fill)
+                        save_trades(trade)
+                        entry = load_log_ontrade(df,entry) # Close Reset
+                        save_log_ontrade(entry)
                         print('TAKE PROFIT Long')
+                        notify_exit('TAKE PROFIT Long', trade)
                         
-                    elif entry_df['take_profit'][0] == 0.0:
+                    elif entry.take_profit == 0.0:
                         print('Not Set TP')
                     
-                elif (not entry_df['symbol'].empty) :
-                    if (entry_df['stop_loss'][0] != 0.0) and (last_price <= entry_df['stop_loss'][0]) :
-                        exit_df =close_positions(robot_symbol)
-                        trades_df =close_trades(entry_df,exit_df)
-                        save_trades(read_log_history(),trades_df)
-                        entry_df = load_log_ontrade(df,entry_df) # Close Reset
-                        time.sleep(2)
-                        entry_df.to_csv(log_ontrade)
+                elif entry != None:
+                    if (entry.stop_loss != 0.0) and (last_price <= entry.stop_loss) :
+                        exit_fill =close_positions(robot_symbol)
+                        trade =close_trades(entry,exit_fill)
+                        save_trades(trade)
+                        entry = load_log_ontrade(df,entry) # Close Reset
+                        save_log_ontrade(entry)
                         print('STOPLOSS Long')
+                        notify_exit('STOPLOSS Long', trade)
 
-                    elif entry_df['stop_loss'][0] == 0.0:
+                    elif entry.stop_loss == 0.0:
                         print('NOT SET SL')
                         
-                elif ShortEntries == True: # Reverse Signal
-                    exit_df = close_positions(robot_symbol)
-                    trades_df = close_trades(entry_df,exit_df)
-                    save_trades(read_log_history(), trades_df)
-                    entry_df = load_log_ontrade(df, entry_df) # Close Reset
-                    entry_df = create_open_market_order(robot_symbol, 'sell', size=size)
-                    entry_df = load_log_ontrade(df,entry_df) # Calculation tp ,sl to entry_dataframe
-                    time.sleep(2)
-                    entry_df.to_csv(log_ontrade)
-                    print("------ Open Short ------")
-                    
-                else:
+                else: # ShortEntries implies LongExit, an opposite entry always closes above
                     print('Have Long Positions, No signal')
-                    if entry_df['symbol'].empty or entry_df['price'].empty: # have position but lastest_log not calculation 
-                        entry_df = load_log_ontrade(df,entry_df) # Close Reset
-                        time.sleep(2)
-                        entry_df.to_csv(log_ontrade)
-                        print('NEW ', entry_df)
+                    if entry == None: # have position but lastest_log not calculation 
+                        entry = load_log_ontrade(df,entry) # Close Reset
+                        save_log_ontrade(entry)
+                        print('NEW ', entry)
                     else:
-                        print('Holding ', entry_df)
+                        print('Holding ', entry)
                                                 
                         
             elif last_position== -1: # Have Short Positions 
 
                 if ShortExit == True :
-                    exit_df = close_positions(robot_symbol)
-                    trades_df = close_trades(entry_df,exit_df)
-                    save_trades(read_log_history(),trades_df)     
-                    entry_df = load_log_ontrade(df,entry_df) # Close Reset
-                    time.sleep(2)
-                    entry_df.to_csv(log_ontrade)
+                    exit_fill = close_positions(robot_symbol)
+                    trade = close_trades(entry,exit_fill)
+                    save_trades(trade)     
+                    entry = load_log_ontrade(df,entry) # Close Reset
+                    save_log_ontrade(entry)
                     print("------ Exit Short ------")
+                    notify_exit('Exit Short', trade)
 
-                elif (not entry_df['symbol'].empty):
-                    if (entry_df['take_profit'][0] != 0.0) and (last_price <= entry_df['take_profit'][0]):
+                elif entry != None:
+                    if (entry.take_profit != 0.0) and (last_price <= entry.take_profit):
 
-                        exit_df = close_positions(robot_symbol)
-                        trades_df = close_trades(entry_df,exit_df)
-                        save_trades(read_log_history(),trades_df)
-                        entry_df = load_log_ontrade(df,entry_df) # Close Reset
-                        time.sleep(2)
-                        entry_df.to_csv(log_ontrade) 
+                        exit_fill = close_positions(robot_symbol)
+                        trade = close_trades(entry,exit_fill)
+                        save_trades(trade)
+                        entry = load_log_ontrade(df,entry) # Close Reset
+                        save_log_ontrade(entry) 
                         print('TAKE PROFIT Short')
+                        notify_exit('TAKE PROFIT Short', trade)
 
-                    elif entry_df['take_profit'][0] == 0.0:
+                    elif entry.take_profit == 0.0:
                         print('Not Set TP')
                         
-                elif  (not entry_df['symbol'].empty) :
-                    if (entry_df['stop_loss'][0] != 0.0) and (last_price >= entry_df['stop_loss'][0]):
-
-                        exit_df = close_positions(robot_symbol)
-                        trades_df = close_trades(entry_df,exit_df)
-                        save_trades(read_log_history(),trades_df)
-                        entry_df = load_log_ontrade(df,entry_df) # Close Reset
-                        time.sleep(2)
-                        entry_df.to_csv(log_ontrade)
+                elif entry != None:
+                    if (entry.stop_loss != 0.0) and (last_price >= entry.stop_loss):
+
+                        exit_fill = close_positions(robot_symbol)
+                        trade = close_trades(entry,exit_fill)
+                        save_trades(trade)
+                        entry = load_log_ontrade(df,entry) # Close Reset
+                        save_log_ontrade(entry)
                         print('STOPLOSS Short')   
+                        notify_exit('STOPLOSS Short', trade)
 
-                    elif entry_df['stop_loss'][0] == 0.0:
+                    elif entry.stop_loss == 0.0:
                         print('Not Set SL' )
                         
-                elif LongEntries == True: # Reverse Signal
-                    exit_df = close_positions(robot_symbol)
-                    trades_df = close_trades(entry_df,exit_df)
-                    save_trades(read_log_history(),trades_df)
-                    entry_df = load_log_ontrade(df,entry_df) # Close Reset
-                    entry_df = create_open_market_order(robot_symbol,'sell',size=size)
-                    entry_df = load_log_ontrade(df,entry_df) 
-                    time.sleep(2)
-                    entry_df.to_csv(log_ontrade)
-                    print("------ Open Long ------")
-
-                else:
+                else: # LongEntries implies ShortExit, an opposite entry always closes above
                     print('Have Short Positions, No signal')
-                    if entry_df['symbol'].empty or  entry_df['price'].empty: # have position but lastest_log not calculation 
-                        entry_df = load_log_ontrade(df,entry_df) # Close Reset
-                        time.sleep(2)
-                        entry_df.to_csv(log_ontrade)
+                    if entry == None: # have position but lastest_log not calculation 
+                        entry = load_log_ontrade(df,entry) # Close Reset
+                        save_log_ontrade(entry)
 
-                        print('NEW ',entry_df)
+                        print('NEW ',entry)
                     else:
-                        print('Holding' ,entry_df)
+                        print('Holding' ,entry)
 
         else:
             print('SAMEBAR')
@@ -653,16 +638,135 @@ def trading():
         print('Can Not get DataFrame')
         logger.debug('Can Not get DataFrame')
         pass        
+
+    cycle_calls = rest_calls.end_cycle()
+    print(f'REST CALLS {sum(cycle_calls.values())} (avg {rest_calls.average_per_cycle():.1f}/cycle) : {cycle_calls}')
+    logger.info(f'REST calls this cycle {sum(cycle_calls.values())} : {cycle_calls}')
+    write_checkpoint()
+    price_polls = risk_monitor.end_cycle()
+    headroom = rate_budget.headroom(calls_per_unit=rest_calls.average_per_cycle(), unit_seconds=robot_tf_ms/1000,
+                                    poll_calls_per_unit=risk_monitor.average_per_cycle())
+    logger.info(f"Rate budget : {headroom['tokens']:.1f} tokens, used {headroom['used_per_second'] or 0:.2f}/s, room for {headroom['fits']} more bots like this one")
+    retry_summary = retry_policy.cycle_summary()
+    if retry_summary['retries'] or retry_summary['open_circuits']:
+        print(f'RETRIES {retry_summary}')
+        logger.info(f'Retries this cycle : {retry_summary}')
+    for endpoint, n in retry_summary['retries'].items():
+        metrics.inc('exchange_retries_total', 'endpoint', endpoint, n)
+    summary = metrics.end_cycle(bar=prev_bar, rest_calls=cycle_calls, price_polls=price_polls, rate_budget=headroom, **retry_summary)
+    print(f"CYCLE {summary['cycle_seconds']*1000:.0f}ms {summary['stages']}")
     
+# ===============================================================================================================
+# Startup
+# ===============================================================================================================
+@metrics.timed('checkpoint')
+def write_checkpoint():
+    save_checkpoint(log_checkpoint, symbol=robot_symbol, timeframe=robot_timeframe, prev_bar=prev_bar,
+                    candle_buffer=candle_buffer, resampler=resampler, indicator_state=indicator_state, entry=journal.open_position(robot_symbol))
+
+def restore_checkpoint():
+    ''' Resume candles, indicators, prev_bar and open position from the last cycle, False if there is nothing usable '''
+    global candle_buffer, resampler, indicator_state, prev_bar
+    state = load_checkpoint(log_checkpoint, max_age=robot_max_candles * robot_tf_ms / 1000)
+    if state == None or state['symbol'] != robot_symbol or state['timeframe'] != robot_timeframe:
+        return False
+    if state['candle_buffer'].capacity == robot_max_candles:
+        candle_buffer = state['candle_buffer']
+        indicator_state = state['indicator_state']
+        saved = state.get('resampler')
+        if saved != None and (saved.base, saved.timeframes, saved.capacity) == (resampler.base, resampler.timeframes, resampler.capacity):
+            resampler = saved
+    prev_bar = state['prev_bar']
+    if state['entry'] != None and journal.open_position(robot_symbol) == None:
+        journal.set_open_position(state['entry'])
+    print(f'Checkpoint restored, prev bar {prev_bar}, {len(candle_buffer)} candles')
+    logger.info(f'Checkpoint restored, saved at {datetime.fromtimestamp(state["saved_at"])}')
+    return True
+
+def apply_params(path=None):
+    ''' Out-of-sample parameters from optimize.py, the defaults above stay when there is no file for this symbol / timeframe '''
+    global indicator_state, robot_sl_multiply, robot_tp_multiply, robot_riskpertrade
+    path = path or robot_params
+    params = load_params(path, robot_symbol, robot_timeframe)
+    if params == None:
+        return None
+    if (indicator_state.fast, indicator_state.slow, indicator_state.vol_window) != (params['fast'], params['slow'], params['vol_window']):
+        indicator_state = IndicatorState(fast=params['fast'], slow=params['slow'], vol_window=params['vol_window'],
+                                         vol_alpha=indicator_state.vol_alpha) # warms up again from the candle window
+    robot_sl_multiply = params['sl_multiply']
+    robot_tp_multiply = params['tp_multiply']
+    robot_riskpertrade = params['riskpertrade']
+    print(f'Params {path} : EMA {params["fast"]}/{params["slow"]}, STDDEV {params["vol_window"]}, '
+          f'SL x{robot_sl_multiply}, TP x{robot_tp_multiply}, RPT {robot_riskpertrade}')
+    logger.info(f'Params loaded : {params}')
+    return params
+
+def startup():
+    ''' Everything that used to run at import: log file, leverage, exchange status and warm start '''
+    t0 = time.perf_counter()
+    logger.add(log_status, format="{time:YYYY-MM-DD at HH:mm:ss} | {level} | {message}", retention= "30 days", enqueue=True) # Cleanup after some time, written from loguru's own thread
+    notifier.send = create_line_sender()
+    restore_checkpoint()
+    apply_params() # after the checkpoint, its indicator_state may have other periods
+    response = call_exchange('leverage', exchange.private_post_account_leverage, {'leverage': robot_leverage,})
+    status = call_exchange('status', exchange.fetchStatus)
+    print(status)
+    logger.info(f'Status : {status}')
+    startup_seconds = time.perf_counter() - t0
+    print(f'Import {import_seconds:.3f}s, Startup {startup_seconds:.3f}s')
+    logger.info(f'Import {import_seconds:.3f}s, Startup {startup_seconds:.3f}s')
+
+def confirm_bar_closed(timeframe, boundary):
+    ''' Bar ending at boundary is closed once the exchange returns the bar opening at boundary.
+        The first poll of a boundary starts the cycle, so the candle fetch is counted and timed with it '''
+    global cycle_boundary
+    if cycle_boundary != boundary:
+        cycle_boundary = boundary
+        start_cycle()
+    fetch_data()
+    return candle_buffer.last_ts != None and candle_buffer.last_ts >= boundary
+
+def on_bar_close(timeframe, bar_ts):
+    with trade_lock:
+        trading(resampler.frame(robot_timeframe))
+
+def live_price():
+    ''' Polled from the risk monitor thread, retries, breakers and the REST call count kept apart from trading()'s cycle.
+        The monitor counts these polls itself, headroom() adds them to the cost of this bot '''
+    with rest_calls.paused():
+        ticker = get_ticker(robot_symbol, policy=price_retry_policy)
+    return float(ticker['last']) if ticker != None else None
+
+def exit_on_level(reason, price, position):
+    ''' Risk monitor exit, the close sequence of trading() under trade_lock.
+        Skipped if trading() changed the position since the monitor read it '''
+    with trade_lock:
+        account.invalidate()
+        entry = open_position()
+        if entry != position or check_positions() == 0:
+            return
+        exit_fill = close_positions(robot_symbol)
+        trade = close_trades(entry, exit_fill)
+        save_trades(trade)
+        entry = load_log_ontrade(resampler.frame(robot_timeframe), entry) # Close Reset
+        save_log_ontrade(entry)
+        print(f'{reason} {"Long" if position.side == "buy" else "Short"} INTRABAR at {price}')
+        notify_exit(f'{reason} {"Long" if position.side == "buy" else "Short"} intrabar', trade)
+
+risk_monitor = RiskMonitor(price=live_price, position=open_position, exit=exit_on_level, poll=1.0, lock=trade_lock) # 60 ticker calls per 1m bar in a position
+
+import_seconds = time.perf_counter() - _import_started
+
 # ===============================================================================================================
 # Run
 # ===============================================================================================================
-import vectorbt as vbt
-prev_bar = 0
-exit_df = pd.DataFrame()
-logger.info(f'{robot_symbol} BOT, Time Frame {robot_timeframe}, RPT {robot_riskpertrade*100:.2f}, MAX LEVERAGE {robot_leverage}')
-print(f'{robot_symbol} BOT, Time Frame {robot_timeframe}, RPT {robot_riskpertrade*100:.2f}, MAX LEVERAGE {robot_leverage}')
-print('-'*50)
-scheduler = vbt.ScheduleManager()
-scheduler.every('minute', ':02').do(trading)
-scheduler.start()        
\ No newline at end of file
+if __name__ == '__main__':
+    startup()
+    metrics.serve(9108) # Prometheus scrape endpoint on http://127.0.0.1:9108/metrics
+    risk_monitor.start() # SL / TP between bar closes, ticker every second
+    logger.info(f'{robot_symbol} BOT, Time Frame {robot_timeframe}, RPT {robot_riskpertrade*100:.2f}, MAX LEVERAGE {robot_leverage}')
+    print(f'{robot_symbol} BOT, Time Frame {robot_timeframe}, RPT {robot_riskpertrade*100:.2f}, MAX LEVERAGE {robot_leverage}')
+    print('-'*50)
+    scheduler = BarScheduler(server_time=lambda: call_exchange('time', exchange_time_ms, exchange, robot_symbol))
+    scheduler.every(robot_timeframe, on_bar_close, confirm=confirm_bar_closed)
+    scheduler.run_forever()        
\ No newline at end of file
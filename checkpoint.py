@@ -0,0 +1,26 @@
+# ===============================================================================================================
+# Checkpoint
+# Pickle of the in-memory bot state written every cycle so a restarted process resumes within one bar
+# ===============================================================================================================
+import os
+import pickle
+import time
+
+def save_checkpoint(path, **state):
+    ''' Write state atomically: temp file then os.replace, a crash never leaves a half-written checkpoint '''
+    state['saved_at'] = time.time()
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+def load_checkpoint(path, max_age=None):
+    ''' Saved state dict, None if there is no checkpoint, it cannot be read or it is older than max_age seconds '''
+    try:
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    if max_age is not None and time.time() - state.get('saved_at', 0) > max_age:
+        return None
+    return state
@@ -0,0 +1,236 @@
+# ===============================================================================================================
+# Async multi-symbol engine
+# One ccxt.async_support client (one connection pool, one rate limiter) running fetch -> strategy -> order
+# for every symbol of the universe concurrently on a single event loop
+# ===============================================================================================================
+import asyncio
+import configparser
+import os
+import time
+
+import ccxt.async_support as ccxt_async
+from loguru import logger
+
+from account import AccountSnapshot
+from candles import CandleBuffer, timeframe_to_ms
+from indicators import IndicatorState
+from journal import TradeJournal
+from markets import MarketSpecCache
+from orders import AsyncFillTracker
+from records import ClosedTrade, Fill, Position
+from retry import RetryPolicy, next_bar_deadline
+
+def position_size(cash, sl_distance, riskpertrade, size_limit, min_size):
+    ''' Cal_Size() rule: risk riskpertrade of cash over the stop distance, clamped to [min_size, size_limit] '''
+    size = (riskpertrade * cash) / sl_distance
+    if size > size_limit:
+        size = size_limit
+    elif size < min_size:
+        size = min_size
+    return size
+
+def decide(position, signals, last_price, entry):
+    ''' Action for one closed bar: 'open_long', 'open_short', 'close' or None.
+        position is 1 / -1 / 0, signals is (LongEntries, LongExit, ShortEntries, ShortExit),
+        entry is the open position record with stop_loss / take_profit (0.0 = not set) or None.
+        There is no reverse: the opposite entry implies the exit (ShortEntries means close < ema1 < ema2,
+        so LongExit), and trading() checks the exit first, closing and staying flat '''
+    LongEntries, LongExit, ShortEntries, ShortExit = signals
+    if position == 0:
+        if LongEntries:
+            return 'open_long'
+        if ShortEntries:
+            return 'open_short'
+        return None
+    exit_signal = LongExit if position == 1 else ShortExit
+    if exit_signal:
+        return 'close'
+    if entry is not None:
+        tp, sl = entry.get('take_profit', 0.0), entry.get('stop_loss', 0.0)
+        if tp and (last_price - tp) * position >= 0:
+            return 'close'
+        if sl and (last_price - sl) * position <= 0:
+            return 'close'
+    return None
+
+def entry_record(symbol, fill, side, sl_distance):
+    ''' Open position record of an entry fill, stamped in epoch seconds like the script's journal rows
+        (fills carry the exchange's ms timestamp) '''
+    sign = 1 if side == 'buy' else -1
+    return dict(fill, symbol=symbol, timestamp=int(fill['timestamp'] / 1000),
+                stop_loss=fill['price'] - sign * sl_distance, take_profit=0.0)
+
+class SymbolState:
+    ''' Everything the engine keeps per symbol: candle window, indicators, open position record and trade journal '''
+
+    def __init__(self, symbol, timeframe, max_candles, log_dir='.'):
+        self.symbol = symbol
+        self.candles = CandleBuffer(max_candles, timeframe)
+        self.indicators = IndicatorState()
+        self.prev_bar = 0
+        name = symbol.replace('/', '_').replace(':', '_')
+        self.journal = TradeJournal(os.path.join(log_dir, f'trades_{name}.db'))
+        self.entry = self.journal.open_position(symbol) # resumes the position held before a restart
+
+    def save_entry(self):
+        if self.entry is not None:
+            self.journal.set_open_position(self.entry)
+        else:
+            self.journal.clear_open_position(self.symbol)
+
+    def save_trade(self, exit_fill):
+        trade = ClosedTrade(Position.from_dict(self.entry), Fill.from_dict(dict(exit_fill, symbol=self.symbol)))
+        self.journal.append_trade(trade.to_dict())
+
+class AsyncEngine:
+    ''' Runs the per-bar pipeline for N symbols concurrently over one shared exchange client '''
+
+    def __init__(self, exchange, symbols, timeframe='1m', max_candles=100, riskpertrade=0.0001,
+                 position_size_limit=1, sl_multiply=1.2, log_dir='.'):
+        self.exchange = exchange
+        self.timeframe = timeframe
+        self.tf_ms = timeframe_to_ms(timeframe)
+        self.max_candles = max_candles
+        self.riskpertrade = riskpertrade
+        self.position_size_limit = position_size_limit
+        self.sl_multiply = sl_multiply
+        self.states = {s: SymbolState(s, timeframe, max_candles, log_dir) for s in symbols}
+        self.account = AccountSnapshot(exchange)
+        self.market_specs = MarketSpecCache(exchange, ttl=float('inf')) # reloaded explicitly in start()
+        self.retry_policy = RetryPolicy()
+        self.fill_tracker = AsyncFillTracker(exchange)
+
+    async def call(self, endpoint, fn, *args, max_attempts=None, **kwargs):
+        ''' Async call_exchange(): retry through the shared policy, None once it gives up '''
+        try:
+            return await self.retry_policy.acall(endpoint, fn, *args, deadline=next_bar_deadline(self.tf_ms),
+                                                 max_attempts=max_attempts, **kwargs)
+        except Exception as e:
+            logger.debug(f'Cant get {endpoint}, {type(e).__name__} : {str(e)}')
+            return None
+
+    async def start(self, leverage=None):
+        self.market_specs.load(await self.exchange.load_markets(reload=True))
+        if leverage is not None:
+            await self.exchange.private_post_account_leverage({'leverage': leverage})
+
+    async def refresh_account(self):
+        ''' One positions and one balances request for the whole universe, False if either failed '''
+        positions, balances = await asyncio.gather(
+            self.call('positions', self.exchange.private_get_positions),
+            self.call('wallet', self.exchange.privateGetWalletBalances),
+        )
+        self.account.invalidate()
+        if positions is None or balances is None: # an empty position list would read as flat and open on top
+            return False
+        self.account.load(positions['result'], balances['result'])
+        return True
+
+    async def fetch_candles(self, state):
+        buf = state.candles
+        if len(buf) > 0:
+            bars = await self.call('ohlcv', self.exchange.fetch_ohlcv, state.symbol, self.timeframe, since=buf.last_ts, limit=self.max_candles)
+            if bars is None or (len(bars) < self.max_candles and buf.update(bars)):
+                return
+        bars = await self.call('ohlcv', self.exchange.fetch_ohlcv, state.symbol, self.timeframe, limit=self.max_candles)
+        if bars is not None:
+            buf.seed(bars)
+
+    async def market_order(self, symbol, side, size, params={}):
+        order = await self.call('create_order', self.exchange.create_order, symbol, 'market', side, size, params=params, max_attempts=1)
+        if order is None:
+            return None
+        return await self.call('fill', self.fill_tracker.track, order['id'], symbol, since=order['timestamp'] or time.time() * 1000)
+
+    async def open_position(self, state, side, size, sl_distance):
+        fill = await self.market_order(state.symbol, side, size)
+        if fill is None:
+            return
+        state.entry = entry_record(state.symbol, fill, side, sl_distance)
+        state.save_entry()
+        logger.info(f'{state.symbol} OPEN {side} {fill["amount"]} @ {fill["price"]}')
+
+    async def close_position(self, state):
+        pos = self.account.position(state.symbol)
+        netsize = float(pos['netSize']) if pos else 0.0
+        if netsize == 0:
+            state.entry = None
+            state.save_entry()
+            return
+        fill = await self.market_order(state.symbol, 'sell' if netsize > 0 else 'buy', abs(netsize))
+        if fill is None:
+            return
+        if state.entry is not None:
+            state.save_trade(fill)
+        state.entry = None
+        state.save_entry()
+        logger.info(f'{state.symbol} CLOSE {fill["amount"]} @ {fill["price"]}')
+
+    async def run_symbol(self, state):
+        await self.fetch_candles(state)
+        closed = state.candles.to_array()
+        if len(closed) == 0:
+            return
+        state.indicators.sync(closed[:, 0], closed[:, 4])
+        cur_bar = int(closed[-1, 0])
+        if cur_bar == state.prev_bar:
+            return
+        state.prev_bar = cur_bar
+        position = self.account.position_side(state.symbol) or 0
+        last_price = float(closed[-1, 4])
+        action = decide(position, state.indicators.signals(), last_price, state.entry)
+        if action is None:
+            return
+        sl_distance = state.indicators.vol * self.sl_multiply
+        if action == 'close':
+            await self.close_position(state)
+            return
+        cash = self.account.cash()
+        if cash is None:
+            return
+        min_size = self.market_specs.min_size(state.symbol)
+        size = self.market_specs.round_size(state.symbol, position_size(cash, sl_distance, self.riskpertrade, self.position_size_limit, min_size))
+        await self.open_position(state, 'buy' if action == 'open_long' else 'sell', size, sl_distance)
+
+    async def run_cycle(self):
+        ''' One bar for the whole universe, returns the cycle duration in seconds '''
+        t0 = time.perf_counter()
+        self.retry_policy.start_cycle()
+        if not await self.refresh_account(): # same as trading() when check_positions() is None
+            logger.debug('Cant load positions / balances, skip cycle')
+            return time.perf_counter() - t0
+        results = await asyncio.gather(*(self.run_symbol(s) for s in self.states.values()), return_exceptions=True)
+        for state, res in zip(self.states.values(), results):
+            if isinstance(res, Exception):
+                logger.debug(f'{state.symbol} cycle failed : {type(res).__name__} {res}')
+        elapsed = time.perf_counter() - t0
+        logger.info(f'Cycle {len(self.states)} symbols in {elapsed:.3f}s, retries {self.retry_policy.cycle_summary()}')
+        return elapsed
+
+    async def run_forever(self, delay_after_close=0.5):
+        while True:
+            now_ms = time.time() * 1000
+            await asyncio.sleep((self.tf_ms - now_ms % self.tf_ms) / 1000 + delay_after_close)
+            await self.run_cycle()
+
+async def main(symbols, timeframe='1m', leverage=20, subaccount='testAPI'):
+    config = configparser.ConfigParser()
+    config.read('key.ini')
+    exchange = ccxt_async.ftx({
+        'apiKey': config['key']['apikey'],
+        'secret': config['key']['secretkey'],
+        'enableRateLimit': True,
+        'option': {'defaultType': 'future', 'adjustForTimeDifference': True},
+    })
+    exchange.headers = {'FTX-SUBACCOUNT': subaccount}
+    engine = AsyncEngine(exchange, symbols, timeframe)
+    try:
+        await engine.start(leverage)
+        await engine.run_forever()
+    finally:
+        await exchange.close()
+
+if __name__ == '__main__':
+    import sys
+    logger.add('log_engine.log', format="{time:YYYY-MM-DD at HH:mm:ss} | {level} | {message}", retention="30 days")
+    asyncio.run(main(sys.argv[1:] or ['BTC-PERP', 'ETH-PERP']))
@@ -0,0 +1,199 @@
+# ===============================================================================================================
+# Subaccount fan-out
+# One process computes the signal once per bar and executes it on N subaccounts concurrently, every client
+# sharing one connection pool, each account with its own snapshot, sizing and trade journal
+# ===============================================================================================================
+import asyncio
+import configparser
+import time
+from collections import deque
+
+import ccxt.async_support as ccxt_async
+from loguru import logger
+
+from account import AccountSnapshot
+from candles import CandleBuffer, timeframe_to_ms
+from engine import decide, entry_record, position_size
+from indicators import IndicatorState
+from journal import TradeJournal
+from markets import MarketSpecCache
+from orders import AsyncFillTracker, plan_order, split_fill
+from records import ClosedTrade, Fill, Position
+from retry import RetryPolicy, next_bar_deadline
+
+class SubAccount:
+    ''' Per-account state: client with the FTX-SUBACCOUNT header, positions / wallet snapshot, fills, journal and
+        its own retry policy, so one failing account cannot open the circuit breakers of the others '''
+
+    def __init__(self, name, exchange, journal_path=None):
+        self.name = name
+        self.exchange = exchange
+        self.retry_policy = RetryPolicy()
+        self.account = AccountSnapshot(exchange)
+        self.fill_tracker = AsyncFillTracker(exchange)
+        self.journal = TradeJournal(journal_path or f'trades_{name}.db')
+        self.latencies = deque(maxlen=1000) # seconds from signal to this account's last fill
+
+class FanOut:
+    ''' fetch -> indicators -> signal once per bar on data_exchange, then decide / size / order per account '''
+
+    def __init__(self, data_exchange, accounts, symbol='BTC-PERP', timeframe='1m', max_candles=100, riskpertrade=0.0001,
+                 position_size_limit=1, sl_multiply=1.2):
+        self.exchange = data_exchange
+        self.accounts = accounts
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.tf_ms = timeframe_to_ms(timeframe)
+        self.max_candles = max_candles
+        self.riskpertrade = riskpertrade
+        self.position_size_limit = position_size_limit
+        self.sl_multiply = sl_multiply
+        self.candles = CandleBuffer(max_candles, timeframe)
+        self.indicators = IndicatorState()
+        self.market_specs = MarketSpecCache(data_exchange, ttl=float('inf')) # same market for every account
+        self.retry_policy = RetryPolicy() # market data calls, each account retries through its own
+        self.prev_bar = 0
+        self.worst = deque(maxlen=1000) # worst signal -> last fill seconds per bar that traded
+
+    async def call(self, endpoint, fn, *args, max_attempts=None, policy=None, **kwargs):
+        ''' Async call_exchange(): retry through policy, the market data one by default, None once it gives up '''
+        try:
+            return await (policy or self.retry_policy).acall(endpoint, fn, *args, deadline=next_bar_deadline(self.tf_ms),
+                                                 max_attempts=max_attempts, **kwargs)
+        except Exception as e:
+            logger.debug(f'Cant get {endpoint}, {type(e).__name__} : {str(e)}')
+            return None
+
+    async def start(self, leverage=None):
+        self.market_specs.load(await self.exchange.load_markets(reload=True))
+        if leverage is not None:
+            await asyncio.gather(*(self.call('leverage', acc.exchange.private_post_account_leverage, {'leverage': leverage},
+                                             policy=acc.retry_policy) for acc in self.accounts))
+
+    async def signal(self):
+        ''' (bar_ts, signals, last_price, sl_distance) of a newly closed bar, None on the same bar or no data '''
+        bars = None
+        if len(self.candles) > 0:
+            bars = await self.call('ohlcv', self.exchange.fetch_ohlcv, self.symbol, self.timeframe, since=self.candles.last_ts, limit=self.max_candles)
+        if bars is None or len(bars) >= self.max_candles or not self.candles.update(bars):
+            bars = await self.call('ohlcv', self.exchange.fetch_ohlcv, self.symbol, self.timeframe, limit=self.max_candles)
+            if bars is None:
+                return None
+            self.candles.seed(bars)
+        closed = self.candles.to_array()
+        if len(closed) == 0 or int(closed[-1, 0]) == self.prev_bar:
+            return None
+        self.prev_bar = int(closed[-1, 0])
+        self.indicators.sync(closed[:, 0], closed[:, 4])
+        return self.prev_bar, self.indicators.signals(), float(closed[-1, 4]), self.indicators.vol * self.sl_multiply
+
+    async def run_account(self, acc, signals, last_price, sl_distance, t_signal):
+        ''' Decide and trade one account, returns seconds from t_signal to its last fill, None if it did not trade '''
+        positions, balances = await asyncio.gather(
+            self.call('positions', acc.exchange.private_get_positions, policy=acc.retry_policy),
+            self.call('wallet', acc.exchange.privateGetWalletBalances, policy=acc.retry_policy),
+        )
+        acc.account.invalidate()
+        if positions is None or balances is None: # this account sits the bar out rather than reading as flat
+            logger.debug(f'{acc.name} cant load positions / balances, skip')
+            return None
+        acc.account.load(positions['result'], balances['result'])
+        pos = acc.account.position(self.symbol)
+        netsize = float(pos['netSize']) if pos else 0.0
+        position = (netsize > 0) - (netsize < 0)
+        entry = acc.journal.open_position(self.symbol)
+        action = decide(position, signals, last_price, entry)
+        if action is None:
+            return None
+        cash = acc.account.cash()
+        if cash is None:
+            return None
+        size = self.market_specs.round_size(self.symbol, position_size(
+            cash, sl_distance, self.riskpertrade, self.position_size_limit, self.market_specs.min_size(self.symbol)))
+        target = {'open_long': size, 'open_short': -size, 'close': 0.0}[action]
+        side, amount, closing = plan_order(netsize, target)
+        order = await self.call('create_order', acc.exchange.create_order, self.symbol, 'market', side,
+                                self.market_specs.round_size(self.symbol, amount), max_attempts=1, policy=acc.retry_policy)
+        if order is None:
+            return None
+        fill = await self.call('fill', acc.fill_tracker.track, order['id'], self.symbol, since=order['timestamp'] or time.time() * 1000,
+                               policy=acc.retry_policy)
+        latency = time.perf_counter() - t_signal
+        if fill is None:
+            logger.debug(f'{acc.name} {action} order {order["id"]} fill unknown')
+            return latency
+        exit_fill, entry_fill = split_fill(fill, closing)
+        if exit_fill is not None and entry is not None:
+            acc.journal.append_trade(ClosedTrade(Position.from_dict(entry), Fill.from_dict(exit_fill)).to_dict())
+        if entry_fill is not None:
+            acc.journal.set_open_position(entry_record(self.symbol, entry_fill, side, sl_distance))
+        elif closing:
+            acc.journal.clear_open_position(self.symbol)
+        acc.latencies.append(latency)
+        logger.info(f'{acc.name} {action} {side} {fill["amount"]} @ {fill["price"]}, {latency*1000:.0f}ms after signal')
+        return latency
+
+    async def run_cycle(self):
+        ''' One bar: signal once, all accounts concurrently. Returns {account: seconds to last fill or None} '''
+        for policy in [self.retry_policy] + [acc.retry_policy for acc in self.accounts]:
+            policy.start_cycle()
+        signal = await self.signal()
+        if signal is None:
+            return {}
+        bar, signals, last_price, sl_distance = signal
+        t_signal = time.perf_counter()
+        results = await asyncio.gather(*(self.run_account(acc, signals, last_price, sl_distance, t_signal) for acc in self.accounts),
+                                       return_exceptions=True)
+        latencies = {}
+        for acc, res in zip(self.accounts, results):
+            if isinstance(res, Exception):
+                logger.debug(f'{acc.name} cycle failed : {type(res).__name__} {res}')
+                res = None
+            latencies[acc.name] = res
+        traded = [v for v in latencies.values() if v is not None]
+        if traded:
+            self.worst.append(max(traded))
+            retries = {}
+            for acc in self.accounts:
+                summary = acc.retry_policy.cycle_summary()
+                if summary['retries'] or summary['open_circuits']:
+                    retries[acc.name] = summary
+            logger.info(f'Bar {bar} signal {signals} -> {len(traded)}/{len(self.accounts)} accounts filled, '
+                        f'worst {max(traded)*1000:.0f}ms, retries {self.retry_policy.cycle_summary()}, accounts {retries}')
+        return latencies
+
+    async def run_forever(self, delay_after_close=0.5):
+        while True:
+            now_ms = time.time() * 1000
+            await asyncio.sleep((self.tf_ms - now_ms % self.tf_ms) / 1000 + delay_after_close)
+            await self.run_cycle()
+
+async def main(subaccounts, symbol='BTC-PERP', timeframe='1m', leverage=20, pool_size=100):
+    import aiohttp
+    config = configparser.ConfigParser()
+    config.read('key.ini')
+    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=pool_size, ttl_dns_cache=300)) # one keep-alive pool for every client
+
+    def client(subaccount=None):
+        exchange = ccxt_async.ftx({
+            'apiKey': config['key']['apikey'],
+            'secret': config['key']['secretkey'],
+            'enableRateLimit': True,
+            'session': session,
+            'option': {'defaultType': 'future', 'adjustForTimeDifference': True},
+        })
+        if subaccount:
+            exchange.headers = {'FTX-SUBACCOUNT': subaccount}
+        return exchange
+    accounts = [SubAccount(name, client(name)) for name in subaccounts]
+    fanout = FanOut(client(), accounts, symbol, timeframe)
+    try:
+        await fanout.start(leverage)
+        await fanout.run_forever()
+    finally:
+        await session.close()
+
+if __name__ == '__main__':
+    import sys
+    logger.add('log_fanout.log', format="{time:YYYY-MM-DD at HH:mm:ss} | {level} | {message}", retention="30 days")
+    asyncio.run(main(sys.argv[1:] or ['testAPI']))
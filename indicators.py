@@ -0,0 +1,186 @@
+# ===============================================================================================================
+# Streaming indicators
+# O(1)-per-bar EMA, rolling STDDEV and EWM smoothing that reproduce the TA-Lib / pandas batch results
+# ===============================================================================================================
+import math
+from collections import deque
+
+import numpy as np
+
+def entry_exit_signals(close, ema1, ema1_prev, ema2):
+    ''' EMA cross rule used by strategy(), works on scalars and on broadcast numpy arrays alike '''
+    long_entries = (ema1 > ema2) & (ema1_prev < ema2) & (close > ema1)
+    long_exit = close < ema2
+    short_entries = (ema1 < ema2) & (ema1_prev > ema2) & (close < ema1)
+    short_exit = close > ema2
+    return long_entries, long_exit, short_entries, short_exit
+
+class StreamingEMA:
+    ''' Same as ta.EMA: seeded with the SMA of the first n values, NaN before that '''
+
+    def __init__(self, period):
+        self.period = period
+        self.k = 2.0 / (period + 1)
+        self.value = math.nan
+        self._count = 0
+        self._seed_sum = 0.0
+
+    def update(self, x):
+        if self._count < self.period:
+            self._count += 1
+            self._seed_sum += x
+            if self._count == self.period:
+                self.value = self._seed_sum / self.period
+        else:
+            self.value += self.k * (x - self.value)
+        return self.value
+
+class StreamingSTDDEV:
+    ''' Same as ta.STDDEV(x, n, nbdev=1): population standard deviation over the last n values.
+        The running sums are of x - shift, shift a recent mean, so sumsq / n - mean^2 does not cancel at price scale '''
+
+    _shift = 0.0 # instances restored from checkpoints written before the shift hold raw sums
+
+    def __init__(self, period):
+        self.period = period
+        self.value = math.nan
+        self._window = deque(maxlen=period)
+        self._shift = None
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._since_refresh = 0
+
+    def _refresh(self):
+        ''' Re-center on the window mean and recompute the sums exactly, bounds drift and cancellation '''
+        self._shift = math.fsum(self._window) / len(self._window)
+        self._sum = math.fsum(v - self._shift for v in self._window)
+        self._sumsq = math.fsum((v - self._shift) ** 2 for v in self._window)
+        self._since_refresh = 0
+
+    def update(self, x):
+        if self._shift is None:
+            self._shift = x
+        if len(self._window) == self.period:
+            old = self._window[0] - self._shift
+            self._sum -= old
+            self._sumsq -= old * old
+        self._window.append(x)
+        d = x - self._shift
+        self._sum += d
+        self._sumsq += d * d
+        self._since_refresh += 1
+        if self._since_refresh >= self.period * 4:
+            self._refresh()
+        if len(self._window) == self.period:
+            mean = self._sum / self.period
+            self.value = math.sqrt(max(self._sumsq / self.period - mean * mean, 0.0))
+        return self.value
+
+class StreamingEWM:
+    ''' Same as pandas Series.ewm(alpha=alpha).mean() (adjust=True), leading NaN are skipped '''
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.value = math.nan
+        self._num = 0.0
+        self._den = 0.0
+
+    def update(self, x):
+        if math.isnan(x):
+            if self._den > 0.0: # pandas keeps decaying the weights over NaN gaps
+                self._num *= 1.0 - self.alpha
+                self._den *= 1.0 - self.alpha
+            return self.value
+        self._num = x + (1.0 - self.alpha) * self._num
+        self._den = 1.0 + (1.0 - self.alpha) * self._den
+        self.value = self._num / self._den
+        return self.value
+
+class IndicatorState:
+    ''' Everything strategy(), Cal_SLdistance() and Cal_TPdistance() need, advanced one closed bar at a time '''
+
+    def __init__(self, fast=12, slow=26, vol_window=30, vol_alpha=0.96):
+        self.fast = fast
+        self.slow = slow
+        self.vol_window = vol_window
+        self.vol_alpha = vol_alpha
+        self.reset()
+
+    def reset(self):
+        self._ema1 = StreamingEMA(self.fast)
+        self._ema2 = StreamingEMA(self.slow)
+        self._std = StreamingSTDDEV(self.vol_window)
+        self._vol = StreamingEWM(self.vol_alpha)
+        self.ema1_prev = math.nan
+        self.close = math.nan
+        self.last_ts = None
+        self.bars = 0
+
+    @property
+    def ema1(self):
+        return self._ema1.value
+
+    @property
+    def ema2(self):
+        return self._ema2.value
+
+    @property
+    def vol(self):
+        ''' ta.STDDEV(close, vol_window).ewm(alpha=vol_alpha).mean() at the last bar '''
+        return self._vol.value
+
+    def update(self, ts, close):
+        ''' Add one closed bar '''
+        self.ema1_prev = self._ema1.value
+        self._ema1.update(close)
+        self._ema2.update(close)
+        self._vol.update(self._std.update(close))
+        self.close = close
+        self.last_ts = int(ts)
+        self.bars += 1
+
+    def sync(self, timestamps, closes):
+        ''' Feed only the bars newer than last_ts, replay the whole window if it no longer contains last_ts '''
+        start = 0
+        if self.last_ts is not None:
+            idx = int(np.searchsorted(timestamps, self.last_ts))
+            if idx < len(timestamps) and timestamps[idx] == self.last_ts:
+                start = idx + 1
+            else:
+                self.reset()
+        for i in range(start, len(timestamps)):
+            self.update(timestamps[i], float(closes[i]))
+        return len(timestamps) - start
+
+    def signals(self):
+        ''' (LongEntries, LongExit, ShortEntries, ShortExit) for the last bar '''
+        return tuple(bool(s) for s in entry_exit_signals(self.close, self.ema1, self.ema1_prev, self.ema2))
+
+def batch_volatility(close, window=30, alpha=0.96):
+    ''' ta.STDDEV(close, window).ewm(alpha=alpha).mean() as a numpy array, the batch twin of IndicatorState.vol '''
+    import talib as ta
+    import pandas as pd
+
+    return pd.Series(ta.STDDEV(np.asarray(close, dtype=np.float64), window)).ewm(alpha=alpha).mean().to_numpy()
+
+def verify_against_talib(close, fast=12, slow=26, vol_window=30, vol_alpha=0.96, rtol=1e-9, atol=1e-12):
+    ''' Stream close through IndicatorState and compare every bar with the TA-Lib batch computation.
+        atol is relative to the largest price, the rounding of both sides grows with it '''
+    import talib as ta
+
+    close = np.asarray(close, dtype=np.float64)
+    state = IndicatorState(fast, slow, vol_window, vol_alpha)
+    stream = np.empty((len(close), 3))
+    for i, c in enumerate(close):
+        state.update(i, c)
+        stream[i] = state.ema1, state.ema2, state.vol
+    batch = np.column_stack([
+        ta.EMA(close, fast),
+        ta.EMA(close, slow),
+        batch_volatility(close, vol_window, vol_alpha),
+    ])
+    ok = np.allclose(stream, batch, rtol=rtol, atol=atol * np.nanmax(np.abs(close)), equal_nan=True)
+    if not ok:
+        diff = np.nanmax(np.abs(stream - batch), axis=0)
+        print(f'Indicator mismatch, max abs diff ema1 {diff[0]} ema2 {diff[1]} vol {diff[2]}')
+    return ok
@@ -0,0 +1,180 @@
+# ===============================================================================================================
+# Trade journal
+# SQLite (WAL) store replacing log_history.csv / log_ontrade.csv: O(1) appends for closed trades,
+# atomic upsert of the open position and indexed queries by symbol, side and time
+# ===============================================================================================================
+import sqlite3
+import time
+
+import pandas as pd
+
+ONTRADE_COLUMNS = ['symbol', 'timestamp', 'side', 'price', 'amount', 'cost', 'stop_loss', 'take_profit']
+TRADE_COLUMNS = ONTRADE_COLUMNS + ['timestamp_exit', 'side_exit', 'price_exit', 'amount_exit', 'cost_exit', 'diff_price', 'pnl']
+# log_ontrade.csv columns of the first entry written by the old script, before load_log_ontrade() renamed them
+LEGACY_ONTRADE_COLUMNS = {'entry_time': 'timestamp', 'entry_price': 'price', 'position_side': 'side', 'position_amount': 'amount'}
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS trades (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    symbol TEXT NOT NULL, timestamp REAL, side TEXT, price REAL, amount REAL, cost REAL,
+    stop_loss REAL, take_profit REAL,
+    timestamp_exit REAL, side_exit TEXT, price_exit REAL, amount_exit REAL, cost_exit REAL,
+    diff_price REAL, pnl REAL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS trades_symbol_ts ON trades (symbol, timestamp);
+CREATE INDEX IF NOT EXISTS trades_side_ts ON trades (side, timestamp);
+CREATE INDEX IF NOT EXISTS trades_exit_ts ON trades (timestamp_exit);
+CREATE TABLE IF NOT EXISTS open_positions (
+    symbol TEXT PRIMARY KEY, timestamp REAL, side TEXT, price REAL, amount REAL, cost REAL,
+    stop_loss REAL, take_profit REAL, updated_at REAL NOT NULL
+);
+'''
+
+def _value(v):
+    ''' numpy / pandas scalars to plain python for sqlite, timestamps to epoch seconds '''
+    if isinstance(v, pd.Timestamp):
+        return v.timestamp()
+    if hasattr(v, 'item'):
+        v = v.item()
+    if isinstance(v, float) and v != v:
+        return None
+    return v
+
+def _ontrade_record(record, symbol=None):
+    ''' log_ontrade.csv row in either layout -> open_positions record, the old entry_time is a candle datetime
+        string and the old layout has no cost. Rows without price or amount raise ValueError '''
+    record = dict(record)
+    for old, new in LEGACY_ONTRADE_COLUMNS.items():
+        if _value(record.get(new)) is None and _value(record.get(old)) is not None:
+            record[new] = record[old]
+    if symbol is not None:
+        record['symbol'] = symbol
+    if _value(record.get('price')) is None or _value(record.get('amount')) is None:
+        raise ValueError(f'log_ontrade row without price / amount, cannot import it as an open position : {record}')
+    if isinstance(record.get('timestamp'), str):
+        record['timestamp'] = pd.Timestamp(record['timestamp']).timestamp()
+    if _value(record.get('cost')) is None:
+        record['cost'] = float(record['amount']) * float(record['price'])
+    return record
+
+class TradeJournal:
+    ''' One sqlite file per bot, safe against crashes mid-write thanks to WAL journaling '''
+
+    def __init__(self, path='trades.db'):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False) # autocommit, one statement = one transaction
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    # ----- closed trades -----------------------------------------------------------------------------------------
+    def append_trade(self, record):
+        ''' Insert one closed trade (close_trades() row layout), unknown keys are ignored '''
+        cols = [c for c in TRADE_COLUMNS if c in record]
+        values = [_value(record[c]) for c in cols] + [time.time()]
+        self.conn.execute(f'INSERT INTO trades ({", ".join(cols)}, recorded_at) VALUES ({", ".join("?" * (len(cols) + 1))})', values)
+
+    def append_trades(self, df):
+        if df.empty:
+            return 0
+        cols = [c for c in TRADE_COLUMNS if c in df.columns]
+        now = time.time()
+        rows = [[_value(v) for v in row] + [now] for row in df[cols].itertuples(index=False, name=None)]
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany(f'INSERT INTO trades ({", ".join(cols)}, recorded_at) VALUES ({", ".join("?" * (len(cols) + 1))})', rows)
+        return len(rows)
+
+    def trades(self, symbol=None, side=None, since=None, until=None):
+        ''' Closed trades filtered by symbol, entry side and entry timestamp range, oldest first '''
+        where, args = [], []
+        for clause, value in (('symbol = ?', symbol), ('side = ?', side), ('timestamp >= ?', since), ('timestamp < ?', until)):
+            if value is not None:
+                where.append(clause)
+                args.append(value)
+        sql = f'SELECT {", ".join(TRADE_COLUMNS)} FROM trades'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        return pd.read_sql_query(sql + ' ORDER BY timestamp', self.conn, params=args)
+
+    # ----- open position -----------------------------------------------------------------------------------------
+    def set_open_position(self, record):
+        ''' Atomically replace the open position of record['symbol'] '''
+        values = [_value(record.get(c)) for c in ONTRADE_COLUMNS] + [time.time()]
+        self.conn.execute(f'INSERT OR REPLACE INTO open_positions ({", ".join(ONTRADE_COLUMNS)}, updated_at) VALUES ({", ".join("?" * (len(ONTRADE_COLUMNS) + 1))})', values)
+
+    def clear_open_position(self, symbol):
+        self.conn.execute('DELETE FROM open_positions WHERE symbol = ?', (symbol,))
+
+    def open_position(self, symbol):
+        ''' Open position record as a dict, None if flat '''
+        row = self.conn.execute(f'SELECT {", ".join(ONTRADE_COLUMNS)} FROM open_positions WHERE symbol = ?', (symbol,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(ONTRADE_COLUMNS, row))
+
+    # ----- migration ---------------------------------------------------------------------------------------------
+    def import_csv(self, log_history=None, log_ontrade=None, symbol=None):
+        ''' One-time import of the old log_history.csv / log_ontrade.csv files, returns imported trade count.
+            The open position is checked before anything is written '''
+        records = []
+        if log_ontrade is not None:
+            ontrade = pd.read_csv(log_ontrade)
+            records = [_ontrade_record(r, symbol) for r in ontrade.dropna(subset=['symbol']).to_dict('records')]
+        imported = 0
+        if log_history is not None:
+            history = pd.read_csv(log_history)
+            imported = self.append_trades(history.dropna(subset=['symbol']))
+        for record in records:
+            self.set_open_position(record)
+        return imported
+
+def verify_legacy_import(workdir=None):
+    ''' Import a log_ontrade.csv in the old first-entry layout, read the position back the way the bot does
+        and check that a row without a price is refused '''
+    import os
+    import tempfile
+    from records import Position
+
+    workdir = workdir or tempfile.mkdtemp(prefix='journal_')
+    path = os.path.join(workdir, 'log_ontrade.csv')
+    opened = pd.Timestamp('2022-03-01 12:34:00')
+    legacy = {'symbol': 'BTC-PERP', 'entry_time': opened, 'entry_price': 43000.0, 'position_side': 'buy',
+              'position_amount': 0.01, 'stop_loss': 42500.0, 'take_profit': 0.0}
+    pd.DataFrame([legacy]).to_csv(path) # with the index column, as the old script wrote it
+    journal = TradeJournal(os.path.join(workdir, 'trades.db'))
+    try:
+        journal.import_csv(log_ontrade=path, symbol='BTC-PERP')
+        position = Position.from_dict(journal.open_position('BTC-PERP'))
+        expected = Position('BTC-PERP', opened.timestamp(), 'buy', 43000.0, 0.01, 430.0, 42500.0, 0.0)
+        ok = position == expected
+        if not ok:
+            print(f'Legacy import mismatch, got {position}, expected {expected}')
+        pd.DataFrame([dict(legacy, entry_price=None)]).to_csv(path)
+        try:
+            journal.import_csv(log_ontrade=path, symbol='ETH-PERP')
+            print('Legacy row without a price was imported')
+            ok = False
+        except ValueError:
+            ok &= journal.open_position('ETH-PERP') is None
+    finally:
+        journal.close()
+    return ok
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Import old csv logs into the trade journal')
+    parser.add_argument('--db', default='trades.db')
+    parser.add_argument('--history', default='log_history.csv')
+    parser.add_argument('--ontrade', default='log_ontrade.csv')
+    parser.add_argument('--symbol', default=None, help='symbol to store the open position under, e.g. BTC-PERP')
+    parser.add_argument('--verify', action='store_true', help='check the import of the old log_ontrade.csv layout and exit')
+    args = parser.parse_args()
+    if args.verify:
+        raise SystemExit(0 if verify_legacy_import() else 1)
+    journal = TradeJournal(args.db)
+    print(f'Imported {journal.import_csv(args.history, args.ontrade, args.symbol)} trades into {args.db}')
@@ -0,0 +1,67 @@
+# ===============================================================================================================
+# Market spec cache
+# priceIncrement / sizeIncrement per market, loaded once from load_markets() instead of a ticker call per lookup
+# ===============================================================================================================
+import time
+from decimal import Decimal
+
+def count_digit(step):
+    ''' Number of decimals of an increment, 0.0001 -> 4, 1e-05 -> 5, 5.0 -> 0 '''
+    exponent = Decimal(str(step)).normalize().as_tuple().exponent
+    return max(-exponent, 0)
+
+class MarketSpecCache:
+    ''' Market metadata keyed by market id (BTC-PERP) and unified symbol, refreshed every ttl seconds or on demand '''
+
+    def __init__(self, exchange, ttl=3600):
+        self.exchange = exchange
+        self.ttl = ttl
+        self._specs = {}
+        self._loaded_at = 0.0
+
+    def refresh(self):
+        ''' Reload every market from the exchange '''
+        return self.load(self.exchange.load_markets(reload=True))
+
+    def load(self, markets):
+        ''' Build the cache from a ccxt markets dict, used directly by async clients '''
+        specs = {}
+        for symbol, market in markets.items():
+            info = market.get('info') or {}
+            price_step = float(info.get('priceIncrement') or market['precision']['price'])
+            size_step = float(info.get('sizeIncrement') or market['precision']['amount'])
+            spec = {
+                'price_increment': price_step,
+                'size_increment': size_step,
+                'min_size': size_step,
+                'price_digit': count_digit(price_step),
+                'size_digit': count_digit(size_step),
+            }
+            specs[symbol] = spec
+            specs[market['id']] = spec
+        self._specs = specs
+        self._loaded_at = time.monotonic()
+        return specs
+
+    def is_stale(self):
+        return (not self._specs) or (time.monotonic() - self._loaded_at > self.ttl)
+
+    def get(self, symbol):
+        if self.is_stale() or symbol not in self._specs:
+            self.refresh()
+        return self._specs[symbol]
+
+    def price_digit(self, symbol):
+        return self.get(symbol)['price_digit']
+
+    def size_digit(self, symbol):
+        return self.get(symbol)['size_digit']
+
+    def min_size(self, symbol):
+        return self.get(symbol)['min_size']
+
+    def round_price(self, symbol, price):
+        return round(price, self.price_digit(symbol))
+
+    def round_size(self, symbol, size):
+        return round(size, self.size_digit(symbol))
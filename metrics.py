@@ -0,0 +1,218 @@
+# ===============================================================================================================
+# Metrics
+# REST call accounting, stage / exchange latency histograms and per-cycle summaries exported as
+# JSON lines and Prometheus text format
+# ===============================================================================================================
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class RestCallCounter:
+    ''' Counts every HTTP request an exchange client sends, grouped by "METHOD /path", from any thread '''
+
+    def __init__(self):
+        self.cycle = Counter()
+        self.total = Counter()
+        self.cycles = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def install(self, exchange):
+        ''' Wrap exchange.fetch, the single point every ccxt REST call goes through '''
+        original_fetch = exchange.fetch
+
+        def fetch(url, method='GET', headers=None, body=None):
+            self.record(f'{method} {urlparse(url).path}')
+            return original_fetch(url, method, headers, body)
+
+        exchange.fetch = fetch
+        return exchange
+
+    def record(self, endpoint):
+        if getattr(self._local, 'paused', False):
+            return
+        with self._lock:
+            self.cycle[endpoint] += 1
+
+    @contextmanager
+    def paused(self):
+        ''' Calls this thread makes inside the block are not counted, e.g. polls that keep their own count '''
+        self._local.paused = True
+        try:
+            yield
+        finally:
+            self._local.paused = False
+
+    def start_cycle(self):
+        ''' Forget calls made outside a cycle, e.g. at startup '''
+        with self._lock:
+            self.cycle = Counter()
+
+    def end_cycle(self):
+        ''' Return {endpoint: calls} of the cycle that just finished and start a new one '''
+        with self._lock:
+            summary = dict(self.cycle)
+            self.total.update(self.cycle)
+            self.cycle = Counter()
+            self.cycles += 1
+        return summary
+
+    def average_per_cycle(self):
+        if self.cycles == 0:
+            return 0.0
+        return sum(self.total.values()) / self.cycles
+
+class Histogram:
+    ''' Prometheus-style histogram with fixed second buckets '''
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for le, n in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += n
+            yield le, total
+
+class Metrics:
+    ''' Latency histograms and counters keyed by (metric, label, value), plus the per-cycle stage summary '''
+
+    def __init__(self, jsonl_path=None, prom_path=None, clock=time.perf_counter):
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.clock = clock
+        self.histograms = {}
+        self.counters = Counter()
+        self.cycle_stages = defaultdict(float)
+        self.cycle_started = None
+        self.last_summary = None
+        self._lock = threading.Lock()
+
+    def observe(self, name, label, value, seconds):
+        with self._lock:
+            key = (name, label, value)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+
+    def inc(self, name, label, value, amount=1):
+        with self._lock:
+            self.counters[(name, label, value)] += amount
+
+    def add_stage(self, stage, seconds):
+        ''' Add seconds to a stage of the current cycle, safe from other threads '''
+        with self._lock:
+            self.cycle_stages[stage] += seconds
+
+    @contextmanager
+    def span(self, stage):
+        ''' Time a block as one stage of the current cycle '''
+        t0 = self.clock()
+        try:
+            yield
+        finally:
+            dt = self.clock() - t0
+            self.observe('stage_seconds', 'stage', stage, dt)
+            self.add_stage(stage, dt)
+
+    def timed(self, stage):
+        ''' Decorator form of span() '''
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def install(self, exchange):
+        ''' Time every HTTP request of a ccxt client, rate-limiter waits are reported by RateBudget '''
+        original_fetch = exchange.fetch
+
+        def fetch(url, method='GET', headers=None, body=None):
+            t0 = self.clock()
+            try:
+                return original_fetch(url, method, headers, body)
+            finally:
+                self.observe('http_request_seconds', 'endpoint', f'{method} {urlparse(url).path}', self.clock() - t0)
+
+        exchange.fetch = fetch
+        return exchange
+
+    def start_cycle(self):
+        with self._lock:
+            self.cycle_stages = defaultdict(float)
+        self.cycle_started = self.clock()
+
+    def end_cycle(self, **extra):
+        ''' Close the cycle, export it and return its summary record '''
+        total = self.clock() - self.cycle_started if self.cycle_started is not None else 0.0
+        self.observe('cycle_seconds', 'bot', 'trading', total)
+        with self._lock:
+            stages = {k: round(v, 6) for k, v in self.cycle_stages.items()}
+        summary = {'time': time.time(), 'cycle_seconds': round(total, 6), 'stages': stages}
+        summary.update(extra)
+        self.last_summary = summary
+        self.export(summary)
+        return summary
+
+    def export(self, summary):
+        if self.jsonl_path:
+            with open(self.jsonl_path, 'a') as f:
+                f.write(json.dumps(summary, default=str) + '\n')
+        if self.prom_path:
+            tmp = self.prom_path + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp, self.prom_path)
+
+    def to_prometheus(self, prefix='bot_'):
+        lines = []
+        with self._lock:
+            for (name, label, value), h in sorted(self.histograms.items()):
+                for le, n in h.cumulative():
+                    lines.append(f'{prefix}{name}_bucket{{{label}="{value}",le="{le}"}} {n}')
+                lines.append(f'{prefix}{name}_sum{{{label}="{value}"}} {h.sum}')
+                lines.append(f'{prefix}{name}_count{{{label}="{value}"}} {h.count}')
+            for (name, label, value), n in sorted(self.counters.items()):
+                lines.append(f'{prefix}{name}{{{label}="{value}"}} {n}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port=9108, host='127.0.0.1'):
+        ''' Expose to_prometheus() on http://host:port/metrics from a daemon thread '''
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
@@ -0,0 +1,297 @@
+# ===============================================================================================================
+# Mock FTX exchange
+# In-process, ccxt-compatible stand-in serving OHLCV, tickers, positions, wallet, market orders and fills
+# with configurable latency, error rate and rate limit, for offline load and latency testing
+# ===============================================================================================================
+import importlib.util
+import itertools
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+import ccxt
+import numpy as np
+
+from candles import timeframe_to_ms
+
+def synthetic_candles(n, start_ms=0, timeframe='1m', price=40_000.0, vol=0.0008, seed=7):
+    ''' Random-walk OHLCV rows [ts, o, h, l, c, v] for tests and benchmarks '''
+    rng = np.random.default_rng(seed)
+    tf_ms = timeframe_to_ms(timeframe)
+    close = price * np.exp(np.cumsum(rng.normal(0, vol, n)))
+    open_ = np.concatenate([[price], close[:-1]])
+    spread = np.abs(rng.normal(0, vol / 2, n)) * close
+    bars = np.empty((n, 6))
+    bars[:, 0] = start_ms + np.arange(n) * tf_ms
+    bars[:, 1] = open_
+    bars[:, 2] = np.maximum(open_, close) + spread
+    bars[:, 3] = np.minimum(open_, close) - spread
+    bars[:, 4] = close
+    bars[:, 5] = rng.uniform(1, 100, n)
+    return bars
+
+class MockFTX:
+    ''' Enough of ccxt.ftx for the bot: every endpoint goes through fetch() and throttle() like a real client,
+        so RestCallCounter / Metrics / RetryPolicy see it exactly as they see the exchange '''
+
+    has = {'fetchTime': True, 'fetchOHLCV': True, 'fetchMyTrades': True, 'fetchOrder': True}
+    parse8601 = staticmethod(ccxt.Exchange.parse8601)
+    iso8601 = staticmethod(ccxt.Exchange.iso8601)
+
+    def __init__(self, candles=None, symbol='BTC-PERP', timeframe='1m', cash=10_000.0, leverage=20,
+                 price_increment=1.0, size_increment=0.0001, fee_rate=0.0007, spread=0.5,
+                 latency=0.0, error_rate=0.0, rate_limit=None, seed=1, now_ms=None, sleep=time.sleep):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.tf_ms = timeframe_to_ms(timeframe)
+        self.candles = np.asarray(candles if candles is not None else synthetic_candles(1_000), dtype=np.float64)
+        self.now_ms = now_ms # None follows the wall clock, otherwise set by the caller (replay, benchmarks)
+        self.collateral = cash
+        self.leverage = leverage
+        self.price_increment = price_increment
+        self.size_increment = size_increment
+        self.fee_rate = fee_rate
+        self.spread = spread
+        self.mark = None # traded price override, e.g. a point of the replay's intrabar path, None for the visible close
+        self.latency = latency # seconds, or (min, max) for a uniform draw
+        self.error_rate = error_rate # share of requests failing with a retryable network error
+        self.rate_limit = rate_limit # requests per second, None for unlimited
+        self.rng = random.Random(seed)
+        self.sleep = sleep
+        self.net_size = 0.0
+        self.avg_price = 0.0
+        self.realized_pnl = 0.0
+        self.orders = {}
+        self.trades = []
+        self.calls = Counter()
+        self.headers = {}
+        self.rateLimit = 0
+        self.enableRateLimit = False
+        self._ids = itertools.count(1)
+        self._bucket = float(rate_limit or 0)
+        self._bucket_at = time.monotonic()
+
+    # ----- transport ---------------------------------------------------------------------------------------------
+    def fetch(self, url, method='GET', headers=None, body=None):
+        ''' Simulated HTTP round trip: rate limit, latency and random failures '''
+        if self.rate_limit:
+            now = time.monotonic()
+            self._bucket = min(self.rate_limit, self._bucket + (now - self._bucket_at) * self.rate_limit)
+            self._bucket_at = now
+            if self._bucket < 1:
+                raise ccxt.RateLimitExceeded(f'mock rate limit {self.rate_limit}/s exceeded on {url}')
+            self._bucket -= 1
+        delay = self.rng.uniform(*self.latency) if isinstance(self.latency, tuple) else self.latency
+        if delay:
+            self.sleep(delay)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            raise ccxt.RequestTimeout(f'mock timeout on {method} {url}')
+        return None
+
+    def throttle(self, cost=None):
+        pass
+
+    def _request(self, method, path):
+        self.calls[f'{method} {path}'] += 1
+        self.throttle()
+        self.fetch(f'https://mock.ftx/api{path}', method)
+
+    def milliseconds(self):
+        return int(self.now_ms if self.now_ms is not None else time.time() * 1000)
+
+    # ----- market data -------------------------------------------------------------------------------------------
+    def _visible(self):
+        ''' Bars opened at or before now, the last one is the still-forming bar '''
+        end = int(np.searchsorted(self.candles[:, 0], self.milliseconds(), side='right'))
+        return self.candles[:end]
+
+    def last_price(self):
+        if self.mark is not None:
+            return float(self.mark)
+        visible = self._visible()
+        return float(visible[-1, 4]) if len(visible) else float(self.candles[0, 1])
+
+    def fetch_time(self, params={}):
+        self._request('GET', '/time')
+        return self.milliseconds()
+
+    def fetchStatus(self, params={}):
+        self._request('GET', '/status')
+        return {'status': 'ok', 'updated': self.milliseconds(), 'eta': None, 'url': None}
+
+    fetch_status = fetchStatus
+
+    def load_markets(self, reload=False, params={}):
+        self._request('GET', '/markets')
+        info = {'name': self.symbol, 'priceIncrement': self.price_increment, 'sizeIncrement': self.size_increment}
+        market = {'id': self.symbol, 'symbol': self.symbol, 'info': info,
+                  'precision': {'price': self.price_increment, 'amount': self.size_increment}}
+        return {self.symbol: market}
+
+    def fetch_ohlcv(self, symbol, timeframe='1m', since=None, limit=None, params={}):
+        self._request('GET', f'/markets/{symbol}/candles')
+        bars = self._visible()
+        if since is not None:
+            bars = bars[int(np.searchsorted(bars[:, 0], since, side='left')):]
+            if limit:
+                bars = bars[:limit]
+        elif limit:
+            bars = bars[-limit:]
+        return bars.tolist()
+
+    def fetch_ticker(self, symbol, params={}):
+        self._request('GET', f'/markets/{symbol}')
+        last = self.last_price()
+        info = {'name': symbol, 'last': last, 'bid': last - self.spread, 'ask': last + self.spread,
+                'priceIncrement': self.price_increment, 'sizeIncrement': self.size_increment}
+        return {'symbol': symbol, 'timestamp': self.milliseconds(), 'last': last, 'bid': info['bid'], 'ask': info['ask'], 'info': info}
+
+    # ----- account -----------------------------------------------------------------------------------------------
+    def _position(self):
+        size = abs(self.net_size)
+        return {
+            'future': self.symbol, 'netSize': self.net_size, 'size': size,
+            'side': 'buy' if self.net_size >= 0 else 'sell',
+            'entryPrice': self.avg_price if size else None, 'recentAverageOpenPrice': self.avg_price if size else None,
+            'cost': self.net_size * self.avg_price, 'realizedPnl': self.realized_pnl,
+            'unrealizedPnl': (self.last_price() - self.avg_price) * self.net_size,
+        }
+
+    def private_get_positions(self, params={}):
+        self._request('GET', '/positions')
+        return {'success': True, 'result': [self._position()]}
+
+    def fetchPositions(self, symbols=None, params={}):
+        return [{'info': p} for p in self.private_get_positions()['result']]
+
+    fetch_positions = fetchPositions
+
+    def privateGetWalletBalances(self, params={}):
+        self._request('GET', '/wallet/balances')
+        equity = self.collateral + (self.last_price() - self.avg_price) * self.net_size
+        used = abs(self.net_size) * self.last_price() / self.leverage
+        return {'success': True, 'result': [{'coin': 'USD', 'total': equity, 'free': equity - used,
+                                             'availableWithoutBorrow': max(equity - used, 0.0), 'usdValue': equity}]}
+
+    private_get_wallet_balances = privateGetWalletBalances
+
+    def private_post_account_leverage(self, params={}):
+        self._request('POST', '/account/leverage')
+        self.leverage = params.get('leverage', self.leverage)
+        return {'success': True, 'result': None}
+
+    # ----- orders ------------------------------------------------------------------------------------------------
+    def create_order(self, symbol, type, side, amount, price=None, params={}):
+        self._request('POST', '/orders')
+        if type != 'market':
+            raise ccxt.InvalidOrder(f'mock only fills market orders, got {type}')
+        amount = float(amount)
+        if amount <= 0:
+            raise ccxt.InvalidOrder(f'mock order amount must be positive, got {amount}')
+        sign = 1 if side == 'buy' else -1
+        if params.get('reduceOnly') and (self.net_size == 0 or np.sign(self.net_size) == sign):
+            raise ccxt.InvalidOrder('mock reduceOnly order would increase the position')
+        fill_price = self.last_price() + sign * self.spread
+        new_net = self.net_size + sign * amount
+        if abs(new_net) > abs(self.net_size) and abs(new_net) * fill_price / self.leverage > self.collateral:
+            raise ccxt.InsufficientFunds(f'mock margin {abs(new_net) * fill_price / self.leverage:.2f} > collateral {self.collateral:.2f}')
+        self._apply_fill(sign, amount, fill_price)
+        ts = self.milliseconds()
+        order_id = str(next(self._ids))
+        trade = {'id': f't{order_id}', 'order': order_id, 'timestamp': ts, 'datetime': self.iso8601(ts), 'symbol': symbol,
+                 'type': 'market', 'side': side, 'price': fill_price, 'amount': amount, 'cost': amount * fill_price,
+                 'fee': {'cost': amount * fill_price * self.fee_rate, 'currency': 'USD'}, 'info': {'orderId': order_id}}
+        self.trades.append(trade)
+        order = {'id': order_id, 'clientOrderId': None, 'timestamp': ts, 'datetime': self.iso8601(ts), 'lastTradeTimestamp': ts,
+                 'symbol': symbol, 'type': 'market', 'side': side, 'price': None, 'amount': amount, 'filled': amount,
+                 'remaining': 0.0, 'average': fill_price, 'cost': amount * fill_price, 'status': 'closed',
+                 'info': {'id': order_id, 'createdAt': self.iso8601(ts), 'status': 'closed', 'market': symbol,
+                          'side': side, 'size': amount, 'filledSize': amount, 'avgFillPrice': fill_price}}
+        self.orders[order_id] = order
+        return order
+
+    def _apply_fill(self, sign, amount, price):
+        ''' Update net position, average entry and collateral (realized PnL minus fee) '''
+        self.collateral -= amount * price * self.fee_rate
+        if self.net_size == 0 or np.sign(self.net_size) == sign:
+            total = abs(self.net_size) + amount
+            self.avg_price = (abs(self.net_size) * self.avg_price + amount * price) / total
+            self.net_size += sign * amount
+            return
+        closing = min(amount, abs(self.net_size))
+        pnl = (price - self.avg_price) * closing * np.sign(self.net_size)
+        self.collateral += pnl
+        self.realized_pnl += pnl
+        self.net_size += sign * amount
+        if abs(self.net_size) < 1e-12:
+            self.net_size = 0.0
+            self.avg_price = 0.0
+        elif np.sign(self.net_size) == sign: # flipped, the remainder opened at the fill price
+            self.avg_price = price
+
+    def fetch_order(self, id, symbol=None, params={}):
+        self._request('GET', f'/orders/{id}')
+        if id not in self.orders:
+            raise ccxt.OrderNotFound(f'mock order {id} not found')
+        return self.orders[id]
+
+    def fetch_my_trades(self, symbol=None, since=None, limit=None, params={}):
+        self._request('GET', '/fills')
+        trades = [t for t in self.trades if (symbol is None or t['symbol'] == symbol) and (since is None or t['timestamp'] >= since)]
+        if 'orderId' in params:
+            trades = [t for t in trades if t['order'] == str(params['orderId'])]
+        if not limit:
+            return trades
+        return trades[:limit] if since is not None else trades[-limit:] # pages forward from since, like FTX start_time
+
+    def close(self):
+        pass
+
+def load_bot(path=None):
+    ''' Import the bot script ("ccxt FTX 4.0.py") as a module, possible now that import has no side effects '''
+    path = path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ccxt FTX 4.0.py')
+    spec = importlib.util.spec_from_file_location('ftx_bot', path)
+    bot = importlib.util.module_from_spec(spec)
+    sys.modules['ftx_bot'] = bot
+    spec.loader.exec_module(bot)
+    return bot
+
+def run_benchmark(cycles=500, latency=0.0, error_rate=0.0, rate_limit=None, seed=1):
+    ''' Drive trading() against MockFTX, one bar per cycle, print throughput and latency percentiles '''
+    import contextlib
+    import io
+    bot = load_bot()
+    bars = synthetic_candles(cycles + bot.robot_max_candles + 1, seed=seed)
+    mock = MockFTX(bars, symbol=bot.robot_symbol, latency=latency, error_rate=error_rate, rate_limit=rate_limit,
+                   now_ms=int(bars[bot.robot_max_candles, 0]))
+    bot.use_exchange(mock)
+    bot.retry_policy.sleep = lambda s: None
+    timings = []
+    t_start = time.perf_counter()
+    for i in range(cycles):
+        mock.now_ms = int(bars[bot.robot_max_candles + i, 0])
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            bot.trading()
+        timings.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - t_start
+    t = np.array(timings) * 1000
+    print(f'{cycles} cycles in {elapsed:.2f}s, {cycles / elapsed:.0f} cycles/s, '
+          f'p50 {np.percentile(t, 50):.2f}ms p95 {np.percentile(t, 95):.2f}ms p99 {np.percentile(t, 99):.2f}ms max {t.max():.2f}ms')
+    print(f'REST calls {sum(mock.calls.values())} ({sum(mock.calls.values()) / cycles:.1f}/cycle), trades {len(mock.trades)}, '
+          f'collateral {mock.collateral:.2f}')
+    return timings
+
+if __name__ == '__main__':
+    import argparse
+    import tempfile
+    parser = argparse.ArgumentParser(description='Offline throughput / latency benchmark of trading() against MockFTX')
+    parser.add_argument('--cycles', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per simulated request')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=None, help='requests per second')
+    args = parser.parse_args()
+    os.chdir(tempfile.mkdtemp(prefix='mockftx_')) # journal, checkpoint and metrics files stay out of the way
+    run_benchmark(args.cycles, args.latency, args.error_rate, args.rate_limit)
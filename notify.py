@@ -0,0 +1,177 @@
+# ===============================================================================================================
+# Notifications
+# Background queue that batches and coalesces messages and sends them off the trading thread,
+# LINE Notify sender and a local stand-in endpoint for offline runs
+# ===============================================================================================================
+import atexit
+import json
+import queue
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+
+LINE_NOTIFY_URL = 'https://notify-api.line.me/api/notify'
+_STOP = object()
+
+def line_sender(token, url=LINE_NOTIFY_URL, timeout=5.0):
+    ''' send(text) posting to LINE Notify, the same request the notebooks made with requests.post '''
+    headers = {'content-type': 'application/x-www-form-urlencoded', 'Authorization': 'Bearer ' + token}
+
+    def send(text):
+        data = urllib.parse.urlencode({'message': text}).encode()
+        with urllib.request.urlopen(urllib.request.Request(url, data=data, headers=headers), timeout=timeout) as r:
+            return r.read()
+    return send
+
+class Notifier:
+    ''' post() never blocks: messages queue up to max_queue, beyond that they are dropped and counted.
+        A daemon thread waits up to linger seconds for a burst to gather, collapses repeated messages,
+        and sends at most batch_size of them per request '''
+
+    def __init__(self, send=None, batch_size=20, linger=0.5, max_queue=1000, clock=time.monotonic):
+        self.send = send # None discards messages, e.g. no token configured
+        self.batch_size = batch_size
+        self.linger = linger
+        self.clock = clock
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self._unreported_drops = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='notifier', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+        return self
+
+    def post(self, msg):
+        if self.send is None:
+            return False
+        self.start()
+        try:
+            self.queue.put_nowait(str(msg))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            self._unreported_drops += 1
+            return False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self.queue.get()
+            if item is _STOP:
+                self.queue.task_done()
+                break
+            batch = [item]
+            deadline = self.clock() + self.linger
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get(timeout=max(deadline - self.clock(), 0))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    self.queue.task_done()
+                    break
+                batch.append(item)
+            self._deliver(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    def _deliver(self, batch):
+        lines = []
+        for msg, n in Counter(batch).items(): # keeps first-seen order
+            lines.append(msg if n == 1 else f'{msg} (x{n})')
+        if self._unreported_drops:
+            lines.append(f'({self._unreported_drops} notifications dropped, queue full)')
+            self._unreported_drops = 0
+        try:
+            self.send('\n'.join(lines))
+            self.sent += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.debug(f'Notify failed, {len(batch)} messages lost : {type(e).__name__} {e}')
+
+    def flush(self, timeout=10.0):
+        ''' Wait until everything queued so far was sent, False on timeout '''
+        deadline = time.monotonic() + timeout
+        while self.queue.unfinished_tasks:
+            if time.monotonic() > deadline or self._thread is None or not self._thread.is_alive():
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout=10.0):
+        ''' Send what is queued and stop the thread, called at exit '''
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+class LocalNotifyServer:
+    ''' Stand-in for the LINE Notify endpoint on 127.0.0.1, keeps every message it receives.
+        delay slows each response down to exercise batching and backpressure '''
+
+    def __init__(self, port=0, delay=0.0):
+        self.messages = []
+        self.requests = 0
+        self.delay = delay
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+                if server.delay:
+                    time.sleep(server.delay)
+                server.requests += 1
+                server.messages.extend(urllib.parse.parse_qs(body).get('message', []))
+                payload = json.dumps({'status': 200, 'message': 'ok'}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}/api/notify'
+        threading.Thread(target=self.httpd.serve_forever, name='notify-server', daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Send a burst of notifications through the queue to a local stand-in endpoint')
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.05, help='seconds the stand-in endpoint takes per request')
+    parser.add_argument('--max-queue', type=int, default=100)
+    args = parser.parse_args()
+    server = LocalNotifyServer(delay=args.delay)
+    notifier = Notifier(line_sender('local-token', server.url), max_queue=args.max_queue)
+    t0 = time.perf_counter()
+    for i in range(args.messages):
+        notifier.post(f'Open Long BTC-PERP at {40000 + i % 3}')
+    post_ms = (time.perf_counter() - t0) * 1000
+    notifier.flush()
+    print(f'{args.messages} posts in {post_ms:.2f}ms, sent {notifier.sent}, dropped {notifier.dropped}, failed {notifier.failed}, '
+          f'{server.requests} requests, {len(server.messages)} delivered texts')
+    notifier.close()
+    server.close()
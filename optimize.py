@@ -0,0 +1,300 @@
+# ===============================================================================================================
+# Walk-forward optimizer
+# Rolling train / test folds over the candle store. Every parameter combination is backtested on each train
+# window in a process pool that reads the candles from shared memory, the train winner is scored on the test
+# window that follows, and the winner of the latest window is written to the params file the live bot loads
+# ===============================================================================================================
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+PARAMS = ['fast', 'slow', 'vol_window', 'sl_multiply', 'tp_multiply', 'riskpertrade']
+
+def load_params(path='params.json', symbol=None, timeframe=None):
+    ''' Parameter set written by save_params(), None if there is no file or it was made for another symbol / timeframe '''
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        params = json.load(f)
+    if (symbol is not None and params.get('symbol') != symbol) or (timeframe is not None and params.get('timeframe') != timeframe):
+        return None
+    return params
+
+def save_params(path, params):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(params, f, indent=2)
+    os.replace(tmp, path)
+
+def make_folds(n, train, test, step=None):
+    ''' (train_lo, train_hi, test_hi) bar indices of rolling folds, each test window right after its train window '''
+    step = step or test
+    return [(lo, lo + train, lo + train + test) for lo in range(0, n - train - test + 1, step)]
+
+def grid_combos(grid):
+    ''' Every combination of the grid lists as a params dict, fast < slow only '''
+    return [dict(zip(PARAMS, values)) for values in itertools.product(*(grid[k] for k in PARAMS)) if values[0] < values[1]]
+
+def params_hash(params, settings):
+    ''' Hash of the parameters plus the run_sweep() settings (fees, freq, sizing) they were backtested with '''
+    key = json.dumps({**{k: params[k] for k in PARAMS}, **settings}, sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+def segment_key(data, lo, hi):
+    ''' Window bounds plus a digest of its candles, a repaired gap or rewritten bar invalidates the cached results '''
+    digest = hashlib.sha1(np.ascontiguousarray(data[lo:hi]).tobytes()).hexdigest()[:16]
+    return f'{int(data[lo, 0])}-{int(data[hi - 1, 0])}-{digest}'
+
+class ResultCache:
+    ''' Backtest stats per (segment, params hash), reruns only backtest what is not in here yet '''
+
+    def __init__(self, path='wfo_cache.db'):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS results (segment TEXT NOT NULL, params_hash TEXT NOT NULL, '
+                          'params TEXT NOT NULL, stats TEXT NOT NULL, PRIMARY KEY (segment, params_hash))')
+
+    def get(self, segment, hashes, chunk=500):
+        ''' {params_hash: (params, stats)} of the cached ones among hashes '''
+        hashes = list(hashes)
+        found = {}
+        for i in range(0, len(hashes), chunk):
+            part = hashes[i:i + chunk]
+            rows = self.conn.execute(f'SELECT params_hash, params, stats FROM results WHERE segment = ? '
+                                     f'AND params_hash IN ({", ".join("?" * len(part))})', [segment, *part])
+            for h, params, stats in rows:
+                found[h] = (json.loads(params), json.loads(stats))
+        return found
+
+    def put(self, segment, rows, settings):
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany('INSERT OR REPLACE INTO results (segment, params_hash, params, stats) VALUES (?, ?, ?, ?)',
+                                  [(segment, params_hash(p, settings), json.dumps(p), json.dumps(s)) for p, s in rows])
+
+    def close(self):
+        self.conn.close()
+
+class SharedCandles:
+    ''' OHLCV rows copied once into a shared memory block, workers map the same pages instead of unpickling a copy '''
+
+    def __init__(self, data):
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        self.shape = data.shape
+        self.shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+        self.array = np.ndarray(self.shape, dtype=np.float64, buffer=self.shm.buf)
+        self.array[:] = data
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        del self.array
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# ----- worker side -----------------------------------------------------------------------------------------------
+_shm = None
+_candles = None
+
+def _attach(name, shape):
+    ''' Pool initializer, the parent owns and unlinks the block '''
+    global _shm, _candles
+    _shm = shared_memory.SharedMemory(name=name)
+    _candles = np.ndarray(shape, dtype=np.float64, buffer=_shm.buf)
+
+def _evaluate(lo, hi, grid, settings):
+    ''' run_sweep() of the product grid on candles[lo:hi], [(params, stats)] '''
+    import pandas as pd
+    from backtest import run_sweep
+
+    rows = _candles[lo:hi]
+    df = pd.DataFrame({'close': rows[:, 4]}, index=pd.to_datetime(rows[:, 0].astype('int64'), unit='ms'))
+    results = run_sweep(df, grid['fast'], grid['slow'], grid['sl_multiply'], grid['tp_multiply'], grid['riskpertrade'],
+                        vol_window=grid['vol_window'], **settings)
+    out = []
+    for (fast, slow, sl, tp, risk), stats in zip(results.index, results.to_dict('records')):
+        params = {'fast': int(fast), 'slow': int(slow), 'vol_window': int(grid['vol_window']),
+                  'sl_multiply': float(sl), 'tp_multiply': float(tp), 'riskpertrade': float(risk)}
+        out.append((params, {k: float(v) for k, v in stats.items()}))
+    return out
+
+# ----- parent side -----------------------------------------------------------------------------------------------
+def _job_grids(combos):
+    ''' Group combos into product grids run_sweep() can take, one job per (vol_window, fast) '''
+    groups = {}
+    for c in combos:
+        groups.setdefault((c['vol_window'], c['fast']), []).append(c)
+    for (vol_window, fast), part in groups.items():
+        grid = {k: sorted({c[k] for c in part}) for k in ('slow', 'sl_multiply', 'tp_multiply', 'riskpertrade')}
+        yield dict(grid, fast=[fast], vol_window=vol_window)
+
+def _run(pool, data, segments, cache, settings):
+    ''' segments [(lo, hi, combos)], backtests the combos not cached yet. {(lo, hi): {params_hash: (params, stats)}} '''
+    keys = {(lo, hi): segment_key(data, lo, hi) for lo, hi, _ in segments}
+    wanted = {(lo, hi): {params_hash(c, settings): c for c in combos} for lo, hi, combos in segments}
+    futures = {}
+    for (lo, hi), combos in wanted.items():
+        cached = cache.get(keys[(lo, hi)], combos)
+        missing = [c for h, c in combos.items() if h not in cached]
+        for grid in _job_grids(missing):
+            futures[pool.submit(_evaluate, lo, hi, grid, settings)] = (lo, hi)
+    for fut in as_completed(futures):
+        cache.put(keys[futures[fut]], fut.result(), settings)
+    return {seg: cache.get(keys[seg], combos) for seg, combos in wanted.items()}, len(futures)
+
+def pick_best(results, rank_by='sharpe_ratio', min_trades=5):
+    ''' (params, stats) ranking highest on rank_by among those with at least min_trades, None if none qualifies '''
+    rows = [(p, s) for p, s in results.values() if s['trades'] >= min_trades and np.isfinite(s[rank_by])]
+    if not rows:
+        return None
+    return max(rows, key=lambda r: (r[1][rank_by], r[1]['total_return']))
+
+def walk_forward(data, grid, train, test, step=None, fees=0.0007, freq='1min', size_limit=1.0, min_size=0.0001,
+                 rank_by='sharpe_ratio', min_trades=5, workers=None, cache=None):
+    ''' Optimize on every train window, score the winner on its test window, and optimize once more on the latest
+        train window for the live parameters. Indicators warm up inside each window, as after a cold start.
+        Returns (one row per fold, live (params, stats) or None, backtest jobs run) '''
+    import pandas as pd
+
+    cache = cache or ResultCache()
+    settings = {'fees': fees, 'freq': freq, 'size_limit': size_limit, 'min_size': min_size}
+    combos = grid_combos(grid)
+    folds = make_folds(len(data), train, test, step)
+    latest = (len(data) - train, len(data))
+    with SharedCandles(data) as shared, \
+         ProcessPoolExecutor(workers, initializer=_attach, initargs=(shared.name, shared.shape)) as pool:
+        trained, jobs = _run(pool, data, [(lo, mid, combos) for lo, mid, _ in folds] + [(*latest, combos)], cache, settings)
+        best = {(lo, mid): pick_best(trained[(lo, mid)], rank_by, min_trades) for lo, mid, _ in folds}
+        tested, test_jobs = _run(pool, data, [(mid, hi, [best[(lo, mid)][0]]) for lo, mid, hi in folds if best[(lo, mid)]],
+                                 cache, settings)
+    rows = []
+    for lo, mid, hi in folds:
+        row = {'train_start': data[lo, 0], 'test_start': data[mid, 0], 'test_end': data[hi - 1, 0]}
+        if best[(lo, mid)] is not None:
+            params, stats = best[(lo, mid)]
+            oos = next(iter(tested[(mid, hi)].values()))[1]
+            row.update(params, **{f'train_{rank_by}': stats[rank_by]}, **{f'test_{k}': v for k, v in oos.items()})
+        rows.append(row)
+    report = pd.DataFrame(rows)
+    for col in ('train_start', 'test_start', 'test_end'):
+        report[col] = pd.to_datetime(report[col].astype('int64'), unit='ms')
+    return report, pick_best(trained[latest], rank_by, min_trades), jobs + test_jobs
+
+def oos_summary(report):
+    ''' Test windows stitched together: compounded return, mean sharpe, worst drawdown '''
+    if 'test_total_return' not in report:
+        return {'folds': len(report), 'scored': 0}
+    scored = report.dropna(subset=['test_total_return'])
+    return {
+        'folds': len(report),
+        'scored': len(scored),
+        'total_return': float(np.prod(1 + scored['test_total_return']) - 1),
+        'mean_sharpe_ratio': float(scored['test_sharpe_ratio'].mean()),
+        'worst_drawdown': float(scored['test_max_drawdown'].min()),
+        'trades': int(scored['test_trades'].sum()),
+        'positive_folds': int((scored['test_total_return'] > 0).sum()),
+    }
+
+def oos_gate(summary, min_positive_share=0.5):
+    ''' Reason the out-of-sample result should not replace the live parameters, None when it passes '''
+    if not summary.get('scored'):
+        return 'no scored out-of-sample folds'
+    share = summary['positive_folds'] / summary['scored']
+    if share < min_positive_share:
+        return f"{summary['positive_folds']}/{summary['scored']} positive folds, below {min_positive_share:.0%}"
+    if summary['total_return'] <= 0:
+        return f"out-of-sample return {summary['total_return']:.2%}"
+    return None
+
+def main():
+    import argparse
+    from candle_store import CandleStore
+    from candles import timeframe_to_ms
+
+    parser = argparse.ArgumentParser(description='Walk-forward optimize the EMA-cross strategy and write the live parameter file')
+    parser.add_argument('--symbol', default='BTC-PERP')
+    parser.add_argument('--timeframe', default='1m')
+    parser.add_argument('--root', default='candles', help='candle store directory')
+    parser.add_argument('--days', type=float, default=None, help='most recent days of the store to use, default all')
+    parser.add_argument('--synthetic', type=int, default=0, help='optimize on this many random-walk bars instead of the store')
+    parser.add_argument('--train-days', type=float, default=7)
+    parser.add_argument('--test-days', type=float, default=1)
+    parser.add_argument('--step-days', type=float, default=None, help='fold step, default the test length')
+    parser.add_argument('--fast', type=int, nargs='+', default=list(range(8, 21, 2)))
+    parser.add_argument('--slow', type=int, nargs='+', default=list(range(20, 61, 5)))
+    parser.add_argument('--vol-window', type=int, nargs='+', default=[20, 30, 40])
+    parser.add_argument('--sl', type=float, nargs='+', default=[1.0, 1.2, 1.5, 2.0])
+    parser.add_argument('--tp', type=float, nargs='+', default=[0.0, 1.5, 2.0])
+    parser.add_argument('--risk', type=float, nargs='+', default=[0.0001, 0.0005, 0.001])
+    parser.add_argument('--fees', type=float, default=0.0007)
+    parser.add_argument('--size-limit', type=float, default=1.0, help='robot_position_size_limit')
+    parser.add_argument('--min-size', type=float, default=0.0001, help='exchange minimum order size')
+    parser.add_argument('--rank-by', default='sharpe_ratio')
+    parser.add_argument('--min-trades', type=int, default=5)
+    parser.add_argument('--min-positive-share', type=float, default=0.5,
+                        help='share of out-of-sample folds that must be profitable before the live file is replaced')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, default one per core')
+    parser.add_argument('--cache', default='wfo_cache.db')
+    parser.add_argument('--out', default='params.json', help='parameter file the bot loads at startup')
+    parser.add_argument('--report', default='wfo_folds.csv')
+    args = parser.parse_args()
+
+    tf_ms = timeframe_to_ms(args.timeframe)
+    if args.synthetic:
+        from mock_exchange import synthetic_candles
+        data = synthetic_candles(args.synthetic, timeframe=args.timeframe)
+    else:
+        store = CandleStore(args.root)
+        last = store.last_ts(args.symbol, args.timeframe)
+        if last is None:
+            raise SystemExit(f'No {args.symbol} {args.timeframe} candles in {args.root}, run candle_store.py first')
+        start = None if args.days is None else last - args.days * 86_400_000
+        data = np.array(store.read(args.symbol, args.timeframe, start=start))
+    bars = lambda days: int(days * 86_400_000 // tf_ms)
+    train, test = bars(args.train_days), bars(args.test_days)
+    step = bars(args.step_days) if args.step_days else None
+    if len(data) < train + test:
+        raise SystemExit(f'{len(data)} bars, a fold needs {train + test}')
+    grid = {'fast': args.fast, 'slow': args.slow, 'vol_window': args.vol_window, 'sl_multiply': args.sl,
+            'tp_multiply': args.tp, 'riskpertrade': args.risk}
+
+    t0 = time.perf_counter()
+    cache = ResultCache(args.cache)
+    report, live, jobs = walk_forward(data, grid, train, test, step, fees=args.fees, freq=f'{tf_ms // 60_000}min',
+                                      size_limit=args.size_limit, min_size=args.min_size,
+                                      rank_by=args.rank_by, min_trades=args.min_trades, workers=args.workers, cache=cache)
+    cache.close()
+    report.to_csv(args.report, index=False)
+    summary = oos_summary(report)
+    print(report.to_string())
+    print(f'{len(grid_combos(grid))} combinations x {len(report)} folds on {len(data)} bars, {jobs} backtest jobs run '
+          f'({time.perf_counter() - t0:.1f}s), out of sample {summary}')
+    if live is None:
+        raise SystemExit(f'No combination made {args.min_trades} trades in the latest window, {args.out} not written')
+    rejected = oos_gate(summary, args.min_positive_share)
+    if rejected:
+        raise SystemExit(f'Out-of-sample gate failed ({rejected}), {args.out} left unchanged')
+    params, stats = live
+    save_params(args.out, dict(params, symbol=args.symbol, timeframe=args.timeframe,
+                               train_start=int(data[-train, 0]), train_end=int(data[-1, 0]), train_stats=stats,
+                               out_of_sample=summary, generated_at=int(time.time())))
+    print(f'Live parameters {params}, saved {args.out}')
+
+if __name__ == '__main__':
+    main()
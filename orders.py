@@ -0,0 +1,128 @@
+# ===============================================================================================================
+# Order fill tracking
+# Resolve a market order as soon as the exchange reports it filled, instead of sleeping a fixed time
+# ===============================================================================================================
+import asyncio
+import time
+
+def aggregate_fills(trades):
+    ''' Sum a list of ccxt trades into one fill: VWAP price, total amount and cost, last timestamp and side '''
+    if not trades:
+        return None
+    amount = 0.0
+    cost = 0.0
+    last = trades[0]
+    for t in trades:
+        amount += float(t['amount'])
+        cost += float(t['cost']) if t.get('cost') is not None else float(t['amount']) * float(t['price'])
+        if t['timestamp'] >= last['timestamp']:
+            last = t
+    return {
+        'symbol': last['symbol'],
+        'timestamp': last['timestamp'],
+        'side': last['side'],
+        'price': cost / amount if amount else 0.0,
+        'amount': amount,
+        'cost': cost,
+    }
+
+def plan_order(netsize, target):
+    ''' One market order taking the net position from netsize to target: (side, amount, closing),
+        closing is the part of amount that closes the current position '''
+    delta = target - netsize
+    side = 'buy' if delta > 0 else 'sell'
+    closing = min(abs(netsize), abs(delta)) if netsize * delta < 0 else 0.0
+    return side, abs(delta), closing
+
+def split_fill(fill, amount):
+    ''' Split a fill summary at amount into (first, rest), both at the fill's VWAP, None for an empty part '''
+    first = min(amount, fill['amount'])
+    rest = fill['amount'] - first
+    eps = 1e-12 * max(fill['amount'], 1.0)
+    part = lambda a: dict(fill, amount=a, cost=fill['cost'] * a / fill['amount']) if a > eps else None
+    return part(first), part(rest)
+
+def is_done(order):
+    return order['status'] in ('closed', 'canceled') or (order.get('remaining') == 0 and bool(order.get('filled')))
+
+def summarize_order(order, symbol):
+    ''' Fill summary straight from a closed order, None if it needs its trades to be summed instead '''
+    if not order.get('average'):
+        return None
+    filled = float(order['filled'])
+    average = float(order['average'])
+    return {
+        'symbol': order.get('symbol') or symbol,
+        'timestamp': order.get('lastTradeTimestamp') or order['timestamp'],
+        'side': order['side'],
+        'price': average,
+        'amount': filled,
+        'cost': filled * average,
+    }
+
+class FillTracker:
+    ''' Poll fetch_order with a short adaptive backoff until the order is closed, then summarize its fills '''
+
+    def __init__(self, exchange, first_delay=0.05, max_delay=1.0, backoff=1.6, timeout=15.0, sleep=time.sleep, clock=time.monotonic,
+                 history=None):
+        self.exchange = exchange
+        self.history = history # TradeHistory mirror, fills are then matched locally after an incremental sync
+        self.first_delay = first_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.timeout = timeout
+        self.sleep = sleep
+        self.clock = clock
+
+    def wait(self, order_id, symbol):
+        ''' Return the ccxt order once it is closed or canceled, None on timeout '''
+        deadline = self.clock() + self.timeout
+        delay = self.first_delay
+        while True:
+            order = self.exchange.fetch_order(order_id, symbol)
+            if is_done(order):
+                return order
+            if self.clock() + delay > deadline:
+                return None
+            self.sleep(delay)
+            delay = min(delay * self.backoff, self.max_delay)
+
+    def fills(self, order_id, symbol, since):
+        ''' Trades belonging to order_id, used when the order does not report an average price '''
+        if self.history is not None:
+            self.history.sync(self.exchange.fetch_my_trades, symbol, first_since=int(since))
+            return self.history.order_fills(order_id, symbol)
+        trades = self.exchange.fetch_my_trades(symbol, since=int(since), params={'orderId': order_id})
+        return [t for t in trades if str(t.get('order')) == str(order_id)]
+
+    def track(self, order_id, symbol, since):
+        ''' Fill summary dict of aggregate_fills() layout, None if nothing was filled in time '''
+        order = self.wait(order_id, symbol)
+        if order is None or not order.get('filled'):
+            return None
+        return summarize_order(order, symbol) or aggregate_fills(self.fills(order_id, symbol, since))
+
+class AsyncFillTracker(FillTracker):
+    ''' FillTracker for ccxt.async_support clients, waits with asyncio.sleep so other symbols keep running '''
+
+    async def wait(self, order_id, symbol):
+        deadline = self.clock() + self.timeout
+        delay = self.first_delay
+        while True:
+            order = await self.exchange.fetch_order(order_id, symbol)
+            if is_done(order):
+                return order
+            if self.clock() + delay > deadline:
+                return None
+            await asyncio.sleep(delay)
+            delay = min(delay * self.backoff, self.max_delay)
+
+    async def fills(self, order_id, symbol, since):
+        trades = await self.exchange.fetch_my_trades(symbol, since=int(since), params={'orderId': order_id})
+        return [t for t in trades if str(t.get('order')) == str(order_id)]
+
+    async def track(self, order_id, symbol, since):
+        order = await self.wait(order_id, symbol)
+        if order is None or not order.get('filled'):
+            return None
+        return summarize_order(order, symbol) or aggregate_fills(await self.fills(order_id, symbol, since))
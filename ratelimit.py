@@ -0,0 +1,172 @@
+# ===============================================================================================================
+# Rate-limit budget
+# Token bucket kept in a small file under an OS lock, so every thread and process on one API key draws from
+# the same budget. Lower priorities must leave a reserve, orders and cancels are never starved by polling
+# ===============================================================================================================
+import os
+import struct
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlparse
+
+try:
+    import fcntl
+
+    def _lock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _unlock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+except ImportError: # Windows
+    import msvcrt
+
+    def _lock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+    def _unlock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+_STATE = struct.Struct('<ddd') # tokens, updated_at, total consumed weight
+
+# Share of the bucket each priority has to leave untouched, in order of urgency
+RESERVE = {'order': 0.0, 'cancel': 0.1, 'market': 0.3, 'account': 0.4}
+
+def classify(method, path):
+    ''' Priority of an FTX REST request '''
+    if path.startswith('/api/orders') or path.startswith('/api/conditional_orders'):
+        if method == 'POST':
+            return 'order'
+        if method == 'DELETE':
+            return 'cancel'
+        return 'account' # order status polling
+    if path.startswith('/api/markets') or path.startswith('/api/futures') or path == '/api/time':
+        return 'market'
+    return 'account'
+
+class RateBudget:
+    ''' acquire(priority, weight) blocks until the shared bucket can pay weight while keeping the reserve of
+        its priority, refills at rate weight per second up to capacity. Waits are exported to metrics if given '''
+
+    def __init__(self, path='ratelimit.bin', rate=30.0, capacity=30.0, reserve=RESERVE, weights=None,
+                 sleep=time.sleep, clock=time.time, metrics=None):
+        self.path = path
+        self.rate = rate
+        self.capacity = capacity
+        self.reserve = reserve
+        self.weights = weights or {} # path prefix -> request weight, default 1
+        self.sleep = sleep
+        self.clock = clock
+        self.metrics = metrics
+        self.granted = Counter()
+        self.waits = Counter()
+        self.waited = defaultdict(float)
+        self._file = None
+        self._lock = threading.Lock()
+        self._last_headroom = None
+
+    def _open(self):
+        if self._file is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            f = open(self.path, 'a+b') # creates it without truncating another process' state
+            f.close()
+            self._file = open(self.path, 'r+b')
+        return self._file
+
+    def _update(self, fn):
+        ''' Run fn(tokens, total, now) -> (tokens, total, result) on the refilled state under both locks '''
+        with self._lock:
+            f = self._open()
+            _lock(f)
+            try:
+                f.seek(0)
+                raw = f.read(_STATE.size)
+                now = self.clock()
+                if len(raw) < _STATE.size:
+                    tokens, updated, total = self.capacity, now, 0.0
+                else:
+                    tokens, updated, total = _STATE.unpack(raw)
+                tokens = min(self.capacity, tokens + max(now - updated, 0.0) * self.rate)
+                tokens, total, result = fn(tokens, total, now)
+                f.seek(0)
+                f.write(_STATE.pack(tokens, now, total))
+                f.flush()
+                return result
+            finally:
+                _unlock(f)
+
+    def try_acquire(self, priority='account', weight=1.0):
+        ''' Take weight now if the priority reserve allows, else return the seconds to wait before retrying '''
+        need = weight + self.reserve.get(priority, 0.0) * self.capacity
+
+        def take(tokens, total, now):
+            if tokens >= need:
+                return tokens - weight, total + weight, 0.0
+            return tokens, total, (need - tokens) / self.rate
+        return self._update(take)
+
+    def acquire(self, priority='account', weight=1.0):
+        ''' Block until granted, returns the seconds waited '''
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(priority, weight)
+            if wait <= 0:
+                break
+            self.sleep(wait)
+            waited += wait
+        self.granted[priority] += 1
+        if waited:
+            self.waits[priority] += 1
+            self.waited[priority] += waited
+            if self.metrics is not None:
+                self.metrics.inc('rate_limit_waits_total', 'priority', priority)
+                self.metrics.inc('rate_limit_wait_seconds_total', 'priority', priority, waited)
+                self.metrics.observe('rate_limit_wait_seconds', 'priority', priority, waited)
+                self.metrics.add_stage('rate_limit_wait', waited)
+        return waited
+
+    def weight(self, path):
+        for prefix, w in self.weights.items():
+            if path.startswith(prefix):
+                return w
+        return 1.0
+
+    def install(self, exchange):
+        ''' Every REST call of exchange pays the shared budget first, ccxt's own flat per-request delay is switched off '''
+        original_fetch = exchange.fetch
+
+        def fetch(url, method='GET', headers=None, body=None):
+            path = urlparse(url).path
+            self.acquire(classify(method, path), self.weight(path))
+            return original_fetch(url, method, headers, body)
+        exchange.fetch = fetch
+        exchange.enableRateLimit = False
+        return exchange
+
+    def headroom(self, calls_per_unit=None, unit_seconds=60.0, poll_calls_per_unit=0.0):
+        ''' Tokens left, weight per second used by all processes since the last call, and how many more units
+            (symbols / subaccounts) making calls_per_unit requests every unit_seconds, plus poll_calls_per_unit
+            from background polling such as the risk monitor, still fit in the budget '''
+        tokens, total, now = self._update(lambda tokens, total, now: (tokens, total, (tokens, total, now)))
+        report = {'rate': self.rate, 'tokens': tokens, 'used_per_second': None, 'utilization': None, 'fits': None}
+        if self._last_headroom is not None:
+            prev_total, prev_now = self._last_headroom
+            if now > prev_now:
+                used = (total - prev_total) / (now - prev_now)
+                report['used_per_second'] = used
+                report['utilization'] = used / self.rate
+                cost = (calls_per_unit or 0.0) + poll_calls_per_unit
+                if cost:
+                    report['fits'] = int(max(self.rate - used, 0.0) * unit_seconds / cost)
+        self._last_headroom = (total, now)
+        report['waits'] = dict(self.waits)
+        report['waited_seconds'] = {k: round(v, 3) for k, v in self.waited.items()}
+        return report
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,77 @@
+# ===============================================================================================================
+# Trade records
+# Slotted Fill / Position / ClosedTrade used on the order path, DataFrames only at the journal and reporting edge
+# ===============================================================================================================
+from dataclasses import dataclass
+
+import pandas as pd
+
+@dataclass(slots=True)
+class Fill:
+    ''' One market order summed over its fills, the aggregate_fills() / summarize_order() layout '''
+    symbol: str
+    timestamp: float
+    side: str
+    price: float
+    amount: float
+    cost: float
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['symbol'], d['timestamp'], d['side'], float(d['price']), float(d['amount']), float(d['cost']))
+
+    def to_dict(self):
+        return {'symbol': self.symbol, 'timestamp': self.timestamp, 'side': self.side,
+                'price': self.price, 'amount': self.amount, 'cost': self.cost}
+
+@dataclass(slots=True)
+class Position:
+    ''' Open position with its stop loss and take profit, 0.0 means not set '''
+    symbol: str
+    timestamp: float
+    side: str
+    price: float
+    amount: float
+    cost: float
+    stop_loss: float = 0.0
+    take_profit: float = 0.0
+
+    @classmethod
+    def from_dict(cls, d):
+        ''' From a journal row, None stop loss / take profit read back as not set '''
+        return cls(d['symbol'], d['timestamp'], d['side'], float(d['price']), float(d['amount']), float(d['cost']),
+                   float(d.get('stop_loss') or 0.0), float(d.get('take_profit') or 0.0))
+
+    def to_dict(self):
+        return {'symbol': self.symbol, 'timestamp': self.timestamp, 'side': self.side, 'price': self.price,
+                'amount': self.amount, 'cost': self.cost, 'stop_loss': self.stop_loss, 'take_profit': self.take_profit}
+
+@dataclass(slots=True)
+class ClosedTrade:
+    ''' Entry position and the fill that closed it, PnL is the cost difference in the entry direction '''
+    entry: Position
+    exit: Fill
+
+    @property
+    def sign(self):
+        return 1.0 if self.entry.side == 'buy' else -1.0
+
+    @property
+    def diff_price(self):
+        return (self.exit.price - self.entry.price) * self.sign
+
+    @property
+    def pnl(self):
+        return (self.exit.cost - self.entry.cost) * self.sign
+
+    def to_dict(self):
+        ''' Flat row in the journal TRADE_COLUMNS layout '''
+        row = self.entry.to_dict()
+        exit = self.exit
+        row.update(timestamp_exit=exit.timestamp, side_exit=exit.side, price_exit=exit.price, amount_exit=exit.amount,
+                   cost_exit=exit.cost, diff_price=self.diff_price, pnl=self.pnl)
+        return row
+
+def to_frame(records):
+    ''' Records to a DataFrame for persistence or reports, one row each '''
+    return pd.DataFrame([r.to_dict() for r in records])
@@ -0,0 +1,160 @@
+# ===============================================================================================================
+# Replay simulator
+# Drives the real trading() bar by bar over recorded candles, and the risk monitor along each bar's OHLC path,
+# on a simulated clock against MockFTX, and returns a per-bar decision trace and the PnL ledger of closed trades
+# ===============================================================================================================
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from candle_store import CandleStore
+from mock_exchange import MockFTX, load_bot
+
+# Lines trading() and the risk monitor's exit print when they act, in the order they can print them within one bar
+DECISION_MARKERS = ('Exit Long', 'Exit Short', 'TAKE PROFIT Long', 'TAKE PROFIT Short', 'STOPLOSS Long', 'STOPLOSS Short',
+                    'Open Long', 'Open Short')
+
+class Replay:
+    ''' One bot module per replay: its journal, checkpoint, candle store and metrics live in workdir.
+        With intrabar the risk monitor is checked at each bar's open, high, low and close before the bar closes '''
+
+    def __init__(self, bars, workdir=None, cash=10_000.0, fee_rate=0.0007, spread=0.5, bot=None, intrabar=True, **mock_kw):
+        self.bars = np.asarray(bars, dtype=np.float64)
+        self.intrabar = intrabar
+        self.workdir = workdir or tempfile.mkdtemp(prefix='replay_')
+        os.makedirs(self.workdir, exist_ok=True)
+        self.bot = bot or load_bot()
+        self.mock = MockFTX(self.bars, symbol=self.bot.robot_symbol, timeframe=self.bot.robot_timeframe, cash=cash,
+                            fee_rate=fee_rate, spread=spread, now_ms=int(self.bars[0, 0]), **mock_kw)
+        self._isolate()
+        self.trace = []
+
+    def _isolate(self):
+        ''' Point every file the bot writes into workdir and replace real sleeps with the simulated clock '''
+        bot = self.bot
+        bot.log_journal = os.path.join(self.workdir, 'trades.db')
+        bot.log_checkpoint = os.path.join(self.workdir, 'checkpoint.pkl')
+        bot.log_fills = os.path.join(self.workdir, 'fills.db')
+        bot.rate_budget.path = os.path.join(self.workdir, 'ratelimit.bin')
+        bot.candle_store = CandleStore(os.path.join(self.workdir, 'candles'))
+        bot.metrics.jsonl_path = os.path.join(self.workdir, 'log_metrics.jsonl')
+        bot.metrics.prom_path = None
+        bot.retry_policy.sleep = self._sleep
+        bot.price_retry_policy.sleep = self._sleep
+        bot.fill_tracker.sleep = self._sleep
+        bot.use_exchange(self.mock)
+        self.mock.sleep = self._sleep
+
+    def _sleep(self, seconds):
+        self.mock.now_ms += int(seconds * 1000)
+
+    def path(self, bar):
+        ''' (ms, price) points the risk monitor sees within bar: open, the nearer extreme, the other one, close '''
+        ts, open_, high, low, close = bar[:5]
+        prices = (open_, low, high, close) if close >= open_ else (open_, high, low, close)
+        return [(int(ts) + k * self.mock.tf_ms // 4, float(p)) for k, p in enumerate(prices)]
+
+    def walk(self, bar):
+        ''' Run risk monitor checks along the path of bar, each one fills at its point. Returns the exit reason '''
+        mock, monitor = self.mock, self.bot.risk_monitor
+        try:
+            for ts, price in self.path(bar):
+                mock.now_ms, mock.mark = ts, price
+                reason = monitor.check()
+                if reason is not None:
+                    return reason
+        finally:
+            mock.mark = None
+        return None
+
+    def step(self, i):
+        ''' Bar i-1 trades through its path under the risk monitor, then closes: the exchange clock moves to the
+            open of bar i and the bot runs its bar-close path '''
+        bot, mock = self.bot, self.mock
+        fills_before = len(mock.trades)
+        position_before = mock.net_size
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            intrabar = self.walk(self.bars[i - 1]) if self.intrabar else None
+            mock.now_ms = int(self.bars[i, 0])
+            bot.confirm_bar_closed(bot.robot_timeframe, mock.now_ms)
+            bot.on_bar_close(bot.robot_timeframe, mock.now_ms - mock.tf_ms)
+        printed = out.getvalue()
+        state = bot.indicator_state
+        long_entry, long_exit, short_entry, short_exit = state.signals() if state.last_ts is not None else (False,) * 4
+        last_price = float(self.bars[i - 1, 4])
+        self.trace.append({
+            'timestamp': pd.Timestamp(int(self.bars[i - 1, 0]), unit='ms'), 'close': last_price,
+            'ema1': state.ema1, 'ema2': state.ema2, 'vol': state.vol,
+            'LongEntries': bool(long_entry), 'LongExit': bool(long_exit), 'ShortEntries': bool(short_entry), 'ShortExit': bool(short_exit),
+            'position_before': position_before, 'position_after': mock.net_size,
+            'intrabar': intrabar,
+            'decision': ', '.join(m for m in DECISION_MARKERS if m in printed) or None,
+            'fills': len(mock.trades) - fills_before,
+            'equity': mock.collateral + (last_price - mock.avg_price) * mock.net_size,
+        })
+
+    def run(self, start=None, end=None, quiet=True):
+        ''' Replay bars[start:end], start defaults to the first bar with a full candle window behind it '''
+        start = start if start is not None else self.bot.robot_max_candles
+        end = end if end is not None else len(self.bars)
+        if quiet:
+            logger.disable('')
+        try:
+            t0 = time.perf_counter()
+            with pd.option_context('display.max_columns', 20): # fixed width, skips measuring the terminal on every print(df)
+                for i in range(start, end):
+                    self.step(i)
+            self.seconds = time.perf_counter() - t0
+        finally:
+            if quiet:
+                logger.enable('')
+        self.bars_per_second = (end - start) / self.seconds if self.seconds else float('inf')
+        return self.decisions(), self.ledger()
+
+    def decisions(self):
+        return pd.DataFrame(self.trace)
+
+    def ledger(self):
+        ''' Closed trades as save_trades() journaled them, with running PnL and the exchange-side fee estimate '''
+        with contextlib.redirect_stdout(io.StringIO()): # the journal read prints, like every bot call step() makes
+            ledger = self.bot.read_log_history(self.bot.robot_symbol) if self.trace else pd.DataFrame()
+        if not ledger.empty:
+            ledger['fees'] = (ledger['cost'].abs() + ledger['cost_exit'].abs()) * self.mock.fee_rate
+            ledger['cum_pnl'] = (ledger['pnl'] - ledger['fees']).cumsum()
+        return ledger
+
+if __name__ == '__main__':
+    import argparse
+    from mock_exchange import synthetic_candles
+    parser = argparse.ArgumentParser(description='Replay recorded candles through trading() on a simulated clock')
+    parser.add_argument('--timeframe', default='1m')
+    parser.add_argument('--root', default='candles', help='candle store to replay from')
+    parser.add_argument('--days', type=float, default=30, help='most recent days of the store to replay')
+    parser.add_argument('--synthetic', type=int, default=0, help='replay this many random-walk bars instead of the store')
+    parser.add_argument('--out', default='replay', help='prefix of the <out>_decisions.csv / <out>_ledger.csv files')
+    parser.add_argument('--no-intrabar', action='store_true', help='skip the risk monitor, exits only at bar close')
+    args = parser.parse_args()
+    bot = load_bot() # replays the bot's own robot_symbol, the one its orders and journal use
+    if args.synthetic:
+        bars = synthetic_candles(args.synthetic, timeframe=args.timeframe)
+    else:
+        store = CandleStore(args.root)
+        last = store.last_ts(bot.robot_symbol, args.timeframe)
+        if last is None:
+            raise SystemExit(f'No {bot.robot_symbol} {args.timeframe} candles in {args.root}, run candle_store.py first')
+        bars = np.array(store.read(bot.robot_symbol, args.timeframe, start=last - args.days * 86_400_000))
+    replay = Replay(bars, bot=bot, intrabar=not args.no_intrabar)
+    decisions, ledger = replay.run()
+    decisions.to_csv(f'{args.out}_decisions.csv', index=False)
+    ledger.to_csv(f'{args.out}_ledger.csv', index=False)
+    acted = decisions['decision'].notna().sum()
+    pnl = ledger['cum_pnl'].iloc[-1] if not ledger.empty else 0.0
+    print(f'{len(decisions)} bars in {replay.seconds:.1f}s ({replay.bars_per_second:.0f} bars/s), '
+          f'{acted} decisions ({decisions["intrabar"].notna().sum()} intrabar), {len(ledger)} closed trades, net PnL {pnl:.2f}, equity {decisions["equity"].iloc[-1]:.2f}')
@@ -0,0 +1,131 @@
+# ===============================================================================================================
+# Multi-timeframe resampler
+# Every higher timeframe is built incrementally from one closed 1m bar stream, bucketed on epoch-aligned
+# boundaries like the exchange's own candles, with a closed-bar event per timeframe
+# ===============================================================================================================
+import numpy as np
+import pandas as pd
+
+from candles import OHLCV_COLUMNS, CandleBuffer, timeframe_to_ms
+
+class Resampler:
+    ''' update(base_bars) folds closed base bars into the forming bar of each timeframe. A bar closes with the base
+        bar that ends on its boundary, or, when the feed skipped that one, with the first base bar of a later bucket.
+        Each timeframe keeps its last capacity closed bars '''
+
+    def __init__(self, timeframes, base='1m', capacity=100):
+        self.base = base
+        self.base_ms = timeframe_to_ms(base)
+        self.capacity = int(capacity)
+        self.tf_ms = {}
+        for tf in dict.fromkeys(timeframes):
+            tf_ms = timeframe_to_ms(tf)
+            if tf_ms % self.base_ms:
+                raise ValueError(f'{tf} is not a multiple of the {base} base timeframe')
+            self.tf_ms[tf] = tf_ms
+        self.listeners = []
+        self.reset()
+
+    def reset(self):
+        self.buffers = {tf: CandleBuffer(self.capacity, tf) for tf in self.tf_ms} # closed bars only
+        self.forming = {tf: None for tf in self.tf_ms}
+        self.last_ts = None # newest base bar folded in
+        self._frames = {} # frame() per timeframe until its next closed bar
+
+    @property
+    def timeframes(self):
+        return list(self.tf_ms)
+
+    def base_bars_needed(self):
+        ''' Base bars that still fill capacity closed bars of every timeframe after seed() cuts the start to a boundary '''
+        return (self.capacity + 1) * max(self.tf_ms.values()) // self.base_ms - 1
+
+    def on_close(self, callback):
+        ''' callback(timeframe, bar) on every closed bar, bar is [timestamp, open, high, low, close, volume] '''
+        self.listeners.append(callback)
+        return callback
+
+    def seed(self, base_bars):
+        ''' Rebuild every timeframe from a window of base bars, no events are sent for the history.
+            The window is cut to start on a boundary of the longest timeframe, so no first bar is a partial bucket '''
+        base_bars = np.asarray(base_bars, dtype=np.float64).reshape(-1, 6)
+        aligned = np.nonzero(base_bars[:, 0] % max(self.tf_ms.values()) == 0)[0]
+        listeners, self.listeners = self.listeners, []
+        try:
+            self.reset()
+            self.update(base_bars[aligned[0]:] if len(aligned) else base_bars[:0])
+        finally:
+            self.listeners = listeners
+
+    def update(self, base_bars):
+        ''' Fold in closed base bars newer than last_ts, returns the (timeframe, bar) closes in order '''
+        events = []
+        for row in np.asarray(base_bars, dtype=np.float64).reshape(-1, 6):
+            ts = int(row[0])
+            if self.last_ts is not None and ts <= self.last_ts:
+                continue
+            self.last_ts = ts
+            for tf, tf_ms in self.tf_ms.items():
+                start = ts - ts % tf_ms
+                bar = self.forming[tf]
+                if bar is not None and bar[0] != start: # feed skipped the end of that bucket
+                    events.append(self._close(tf, bar))
+                    bar = None
+                if bar is None:
+                    bar = row.copy()
+                    bar[0] = start
+                else:
+                    bar[2] = max(bar[2], row[2])
+                    bar[3] = min(bar[3], row[3])
+                    bar[4] = row[4]
+                    bar[5] += row[5]
+                if ts + self.base_ms >= start + tf_ms: # last base bar of the bucket
+                    events.append(self._close(tf, bar))
+                    bar = None
+                self.forming[tf] = bar
+        return events
+
+    def _close(self, tf, bar):
+        self._frames.pop(tf, None)
+        buffer = self.buffers[tf]
+        if not buffer.update([bar]): # whole buckets missing, restart the run of consecutive bars
+            buffer.seed(np.vstack([buffer.to_array(closed_only=False), bar]))
+        for callback in self.listeners:
+            callback(tf, bar)
+        return tf, bar
+
+    def to_array(self, timeframe):
+        return self.buffers[timeframe].to_array(closed_only=False)
+
+    def frame(self, timeframe):
+        ''' Closed bars of timeframe in the fetch_data() DataFrame layout. Built once per closed bar and shared
+            by every caller until the next one, so treat it as read-only '''
+        df = self._frames.get(timeframe)
+        if df is None:
+            bars = self.to_array(timeframe)
+            columns = {'timestamp': bars[:, 0].astype(np.int64).astype('datetime64[ms]')} # one construction, no column rewrite
+            columns.update((col, bars[:, i]) for i, col in enumerate(OHLCV_COLUMNS[1:], 1))
+            df = self._frames[timeframe] = pd.DataFrame(columns)
+        return df
+
+def verify_against_pandas(base_bars, timeframes, base='1m'):
+    ''' Resample base_bars one bar at a time and compare every closed bar with pandas resample on the same epoch grid '''
+    base_bars = np.asarray(base_bars, dtype=np.float64)
+    resampler = Resampler(timeframes, base, capacity=len(base_bars))
+    for row in base_bars:
+        resampler.update(row)
+    df = pd.DataFrame(base_bars, columns=OHLCV_COLUMNS)
+    df.index = pd.to_datetime(df['timestamp'].astype('int64'), unit='ms')
+    ok = True
+    for tf in resampler.timeframes:
+        expected = df.resample(f'{resampler.tf_ms[tf] // 60_000}min', origin='epoch').agg(
+            {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'}).dropna()
+        last_end = (int(base_bars[-1, 0]) + resampler.base_ms) // resampler.tf_ms[tf] * resampler.tf_ms[tf]
+        expected = expected[expected.index < pd.to_datetime(last_end, unit='ms')] # closed buckets only
+        got = resampler.to_array(tf)
+        same = len(got) == len(expected) and np.array_equal(got[:, 0], (expected.index - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1)) \
+            and np.allclose(got[:, 1:], expected.to_numpy())
+        if not same:
+            print(f'{tf} mismatch, {len(got)} bars resampled, {len(expected)} expected')
+        ok &= same
+    return ok
@@ -0,0 +1,140 @@
+# ===============================================================================================================
+# Retry policy
+# Exponential backoff with jitter, bar-aligned deadlines and a per-endpoint circuit breaker for exchange calls
+# ===============================================================================================================
+import asyncio
+import random
+import time
+from collections import Counter
+
+class CircuitOpenError(Exception):
+    ''' Raised instead of calling an endpoint whose circuit breaker is open '''
+
+class RetryBudgetExceeded(Exception):
+    ''' Raised when the next backoff would pass the call deadline '''
+
+def is_retryable(error):
+    ''' Network trouble, timeouts, rate limits and maintenance are retryable. Anything the exchange
+        rejected on purpose (auth, insufficient funds, invalid order, bad symbol) is fatal '''
+    import ccxt # deferred, ccxt is slow to import and only needed once something failed
+    return isinstance(error, ccxt.NetworkError)
+
+def next_bar_deadline(tf_ms, margin=1.0, clock=time.monotonic, wall=time.time):
+    ''' Monotonic deadline `margin` seconds before the current bar closes '''
+    now_ms = wall() * 1000
+    remaining = (tf_ms - now_ms % tf_ms) / 1000
+    return clock() + max(remaining - margin, 0.0)
+
+class CircuitBreaker:
+    ''' Opens after `threshold` consecutive retryable failures, lets one trial call through after `cooldown` seconds '''
+
+    def __init__(self, threshold=5, cooldown=30.0, clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.cooldown:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        return self.state != 'open'
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold or self.state == 'half-open':
+            self.opened_at = self.clock()
+
+class RetryPolicy:
+    ''' Every exchange access goes through call(), which retries retryable errors until attempts or deadline run out '''
+
+    def __init__(self, max_attempts=5, base_delay=0.25, max_delay=8.0, breaker_threshold=5, breaker_cooldown=30.0,
+                 sleep=time.sleep, clock=time.monotonic):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.sleep = sleep
+        self.clock = clock
+        self.breakers = {}
+        self.retries = Counter() # retries spent in the current cycle by endpoint
+        self.waited = 0.0 # seconds slept in backoff in the current cycle
+
+    def breaker(self, endpoint):
+        if endpoint not in self.breakers:
+            self.breakers[endpoint] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown, self.clock)
+        return self.breakers[endpoint]
+
+    def backoff(self, attempt):
+        ''' Full jitter: uniform between 0 and base * 2^attempt, capped at max_delay '''
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, endpoint, fn, *args, deadline=None, max_attempts=None, **kwargs):
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            raise CircuitOpenError(f'{endpoint} circuit open after {breaker.failures} failures')
+        attempts = max_attempts or self.max_attempts
+        attempt = 0
+        while True:
+            try:
+                result = fn(*args, **kwargs)
+                breaker.success()
+                return result
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                breaker.failure()
+                attempt += 1
+                if attempt >= attempts or not breaker.allow():
+                    raise
+                delay = self.backoff(attempt - 1)
+                if deadline is not None and self.clock() + delay > deadline:
+                    raise RetryBudgetExceeded(f'{endpoint} deadline reached after {attempt} attempts: {e}') from e
+                self.retries[endpoint] += 1
+                self.waited += delay
+                self.sleep(delay)
+
+    async def acall(self, endpoint, fn, *args, deadline=None, max_attempts=None, **kwargs):
+        ''' call() for coroutine functions, backoff waits with asyncio.sleep and shares the same breakers '''
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            raise CircuitOpenError(f'{endpoint} circuit open after {breaker.failures} failures')
+        attempts = max_attempts or self.max_attempts
+        attempt = 0
+        while True:
+            try:
+                result = await fn(*args, **kwargs)
+                breaker.success()
+                return result
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                breaker.failure()
+                attempt += 1
+                if attempt >= attempts or not breaker.allow():
+                    raise
+                delay = self.backoff(attempt - 1)
+                if deadline is not None and self.clock() + delay > deadline:
+                    raise RetryBudgetExceeded(f'{endpoint} deadline reached after {attempt} attempts: {e}') from e
+                self.retries[endpoint] += 1
+                self.waited += delay
+                await asyncio.sleep(delay)
+
+    def start_cycle(self):
+        self.retries = Counter()
+        self.waited = 0.0
+
+    def cycle_summary(self):
+        return {'retries': dict(self.retries), 'backoff_seconds': round(self.waited, 3),
+                'open_circuits': [k for k, b in self.breakers.items() if b.state == 'open']}
@@ -0,0 +1,95 @@
+# ===============================================================================================================
+# Intrabar risk monitor
+# Watches the live price between bar closes and exits as soon as the stop loss or take profit is crossed
+# ===============================================================================================================
+import contextlib
+import threading
+import time
+from collections import deque
+
+from loguru import logger
+
+def crossed(position, price):
+    ''' 'STOPLOSS' / 'TAKE PROFIT' if price is through a level of position, else None. 0.0 levels are not set.
+        Both levels are checked, unlike the per-bar elif chain where a matching TP branch hides the SL '''
+    long = position.side == 'buy'
+    if position.stop_loss and (price <= position.stop_loss if long else price >= position.stop_loss):
+        return 'STOPLOSS'
+    if position.take_profit and (price >= position.take_profit if long else price <= position.take_profit):
+        return 'TAKE PROFIT'
+    return None
+
+class RiskMonitor:
+    ''' Poll price() every poll seconds on a daemon thread, call exit(reason, price, position) once a level of
+        position() is crossed. The per-bar loop is untouched, position() is read under lock and exit() is expected
+        to take the same lock trading() runs under. Price polls are counted per cycle, like RestCallCounter '''
+
+    def __init__(self, price, position, exit, poll=1.0, clock=time.perf_counter, lock=None):
+        self.price = price # latest traded price, None when it cannot be fetched
+        self.position = position # open position with side / stop_loss / take_profit, None when flat
+        self.exit = exit
+        self.poll = poll
+        self.clock = clock
+        self.lock = lock or contextlib.nullcontext()
+        self.reactions = deque(maxlen=1000) # (reason, price, seconds from price fetched to exit done)
+        self.checks = 0 # price polls in the current cycle
+        self.total_checks = 0
+        self.cycles = 0
+        self._count_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def end_cycle(self):
+        ''' Price polls since the previous call, every one of them is a REST request '''
+        with self._count_lock:
+            checks, self.checks = self.checks, 0
+            self.total_checks += checks
+            self.cycles += 1
+        return checks
+
+    def average_per_cycle(self):
+        if self.cycles == 0:
+            return 0.0
+        return self.total_checks / self.cycles
+
+    def check(self):
+        ''' One poll, returns the exit reason if it fired '''
+        with self.lock:
+            position = self.position()
+        if position is None:
+            return None
+        t0 = self.clock()
+        price = self.price()
+        with self._count_lock:
+            self.checks += 1
+        if price is None:
+            return None
+        reason = crossed(position, price)
+        if reason is None:
+            return None
+        logger.info(f'{reason} crossed intrabar at {price}, position {position.side} SL {position.stop_loss} TP {position.take_profit}')
+        self.exit(reason, price, position)
+        elapsed = self.clock() - t0
+        self.reactions.append((reason, price, elapsed))
+        logger.info(f'{reason} exit done in {elapsed*1000:.0f}ms')
+        return reason
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                logger.exception(f'Risk monitor check failed : {e}')
+            self._stop.wait(self.poll) # returns at once on stop()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='risk-monitor', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,101 @@
+# ===============================================================================================================
+# Bar-close scheduler
+# Fires jobs as soon as the exchange confirms a candle closed, on exchange time instead of local wall-clock
+# ===============================================================================================================
+import time
+from collections import deque
+
+from loguru import logger
+
+from candles import timeframe_to_ms
+
+def exchange_time_ms(exchange, symbol='BTC-PERP'):
+    ''' Server time in ms, from fetch_time when supported, else the timestamp of a fresh ticker '''
+    if exchange.has.get('fetchTime'):
+        return int(exchange.fetch_time())
+    return int(exchange.fetch_ticker(symbol)['timestamp'])
+
+class BarScheduler:
+    ''' Runs callback(timeframe, bar_ts) once per closed bar of every registered timeframe.
+        confirm(timeframe, boundary_ms) is polled after the boundary until it reports the bar closed '''
+
+    def __init__(self, server_time=None, resync_every=1800, poll=0.25, max_wait=20.0, sleep=time.sleep, wall=time.time):
+        self.server_time = server_time # callable returning exchange time in ms, None to trust the local clock
+        self.resync_every = resync_every
+        self.poll = poll
+        self.max_wait = max_wait
+        self.sleep = sleep
+        self.wall = wall
+        self.offset_ms = 0.0
+        self.rtt_ms = 0.0
+        self._synced_at = None
+        self.jobs = []
+        self.lags = {} # timeframe -> deque of (bar_ts, confirm_lag_ms, decision_lag_ms)
+
+    def sync_clock(self):
+        ''' Offset between exchange and local clock, measured at the midpoint of the request '''
+        if self.server_time is None:
+            return 0.0
+        t0 = self.wall() * 1000
+        try:
+            server_ms = self.server_time()
+        except Exception as e:
+            server_ms = None
+            logger.debug(f'Clock sync failed : {type(e).__name__} {e}')
+        if server_ms is None:
+            logger.debug(f'Clock sync failed, keep offset {self.offset_ms:.0f}ms')
+            self._synced_at = t0
+            return self.offset_ms
+        t1 = self.wall() * 1000
+        self.rtt_ms = t1 - t0
+        self.offset_ms = server_ms - (t0 + t1) / 2
+        self._synced_at = t1
+        logger.info(f'Clock synced, offset {self.offset_ms:.0f}ms, rtt {self.rtt_ms:.0f}ms')
+        return self.offset_ms
+
+    def now_ms(self):
+        return self.wall() * 1000 + self.offset_ms
+
+    def every(self, timeframe, callback, confirm=None):
+        tf_ms = timeframe_to_ms(timeframe)
+        self.jobs.append({'timeframe': timeframe, 'tf_ms': tf_ms, 'callback': callback, 'confirm': confirm,
+                          'last_fired': (int(self.now_ms()) // tf_ms) * tf_ms})
+        self.lags.setdefault(timeframe, deque(maxlen=10_000))
+        return self
+
+    def next_boundary(self):
+        now = self.now_ms()
+        return min((int(now) // job['tf_ms'] + 1) * job['tf_ms'] for job in self.jobs)
+
+    def run_pending(self):
+        ''' Fire every job whose bar has closed since it last fired, the latest boundary only '''
+        now = self.now_ms()
+        for job in self.jobs:
+            boundary = (int(now) // job['tf_ms']) * job['tf_ms']
+            if boundary <= job['last_fired']:
+                continue
+            job['last_fired'] = boundary # never fire the same bar twice, even if confirmation times out
+            if job['confirm'] is not None:
+                while not job['confirm'](job['timeframe'], boundary):
+                    if self.now_ms() - boundary > self.max_wait * 1000:
+                        logger.debug(f'{job["timeframe"]} bar {boundary} not confirmed after {self.max_wait}s')
+                        break
+                    self.sleep(self.poll)
+            confirmed = self.now_ms()
+            try:
+                job['callback'](job['timeframe'], boundary - job['tf_ms'])
+            except Exception as e:
+                logger.exception(f'{job["timeframe"]} job failed : {e}')
+            decided = self.now_ms()
+            self.lags[job['timeframe']].append((boundary - job['tf_ms'], confirmed - boundary, decided - boundary))
+            logger.info(f'{job["timeframe"]} bar close -> confirmed {confirmed - boundary:.0f}ms, decision {decided - boundary:.0f}ms')
+
+    def run_forever(self):
+        self.sync_clock()
+        while True:
+            if self.server_time is not None and self.wall() * 1000 - self._synced_at > self.resync_every * 1000:
+                self.sync_clock()
+            wait = (self.next_boundary() - self.now_ms()) / 1000
+            if wait > 0:
+                self.sleep(wait)
+            self.run_pending()
@@ -0,0 +1,134 @@
+# ===============================================================================================================
+# Trade history mirror
+# Local SQLite copy of the account's fills, synced incrementally from a stored cursor, so entry timestamps
+# and order fill lookups are indexed local queries instead of full fetch_my_trades downloads
+# ===============================================================================================================
+import sqlite3
+import time
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS fills (
+    id TEXT PRIMARY KEY,
+    order_id TEXT, symbol TEXT NOT NULL, side TEXT, timestamp INTEGER NOT NULL,
+    price REAL, amount REAL, cost REAL, fee REAL
+);
+CREATE INDEX IF NOT EXISTS fills_symbol_ts ON fills (symbol, timestamp);
+CREATE INDEX IF NOT EXISTS fills_symbol_side_ts ON fills (symbol, side, timestamp);
+CREATE INDEX IF NOT EXISTS fills_order ON fills (order_id);
+CREATE TABLE IF NOT EXISTS sync_cursor (
+    symbol TEXT PRIMARY KEY, last_ts INTEGER NOT NULL, synced_at REAL NOT NULL
+);
+'''
+COLUMNS = ['id', 'order_id', 'symbol', 'side', 'timestamp', 'price', 'amount', 'cost', 'fee']
+
+def _row(t, symbol):
+    ''' ccxt trade -> fills row keyed on symbol as the caller queries it (ccxt's unified t['symbol'] can differ,
+        e.g. BTC/USD:USD for BTC-PERP), an id is made up from order, time and amount if the exchange gives none '''
+    fee = (t.get('fee') or {}).get('cost')
+    tid = t.get('id') or f"{t.get('order')}-{t['timestamp']}-{t['amount']}"
+    cost = t.get('cost') if t.get('cost') is not None else float(t['amount']) * float(t['price'])
+    return (str(tid), None if t.get('order') is None else str(t['order']), symbol, t['side'], int(t['timestamp']),
+            float(t['price']), float(t['amount']), float(cost), fee)
+
+class TradeHistory:
+    ''' fills table plus one sync cursor per symbol, the newest fill timestamp already mirrored '''
+
+    def __init__(self, path='fills.db'):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def insert(self, trades, symbol):
+        ''' Add ccxt trades of symbol, already known ids are skipped. Returns rows added '''
+        rows = [_row(t, symbol) for t in trades]
+        if not rows:
+            return 0
+        before = self.conn.total_changes
+        with self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany(f'INSERT OR IGNORE INTO fills ({", ".join(COLUMNS)}) VALUES ({", ".join("?" * len(COLUMNS))})', rows)
+        return self.conn.total_changes - before
+
+    def cursor(self, symbol):
+        row = self.conn.execute('SELECT last_ts FROM sync_cursor WHERE symbol = ?', (symbol,)).fetchone()
+        return row[0] if row else None
+
+    def _set_cursor(self, symbol, last_ts):
+        self.conn.execute('INSERT INTO sync_cursor (symbol, last_ts, synced_at) VALUES (?, ?, ?) '
+                          'ON CONFLICT(symbol) DO UPDATE SET last_ts = MAX(last_ts, excluded.last_ts), synced_at = excluded.synced_at',
+                          (symbol, int(last_ts), time.time()))
+
+    def backfill(self, fetch_my_trades, symbol, since, page=200):
+        ''' Page fetch_my_trades(symbol, since=, limit=) forward from since (ms), move the cursor to the newest fill.
+            Pages restart at the last timestamp seen, fills sharing it are deduplicated by id. Returns rows added '''
+        added = 0
+        cursor = int(since)
+        while True:
+            trades = fetch_my_trades(symbol, since=cursor, limit=page)
+            if not trades:
+                break
+            added += self.insert(trades, symbol)
+            newest = max(int(t['timestamp']) for t in trades)
+            self._set_cursor(symbol, newest)
+            if len(trades) < page or newest <= cursor:
+                break
+            cursor = newest
+        return added
+
+    def sync(self, fetch_my_trades, symbol, page=200, first_since=None):
+        ''' Fetch only fills at or after the cursor. The first sync without first_since takes the exchange's
+            default recent window, older history comes from backfill() '''
+        cursor = self.cursor(symbol)
+        if cursor is None and first_since is None:
+            trades = fetch_my_trades(symbol)
+            added = self.insert(trades, symbol)
+            self._set_cursor(symbol, max((int(t['timestamp']) for t in trades), default=0))
+            return added
+        return self.backfill(fetch_my_trades, symbol, cursor if cursor is not None else first_since, page)
+
+    # ----- local queries -----------------------------------------------------------------------------------------
+    def trades(self, symbol, side=None, since=None, order_id=None):
+        ''' Mirrored fills as ccxt-style dicts, oldest first '''
+        where, args = ['symbol = ?'], [symbol]
+        for clause, value in (('side = ?', side), ('timestamp >= ?', since), ('order_id = ?', order_id)):
+            if value is not None:
+                where.append(clause)
+                args.append(value)
+        rows = self.conn.execute(f'SELECT {", ".join(COLUMNS)} FROM fills WHERE {" AND ".join(where)} ORDER BY timestamp', args)
+        return [{'id': r[0], 'order': r[1], 'symbol': r[2], 'side': r[3], 'timestamp': r[4], 'price': r[5],
+                 'amount': r[6], 'cost': r[7], 'fee': {'cost': r[8]}} for r in rows]
+
+    def order_fills(self, order_id, symbol):
+        return self.trades(symbol, order_id=str(order_id))
+
+    def last_ts(self, symbol, side=None):
+        ''' Newest fill timestamp (ms) of symbol, optionally of one side, None if there is none '''
+        if side is None:
+            row = self.conn.execute('SELECT MAX(timestamp) FROM fills WHERE symbol = ?', (symbol,)).fetchone()
+        else:
+            row = self.conn.execute('SELECT MAX(timestamp) FROM fills WHERE symbol = ? AND side = ?', (symbol, side)).fetchone()
+        return row[0]
+
+if __name__ == '__main__':
+    import argparse
+    import configparser
+    import ccxt
+    parser = argparse.ArgumentParser(description='Backfill the local trade history mirror from the exchange')
+    parser.add_argument('symbol')
+    parser.add_argument('--days', type=float, default=90)
+    parser.add_argument('--db', default='fills.db')
+    parser.add_argument('--subaccount', default='testAPI')
+    args = parser.parse_args()
+    config = configparser.ConfigParser()
+    config.read('key.ini')
+    exchange = ccxt.ftx({'apiKey': config['key']['apikey'], 'secret': config['key']['secretkey'], 'enableRateLimit': True})
+    exchange.headers = {'FTX-SUBACCOUNT': args.subaccount}
+    history = TradeHistory(args.db)
+    since = history.cursor(args.symbol) or int((time.time() - args.days * 86400) * 1000)
+    added = history.backfill(exchange.fetch_my_trades, args.symbol, since)
+    print(f'{args.symbol}: +{added} fills, cursor {history.cursor(args.symbol)}')